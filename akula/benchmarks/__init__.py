@@ -0,0 +1,3 @@
+from .synthetic_project import create_synthetic_project
+from .mc_engine import run_mc_engine_benchmarks
+from .sampling_modules import create_fixture_project, run_sampling_module_benchmarks
@@ -0,0 +1,150 @@
+import json
+import platform
+import os
+import shutil
+import numpy as np
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+
+from .synthetic_project import create_synthetic_project
+from ..monte_carlo import compute_consumption_lcia
+from ..qmc import CERTAIN_DISTRIBUTIONS, MATRIX_TYPES
+from ..utils import get_project_tag
+from ..instrumentation import instrument_run
+from ..sensitivity_analysis.variance_propagation import get_ecoinvent_lcia_resources
+from ..sensitivity_analysis.validation import create_masked_vector_datapackage
+from ..sensitivity_analysis.remove_lowly_influential import (
+    get_scores_local_sa_technosphere, get_scores_local_sa_biosphere, get_scores_local_sa_characterization,
+)
+from ..sensitivity_analysis.high_dimensional_screening import compute_consumption_lcia_screening
+
+BENCHMARK_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "benchmarks"
+
+# Numbers of activities of synthetic projects, the largest one has the size of ecoinvent 3.8
+SIZES = (2_000, 5_000, 20_000)
+SOLVERS = ("direct", "refactorize")
+
+PACKAGES = ["numpy", "scipy", "bw2calc", "bw2data", "bw_processing", "matrix_utils", "stats_arrays", "pypardiso"]
+
+
+def get_environment():
+    """Return versions of python and packages, and hardware information of this machine."""
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def get_random_masks(resources, fraction, seed=42):
+    """Select `fraction` of uncertain TECH, BIO and CF inputs at random, e.g. as inputs that vary in a reduced model."""
+    rng = np.random.default_rng(seed)
+    masks = {}
+    for matrix_type in MATRIX_TYPES:
+        uncertain = ~np.isin(resources[matrix_type]["distributions"]["uncertainty_type"], CERTAIN_DISTRIBUTIONS)
+        masks[matrix_type] = uncertain & (rng.random(len(uncertain)) < fraction)
+    return masks
+
+
+def get_project_statistics(resources):
+    dict_ = {}
+    for matrix_type in MATRIX_TYPES:
+        types = resources[matrix_type]["distributions"]["uncertainty_type"]
+        dict_[f"{matrix_type}_inputs"] = len(types)
+        dict_[f"{matrix_type}_uncertain_inputs"] = int((~np.isin(types, CERTAIN_DISTRIBUTIONS)).sum())
+    return dict_
+
+
+def get_cache_directory(project, stage):
+    """Return empty directory for cached results of the benchmark `stage` of `project`, so that it is timed cold."""
+    directory = BENCHMARK_DIR / "cache" / get_project_tag(project) / stage
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+    return directory
+
+
+def benchmark_local_sa(project, directory, factor=10, analytic=True):
+    """Compute local SA scores of all TECH, BIO and CF inputs with the wrappers of local SA, cached in `directory`."""
+    resources = get_ecoinvent_lcia_resources(project)
+    masks = {matrix_type: np.ones(len(resources[matrix_type]["indices"]), dtype=bool) for matrix_type in MATRIX_TYPES}
+    get_scores_local_sa_technosphere(masks["technosphere"], project, factor, "benchmark", analytic, directory)
+    get_scores_local_sa_biosphere(masks["biosphere"], project, factor, analytic, directory)
+    get_scores_local_sa_characterization(masks["characterization"], project, factor, analytic, directory)
+
+
+def benchmark_screening(project, masks, iterations, directory, seed=42, solver="direct"):
+    """Run MC simulations of high-dimensional screening for `masks`, with datapackages and scores in `directory`."""
+    return compute_consumption_lcia_screening(
+        project, None, None, None, None, iterations, seed, None, False, solver=solver, store_dir=directory / "scores",
+        masks=masks, directory=directory,
+    )
+
+
+def benchmark_validation(project, masks, iterations, seed=42, solver="woodbury"):
+    """Run MC simulations of a reduced model where only `masks`ed inputs vary, as in validation of masks."""
+    num_activities = project.split()[-1]
+    dp = create_masked_vector_datapackage(
+        project, ~masks["technosphere"], ~masks["biosphere"], ~masks["characterization"],
+        tag=f"benchmark.{num_activities}", directory=BENCHMARK_DIR,
+    )
+    return compute_consumption_lcia(project, iterations, seed, dp, solver=solver)
+
+
+def run_mc_engine_benchmarks(sizes=SIZES, iterations=100, seed=42, solvers=SOLVERS, fraction=0.05):
+    """
+    Time MC simulations, local SA, screening and validation of masks on synthetic projects with `sizes` activities.
+
+    Synthetic projects are created with `create_synthetic_project`, so no ecoinvent license is needed. Each stage is
+    instrumented, see `akula.instrumentation`, and the report with wall time per phase, iterations per second and peak
+    memory of all stages is written to a JSON file in `BENCHMARK_DIR`. Reduced models for screening and validation vary
+    a random `fraction` of uncertain inputs. Local SA and screening run through their public entry points, with caches
+    in an empty directory per project, so that changes of solvers and caching in these paths show up in the report.
+    """
+    BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    report = {
+        "benchmark": "mc_engine",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": get_environment(),
+        "settings": {"sizes": list(sizes), "iterations": iterations, "seed": seed, "fraction": fraction},
+        "results": [],
+    }
+
+    for size in sizes:
+        project = create_synthetic_project(size, seed)
+        resources = get_ecoinvent_lcia_resources(project)
+        masks = get_random_masks(resources, fraction, seed)
+        statistics = get_project_statistics(resources)
+
+        stages = {f"mc.{solver}": (compute_consumption_lcia, (project, iterations, seed), {"solver": solver})
+                  for solver in solvers}
+        stages["local_sa"] = (benchmark_local_sa, (project, get_cache_directory(project, "local_sa")), {})
+        stages["screening"] = (
+            benchmark_screening, (project, masks, iterations, get_cache_directory(project, "screening"), seed), {}
+        )
+        stages["validation"] = (benchmark_validation, (project, masks, iterations, seed), {})
+
+        for stage, (function, args, kwargs) in stages.items():
+            print(f"Benchmark {stage} with {size} activities")
+            with instrument_run(stage, BENCHMARK_DIR, size=size, iterations=iterations) as recorder:
+                function(*args, **kwargs)
+            result = dict(stage=stage, size=size, **statistics)
+            result.update(recorder.record)
+            report["results"].append(result)
+            print(f"    {result['wall_time']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    fp = BENCHMARK_DIR / f"report.mc_engine.{report['created'].replace(':', '-')}.json"
+    with open(fp, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Benchmark report written to {fp}")
+
+    return report
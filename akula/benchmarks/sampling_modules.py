@@ -0,0 +1,363 @@
+import json
+import multiprocessing
+import shutil
+import numpy as np
+import bw2data as bd
+import bw_processing as bwp
+import stats_arrays as sa
+from datetime import datetime
+from fs.zipfs import ZipFS
+
+from .mc_engine import BENCHMARK_DIR, get_environment
+from .synthetic_project import (
+    ECOINVENT_NAME, BIOSPHERE_NAME, FLOWS_PER_ACTIVITY, create_biosphere_data, create_ecoinvent_data, get_exchange,
+    get_uncertainty_dict,
+)
+from ..utils import read_pickle, write_pickle
+from ..instrumentation import instrument_run, get_current_rss, get_peak_rss
+from ..parameterization import generate_parameterization_datapackage
+from ..combustion import generate_combustion_datapackage
+from ..electricity import generate_entsoe_datapackage
+from ..markets import generate_markets_datapackage
+
+SAMPLING_MODULES_DIR = BENCHMARK_DIR / "sampling-modules"
+FIXTURE_DIR = SAMPLING_MODULES_DIR / "fixture"
+FIXTURE_PROJECT = "akula sampling modules fixture"
+
+NUM_SAMPLES = (100, 2_000, 20_000, 100_000)
+MODULES = ("parameterization", "combustion", "entsoe", "markets")
+
+# Numbers of activities of each kind in the fixture database, and of exchanges in the synthetic ENTSO timeseries
+FIXTURE_SIZES = {
+    "background": 2_000,
+    "combustion": 300,
+    "markets": 200,
+    "parameterized": 300,
+    "entsoe_markets": 90,
+    "entsoe_hours": 3 * 8760,
+}
+
+# Names of fuels as in `akula.combustion.get_liquid_fuels`, with their carbon content as mass fraction
+FUELS = {
+    "market for diesel": 0.86,
+    "diesel, low-sulfur": 0.86,
+    "market for petrol, unleaded": 0.85,
+    "petrol, unleaded": 0.85,
+}
+CO2_PER_CARBON = (12 + 16 * 2) / 12
+
+
+def get_fixture_paths():
+    return {
+        "raw_data": FIXTURE_DIR / "parameterization.raw-data.pickle",
+        "timeseries": FIXTURE_DIR / "entsoe-timeseries.zip",
+    }
+
+
+def get_production(key):
+    return {"input": key, "amount": 1.0, "type": "production"}
+
+
+def get_activity(name, reference_product, exchanges, location="GLO"):
+    return {
+        "name": name,
+        "reference product": reference_product,
+        "location": location,
+        "unit": "kilogram",
+        "type": "process",
+        "exchanges": exchanges,
+    }
+
+
+def create_fuel_data():
+    data = {}
+    for i, name in enumerate(FUELS):
+        key = (ECOINVENT_NAME, f"fuel-{i}")
+        data[key] = get_activity(name, name.split(",")[0].replace("market for ", ""), [get_production(key)])
+    return data
+
+
+def create_combustion_data(num_activities, num_background, rng):
+    """Create activities that burn fuels, whose fossil CO2 emissions are balanced with carbon in the fuels."""
+    fuels = list(FUELS)
+    data = {}
+    for j in range(num_activities):
+        key = (ECOINVENT_NAME, f"combustion-{j}")
+        exchanges = [get_production(key)]
+        carbon = 0
+        for i in rng.choice(len(fuels), rng.integers(1, 3), replace=False):
+            amount = rng.lognormal(-3, 1)
+            exchange = get_exchange(
+                (ECOINVENT_NAME, f"fuel-{i}"), amount, "technosphere", sa.LognormalUncertainty.id, rng,
+            )
+            exchange["properties"] = {"carbon content": {"amount": FUELS[fuels[i]]}}
+            exchanges.append(exchange)
+            carbon += exchange["amount"] * FUELS[fuels[i]]
+        background = rng.integers(num_background)
+        exchanges += [
+            get_exchange(
+                (ECOINVENT_NAME, f"activity-{background}"), rng.lognormal(-2, 1), "technosphere",
+                sa.LognormalUncertainty.id, rng,
+            ),
+            get_exchange(
+                (BIOSPHERE_NAME, "flow-0"), carbon * CO2_PER_CARBON, "biosphere", sa.LognormalUncertainty.id, rng,
+            ),
+        ]
+        data[key] = get_activity(f"fixture combustion {j}", f"fixture heat {j}", exchanges)
+    return data
+
+
+def create_market_data(num_markets, num_background, rng, max_inputs=6):
+    """Create markets with uncertain inputs from producers of the same product, whose amounts sum up to one."""
+    data = {}
+    for k in range(num_markets):
+        product = f"fixture product {k}"
+        key = (ECOINVENT_NAME, f"market-{k}")
+        exchanges = [get_production(key)]
+        num_inputs = rng.integers(2, max_inputs + 1)
+        for p, amount in enumerate(rng.dirichlet(np.ones(num_inputs))):
+            producer = (ECOINVENT_NAME, f"producer-{k}-{p}")
+            background = rng.integers(num_background)
+            data[producer] = get_activity(
+                f"fixture production {k}", product, [
+                    get_production(producer),
+                    get_exchange(
+                        (ECOINVENT_NAME, f"activity-{background}"), rng.lognormal(-2, 1), "technosphere",
+                        sa.LognormalUncertainty.id, rng,
+                    ),
+                ], location=f"L{p}",
+            )
+            exchanges.append(get_exchange(producer, amount, "technosphere", sa.LognormalUncertainty.id, rng))
+        data[key] = get_activity(f"market for {product}", product, exchanges)
+    return data
+
+
+def get_formula_exchange(exchange, parameters, rng):
+    """Make the amount of `exchange` a multiple of one of the `parameters`."""
+    parameter = parameters[rng.integers(len(parameters))]
+    coefficient = float(f"{exchange['amount'] / parameter['amount']:.6g}")
+    exchange.update({"amount": coefficient * parameter["amount"], "formula": f"{coefficient} * {parameter['name']}"})
+    exchange.update(get_uncertainty_dict(exchange["amount"], sa.NoUncertainty.id, rng))
+    return exchange
+
+
+def create_parameterized_data(num_activities, num_background, num_flows, rng):
+    """
+    Create activities with uncertain parameters and exchanges whose amounts are formulas of these parameters.
+
+    Returns data of bw2data activities, and raw data of the same activities in the format of
+    `akula.parameterization.get_ecoinvent_raw_data`, where biosphere exchanges refer to flows by their codes.
+    """
+    data, raw_data = {}, []
+    for j in range(num_activities):
+        key = (ECOINVENT_NAME, f"parameterized-{j}")
+        parameters = []
+        for m in range(rng.integers(1, 4)):
+            amount = float(rng.lognormal(0, 0.5))
+            parameter = {"name": f"share_{m}", "amount": amount}
+            parameter.update(get_uncertainty_dict(amount, sa.LognormalUncertainty.id, rng))
+            parameters.append(parameter)
+
+        inputs = np.unique(rng.integers(num_background, size=rng.integers(2, 6)))
+        flows = np.unique(rng.integers(num_flows, size=rng.integers(1, 4)))
+        exchanges = [get_production(key)]
+        exchanges += [
+            get_formula_exchange(
+                {"input": (ECOINVENT_NAME, f"activity-{i}"), "amount": rng.lognormal(-2, 1), "type": "technosphere"},
+                parameters, rng,
+            ) for i in inputs
+        ]
+        exchanges += [
+            get_formula_exchange(
+                {"input": (BIOSPHERE_NAME, f"flow-{i}"), "amount": rng.lognormal(-6, 2), "type": "biosphere"},
+                parameters, rng,
+            ) for i in flows
+        ]
+
+        data[key] = get_activity(f"fixture parameterized {j}", f"fixture output {j}", exchanges)
+        data[key]["parameters"] = parameters
+        raw_exchanges = [dict(exc) for exc in exchanges]
+        for exc in raw_exchanges:
+            if exc["type"] == "biosphere":
+                exc["flow"] = exc["input"][1]
+        raw_data.append({
+            "database": ECOINVENT_NAME,
+            "code": key[1],
+            "name": data[key]["name"],
+            "filename": f"{key[1]}.spold",
+            "parameters": [dict(parameter) for parameter in parameters],
+            "exchanges": raw_exchanges,
+        })
+    return data, raw_data
+
+
+def create_entso_timeseries(fp, num_markets, num_hours, rng, max_inputs=20):
+    """
+    Create a datapackage like `create_timeseries_entso_datapackages`, where hourly shares of inputs to electricity
+    markets are random, and markets and their inputs are activities of the fixture database.
+    """
+    ids = np.array(sorted(act.id for act in bd.Database(ECOINVENT_NAME)))
+    markets = rng.choice(ids, num_markets, replace=False)
+
+    indices, sizes = [], []
+    for col in markets:
+        rows = rng.choice(ids[ids != col], rng.integers(2, max_inputs + 1), replace=False)
+        indices += [(row, col) for row in sorted(rows)]
+        sizes.append(len(rows))
+
+    # Shares of all inputs of a market sum up to one in each hour
+    data = rng.gamma(rng.uniform(0.5, 5, (len(indices), 1)), size=(len(indices), num_hours))
+    starts = np.cumsum([0] + sizes[:-1])
+    data /= np.repeat(np.add.reduceat(data, starts, axis=0), sizes, axis=0)
+
+    dp = bwp.create_datapackage(
+        fs=ZipFS(str(fp), write=True),
+        name="synthetic ENTSO generation and trade timeseries",
+        seed=42,
+    )
+    dp.add_persistent_array(
+        matrix="technosphere_matrix",
+        data_array=data,
+        name="timeseries ENTSO electricity values",
+        indices_array=np.array(indices, dtype=bwp.INDICES_DTYPE),
+        flip_array=np.ones(len(indices), dtype=bool),
+    )
+    dp.finalize_serialization()
+
+
+def create_fixture_project(seed=42, sizes=None, overwrite=False):
+    """
+    Create bw2data project with a small fixture database for all sampling modules, and a synthetic ENTSO timeseries.
+
+    The fixture database contains background activities of `akula.benchmarks.create_synthetic_project`, liquid fuels
+    and activities that burn them, markets with inputs from several producers of the same product, and parameterized
+    activities, whose raw data is saved as input of `generate_parameterization_datapackage`. Existing fixtures are
+    reused, unless `overwrite` is True.
+    """
+    sizes = dict(FIXTURE_SIZES, **(sizes or {}))
+    paths = get_fixture_paths()
+    if overwrite:
+        if FIXTURE_PROJECT in bd.projects:
+            bd.projects.delete_project(FIXTURE_PROJECT, delete_dir=True)
+        shutil.rmtree(FIXTURE_DIR, ignore_errors=True)
+    bd.projects.set_current(FIXTURE_PROJECT)
+    if ECOINVENT_NAME in bd.databases and all(fp.exists() for fp in paths.values()):
+        return FIXTURE_PROJECT
+
+    rng = np.random.default_rng(seed)
+    num_background = sizes["background"]
+    num_flows = max(int(FLOWS_PER_ACTIVITY * num_background), 10)
+
+    print(f"Creating fixture project for sampling modules with {num_background} background activities")
+    data = create_ecoinvent_data(num_background, num_flows, rng)
+    data.update(create_fuel_data())
+    data.update(create_combustion_data(sizes["combustion"], num_background, rng))
+    data.update(create_market_data(sizes["markets"], num_background, rng))
+    parameterized_data, raw_data = create_parameterized_data(sizes["parameterized"], num_background, num_flows, rng)
+    data.update(parameterized_data)
+
+    bd.Database(BIOSPHERE_NAME).write(create_biosphere_data(num_flows))
+    bd.Database(ECOINVENT_NAME).write(data)
+
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    write_pickle(raw_data, paths["raw_data"])
+    create_entso_timeseries(paths["timeseries"], sizes["entsoe_markets"], sizes["entsoe_hours"], rng)
+
+    return FIXTURE_PROJECT
+
+
+def generate_datapackage(module, num_samples, seed, directory, input_data=None):
+    if module == "parameterization":
+        return generate_parameterization_datapackage(
+            None, module, num_samples, seed, directory=directory, input_data=input_data,
+        )
+    elif module == "combustion":
+        return generate_combustion_datapackage(module, num_samples, seed, directory=directory)
+    elif module == "entsoe":
+        fp_timeseries = get_fixture_paths()["timeseries"]
+        return generate_entsoe_datapackage(module, num_samples, seed, directory=directory, fp_timeseries=fp_timeseries)
+    elif module == "markets":
+        return generate_markets_datapackage(module, num_samples, seed, directory=directory)
+    raise ValueError(f"Unknown sampling module {module}")
+
+
+def benchmark_sampling_module(task):
+    """Generate the datapackage of one sampling module from scratch in a fresh `directory`, and return its record."""
+    module, num_samples, seed = task
+    directory = SAMPLING_MODULES_DIR / f"{module}-{seed}-{num_samples}"
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+
+    bd.projects.set_current(FIXTURE_PROJECT)
+    input_data = read_pickle(get_fixture_paths()["raw_data"]) if module == "parameterization" else None
+    baseline_rss = get_current_rss()
+    if baseline_rss is None:
+        baseline_rss = get_peak_rss()["peak_rss_mb"]
+
+    with instrument_run(module, SAMPLING_MODULES_DIR, num_samples=num_samples, seed=seed) as recorder:
+        generate_datapackage(module, num_samples, seed, directory, input_data)
+
+    record = recorder.record
+    record["baseline_rss_mb"] = baseline_rss
+    record["datapackage_mb"] = sum(fp.stat().st_size for fp in directory.glob("*.zip")) / 1024**2
+    shutil.rmtree(directory)
+    return record
+
+
+def print_sampling_module_summary(results):
+    phases = ["candidate_discovery", "loading", "sampling", "serialization"]
+    print(f"{'module':<18} {'samples':>8} {'wall, s':>9} " + " ".join(f"{p[:13]:>13}" for p in phases)
+          + f" {'peak, MB':>9} {'size, MB':>9}")
+    for result in results:
+        times = [result["phases"].get(p, {}).get("time", 0.0) for p in phases]
+        print(
+            f"{result['module']:<18} {result['num_samples']:>8} {result['wall_time']:>9.2f} "
+            + " ".join(f"{time:>13.2f}" for time in times)
+            + f" {result['peak_rss_mb'] - result['baseline_rss_mb']:>9.0f} {result['datapackage_mb']:>9.1f}"
+        )
+
+
+def run_sampling_module_benchmarks(num_samples=NUM_SAMPLES, seed=42, modules=MODULES, fixture_sizes=None):
+    """
+    Time and memory-profile datapackage generation of sampling modules for all `num_samples` on fixture data.
+
+    The fixture project and synthetic ENTSO timeseries are created with `create_fixture_project`, so the benchmark
+    runs offline. Each datapackage is generated from scratch in its own forked process, so that peak memory is
+    measured per run and no cached candidates are reused. Wall time is split into candidate discovery, loading,
+    sampling and serialization, and the report is written to a JSON file in `BENCHMARK_DIR`. Peak memory is reported
+    on top of the memory of the process before the run.
+    """
+    create_fixture_project(seed, fixture_sizes)
+    report = {
+        "benchmark": "sampling_modules",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": get_environment(),
+        "settings": {
+            "num_samples": list(num_samples),
+            "seed": seed,
+            "fixture_sizes": dict(FIXTURE_SIZES, **(fixture_sizes or {})),
+        },
+        "results": [],
+    }
+
+    for n in num_samples:
+        for module in modules:
+            print(f"Benchmark {module} sampling module with {n} samples")
+            with multiprocessing.get_context("fork").Pool(1) as pool:
+                record = pool.apply(benchmark_sampling_module, ((module, n, seed), ))
+            result = dict(module=module, num_samples=n)
+            result.update(record)
+            report["results"].append(result)
+            print(f"    {result['wall_time']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    print_sampling_module_summary(report["results"])
+    largest = [result for result in report["results"] if result["num_samples"] == max(num_samples)]
+    slowest = max(largest, key=lambda result: result["wall_time"])
+    print(f"Slowest sampling module with {slowest['num_samples']} samples is {slowest['module']}")
+
+    fp = BENCHMARK_DIR / f"report.sampling_modules.{report['created'].replace(':', '-')}.json"
+    with open(fp, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Benchmark report written to {fp}")
+
+    return report
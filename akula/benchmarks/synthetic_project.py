@@ -0,0 +1,197 @@
+import numpy as np
+import bw2data as bd
+import stats_arrays as sa
+
+from ..utils import METHOD
+
+ECOINVENT_NAME = "ecoinvent 3.8 cutoff"
+BIOSPHERE_NAME = "biosphere3"
+CONSUMPTION_NAME = "swiss consumption 1.0"
+CONSUMPTION_ACTIVITY_NAME = "ch hh average consumption aggregated, years 121314"
+
+LOCATIONS = ["CH", "DE", "FR", "IT", "AT", "RER", "RoW", "GLO"]
+
+# Statistics of ecoinvent 3.8 cutoff, with 19565 activities, 4709 biosphere flows, about 15 technosphere and 30
+# biosphere exchanges per activity
+TECHNOSPHERE_PER_ACTIVITY = 15
+BIOSPHERE_PER_ACTIVITY = 30
+FLOWS_PER_ACTIVITY = 0.24
+CHARACTERIZED_FRACTION = 0.05
+
+# Shares of lognormal, normal and triangular distributions among uncertain exchanges
+UNCERTAINTY_SHARES = {
+    sa.LognormalUncertainty.id: 0.9,
+    sa.NormalUncertainty.id: 0.05,
+    sa.TriangularUncertainty.id: 0.05,
+}
+
+# Sum of technosphere inputs to one unit of activity output, below 1 so that the technosphere matrix is invertible
+INPUTS_PER_OUTPUT = 0.5
+
+
+def get_synthetic_project_name(num_activities):
+    return f"akula benchmark {num_activities}"
+
+
+def get_uncertainty_dict(amount, uncertainty_type, rng):
+    """Return uncertainty fields of bw2data exchanges for an `amount` with a distribution of `uncertainty_type`."""
+    # Python floats, so that exchanges can be serialized by bw2data
+    amount = float(amount)
+    if uncertainty_type == sa.LognormalUncertainty.id:
+        return {
+            "uncertainty type": int(uncertainty_type),
+            "loc": float(np.log(abs(amount))),
+            "scale": float(rng.uniform(0.05, 0.6)),
+            "negative": bool(amount < 0),
+        }
+    elif uncertainty_type == sa.NormalUncertainty.id:
+        return {
+            "uncertainty type": int(uncertainty_type),
+            "loc": amount,
+            "scale": abs(amount) * float(rng.uniform(0.05, 0.3)),
+        }
+    elif uncertainty_type == sa.TriangularUncertainty.id:
+        width = abs(amount) * float(rng.uniform(0.1, 0.5))
+        return {
+            "uncertainty type": int(uncertainty_type),
+            "loc": amount,
+            "minimum": amount - width,
+            "maximum": amount + width,
+        }
+    return {"uncertainty type": int(sa.NoUncertainty.id), "loc": amount}
+
+
+def get_exchange(input_key, amount, exchange_type, uncertainty_type, rng):
+    exchange = {"input": input_key, "amount": float(amount), "type": exchange_type}
+    exchange.update(get_uncertainty_dict(amount, uncertainty_type, rng))
+    return exchange
+
+
+def sample_uncertainty_types(size, rng, uncertain_fraction=0.9):
+    """Sample uncertainty types of `size` exchanges, where `uncertain_fraction` of them have distributions."""
+    types = rng.choice(list(UNCERTAINTY_SHARES), size=size, p=list(UNCERTAINTY_SHARES.values()))
+    types[rng.random(size) > uncertain_fraction] = sa.NoUncertainty.id
+    return types
+
+
+def create_biosphere_data(num_flows):
+    data = {
+        (BIOSPHERE_NAME, f"flow-{i}"): {
+            "name": f"Synthetic emission {i}",
+            "categories": ("air",),
+            "unit": "kilogram",
+            "type": "emission",
+        }
+        for i in range(num_flows)
+    }
+    # Used by the combustion sampling module
+    data[(BIOSPHERE_NAME, "flow-0")]["name"] = "Carbon dioxide, fossil"
+    return data
+
+
+def create_ecoinvent_data(num_activities, num_flows, rng):
+    """
+    Create ecoinvent-like activities with random technosphere and biosphere exchanges.
+
+    Numbers of exchanges per activity follow a geometric distribution with ecoinvent means, inputs are drawn with
+    preference for a small number of frequently used activities, as in ecoinvent markets, and amounts are lognormal.
+    """
+    popularity = rng.pareto(1.0, num_activities) + 1
+    popularity /= popularity.sum()
+    emissions = rng.pareto(1.0, num_flows) + 1
+    emissions /= emissions.sum()
+
+    data = {}
+    for j in range(num_activities):
+        key = (ECOINVENT_NAME, f"activity-{j}")
+        exchanges = [{"input": key, "amount": 1.0, "type": "production"}]
+
+        num_inputs = min(rng.geometric(1 / TECHNOSPHERE_PER_ACTIVITY), num_activities - 1)
+        inputs = np.setdiff1d(np.unique(rng.choice(num_activities, num_inputs, p=popularity)), [j])
+        amounts = rng.lognormal(0, 1.5, len(inputs))
+        amounts *= INPUTS_PER_OUTPUT / max(amounts.sum(), 1)
+        types = sample_uncertainty_types(len(inputs), rng)
+        exchanges += [
+            get_exchange((ECOINVENT_NAME, f"activity-{i}"), amount, "technosphere", uncertainty_type, rng)
+            for i, amount, uncertainty_type in zip(inputs, amounts, types)
+        ]
+
+        num_emissions = min(rng.geometric(1 / BIOSPHERE_PER_ACTIVITY), num_flows)
+        flows = np.unique(rng.choice(num_flows, num_emissions, p=emissions))
+        amounts = rng.lognormal(-6, 3, len(flows))
+        types = sample_uncertainty_types(len(flows), rng)
+        exchanges += [
+            get_exchange((BIOSPHERE_NAME, f"flow-{i}"), amount, "biosphere", uncertainty_type, rng)
+            for i, amount, uncertainty_type in zip(flows, amounts, types)
+        ]
+
+        data[key] = {
+            "name": f"synthetic activity {j}",
+            "reference product": f"synthetic product {j}",
+            "location": LOCATIONS[j % len(LOCATIONS)],
+            "unit": "kilogram",
+            "type": "process",
+            "exchanges": exchanges,
+        }
+    return data
+
+
+def create_consumption_data(num_activities, rng, num_inputs=300):
+    """Create one consumption activity with static inputs from ecoinvent activities."""
+    key = (CONSUMPTION_NAME, "ch-hh-average")
+    inputs = rng.choice(num_activities, min(num_inputs, num_activities), replace=False)
+    exchanges = [{"input": key, "amount": 1.0, "type": "production"}]
+    exchanges += [
+        {"input": (ECOINVENT_NAME, f"activity-{i}"), "amount": float(amount), "type": "technosphere"}
+        for i, amount in zip(inputs, rng.lognormal(0, 2, len(inputs)))
+    ]
+    return {
+        key: {
+            "name": CONSUMPTION_ACTIVITY_NAME,
+            "location": "CH",
+            "unit": "unit",
+            "type": "process",
+            "exchanges": exchanges,
+        }
+    }
+
+
+def create_method_data(num_flows, rng):
+    """Create GWP-like characterization factors, where CO2 is certain, and other factors are uncertain."""
+    flows = rng.choice(np.arange(1, num_flows), max(int(CHARACTERIZED_FRACTION * num_flows), 1), replace=False)
+    data = [((BIOSPHERE_NAME, "flow-0"), 1.0)]
+    for i, amount in zip(flows, rng.lognormal(2, 2, len(flows))):
+        uncertainty_type = sa.TriangularUncertainty.id if rng.random() < 0.2 else sa.NormalUncertainty.id
+        cf = {"amount": float(amount)}
+        cf.update(get_uncertainty_dict(amount, uncertainty_type, rng))
+        data.append(((BIOSPHERE_NAME, f"flow-{i}"), cf))
+    return data
+
+
+def create_synthetic_project(num_activities, seed=42, overwrite=False):
+    """
+    Create bw2data project with a synthetic database that has the statistics of ecoinvent, and return its name.
+
+    Databases and the LCIA method have the same names as in the real project, so that all functions of akula can be
+    used with the synthetic project. Existing projects are reused, unless `overwrite` is True.
+    """
+    project = get_synthetic_project_name(num_activities)
+    if overwrite and project in bd.projects:
+        bd.projects.delete_project(project, delete_dir=True)
+    bd.projects.set_current(project)
+    if CONSUMPTION_NAME in bd.databases and METHOD in bd.methods:
+        return project
+
+    rng = np.random.default_rng(seed)
+    num_flows = max(int(FLOWS_PER_ACTIVITY * num_activities), 10)
+
+    print(f"Creating synthetic project with {num_activities} activities and {num_flows} biosphere flows")
+    bd.Database(BIOSPHERE_NAME).write(create_biosphere_data(num_flows))
+    bd.Database(ECOINVENT_NAME).write(create_ecoinvent_data(num_activities, num_flows, rng))
+    bd.Database(CONSUMPTION_NAME).write(create_consumption_data(num_activities, rng))
+
+    method = bd.Method(METHOD)
+    method.register(unit="kg CO2-Eq")
+    method.write(create_method_data(num_flows, rng))
+
+    return project
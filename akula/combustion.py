@@ -9,6 +9,7 @@ import stats_arrays as sa
 from tqdm import tqdm
 
 from .utils import read_pickle, write_pickle
+from .instrumentation import instrumented, phase
 
 DATA_DIR = Path(__file__).parent.parent.resolve() / "data" / "datapackages"
 
@@ -111,9 +112,9 @@ def get_liquid_fuels():
             ]
 
 
-def get_candidates(co2, ei_name='ecoinvent 3.8 cutoff'):
+def get_candidates(co2, ei_name='ecoinvent 3.8 cutoff', directory=DATA_DIR):
 
-    fp = DATA_DIR / "combustion.candidates.pickle"
+    fp = directory / "combustion.candidates.pickle"
 
     if fp.exists():
         candidates = read_pickle(fp)
@@ -133,6 +134,7 @@ def get_co2():
     return [x for x in bd.Database('biosphere3') if x['name'] == 'Carbon dioxide, fossil']
 
 
+@instrumented(DATA_DIR, "directory")
 def generate_combustion_datapackage(name, num_samples, seed=42, directory=None):
 
     directory = directory or DATA_DIR
@@ -140,9 +142,10 @@ def generate_combustion_datapackage(name, num_samples, seed=42, directory=None):
 
     if not fp_datapackage.exists():
 
-        fuels = get_liquid_fuels()
-        co2 = get_co2()
-        candidates = get_candidates(co2)
+        with phase("candidate_discovery"):
+            fuels = get_liquid_fuels()
+            co2 = get_co2()
+            candidates = get_candidates(co2, directory=directory)
 
         processed_log = open(directory / "combustion.processed.log", "w")
         unbalanced_log = open(directory / "combustion.unbalanced.log", "w")
@@ -151,35 +154,30 @@ def generate_combustion_datapackage(name, num_samples, seed=42, directory=None):
         indices_tech, flip_tech, data_tech = [], [], []
         indices_bio, data_bio = [], []
 
-        dp = bwp.create_datapackage(
-            fs=ZipFS(str(fp_datapackage), write=True),
-            seed=seed,
-            sequential=True,
-        )
+        with phase("sampling"):
+            for candidate in tqdm(candidates):
+                if not carbon_fuel_emissions_balanced(candidate, fuels, co2):
+                    unbalanced_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
 
-        for candidate in tqdm(candidates):
-            if not carbon_fuel_emissions_balanced(candidate, fuels, co2):
-                unbalanced_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
+                try:
+                    tindices, tflip, tsample, factors = get_samples_and_scaling_vector(
+                        candidate, fuels, size=num_samples, seed=seed
+                    )
+                    if tindices.shape == (0, ):
+                        continue
 
-            try:
-                tindices, tflip, tsample, factors = get_samples_and_scaling_vector(
-                    candidate, fuels, size=num_samples, seed=seed
-                )
-                if tindices.shape == (0, ):
-                    continue
+                    bindices, bsample, _ = rescale_biosphere_exchanges_by_factors(candidate, factors, co2)
 
-                bindices, bsample, _ = rescale_biosphere_exchanges_by_factors(candidate, factors, co2)
+                    indices_tech.append(tindices)
+                    flip_tech.append(tflip)
+                    data_tech.append(tsample)
 
-                indices_tech.append(tindices)
-                flip_tech.append(tflip)
-                data_tech.append(tsample)
+                    indices_bio.append(bindices)
+                    data_bio.append(bsample)
 
-                indices_bio.append(bindices)
-                data_bio.append(bsample)
-
-                processed_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
-            except KeyError:
-                error_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
+                    processed_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
+                except KeyError:
+                    error_log.write("{}\t{}\n".format(candidate.id, str(candidate)))
 
         processed_log.close()
         unbalanced_log.close()
@@ -191,28 +189,36 @@ def generate_combustion_datapackage(name, num_samples, seed=42, directory=None):
         indices = indices_tech + indices_bio
         print("Found {} exchanges in {} datasets".format(sum(len(x) for x in indices), len(indices)))
 
-        dp.add_persistent_array(
-            matrix="technosphere_matrix",
-            data_array=np.vstack(data_tech),
-            # Resource group name that will show up in provenance
-            name="combustion-tech",
-            indices_array=np.hstack(indices_tech),
-            flip_array=np.hstack(flip_tech),
-        )
-
-        dp.add_persistent_array(
-            matrix="biosphere_matrix",
-            data_array=np.vstack(data_bio),
-            # Resource group name that will show up in provenance
-            name="combustion-bio",
-            indices_array=np.hstack(indices_bio),
-        )
-
-        dp.finalize_serialization()
+        with phase("serialization"):
+            dp = bwp.create_datapackage(
+                fs=ZipFS(str(fp_datapackage), write=True),
+                seed=seed,
+                sequential=True,
+            )
+
+            dp.add_persistent_array(
+                matrix="technosphere_matrix",
+                data_array=np.vstack(data_tech),
+                # Resource group name that will show up in provenance
+                name="combustion-tech",
+                indices_array=np.hstack(indices_tech),
+                flip_array=np.hstack(flip_tech),
+            )
+
+            dp.add_persistent_array(
+                matrix="biosphere_matrix",
+                data_array=np.vstack(data_bio),
+                # Resource group name that will show up in provenance
+                name="combustion-bio",
+                indices_array=np.hstack(indices_bio),
+            )
+
+            dp.finalize_serialization()
 
     else:
 
-        dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
+        with phase("loading"):
+            dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
 
     return dp
 
@@ -0,0 +1,218 @@
+import numpy as np
+import bw2calc as bc
+import stats_arrays as sa
+
+from .utils import get_csr_positions, get_adjoint
+from .monte_carlo import get_consumption_lca_inputs, add_datapackages
+from .score_store import advance_lca
+from .convergence import PERCENTILES
+
+MATRIX_LABELS = ("technosphere_mm", "biosphere_mm", "characterization_mm")
+
+
+def get_distribution_means(params):
+    """Return expected values of stats_arrays uncertainty distributions, and `loc` for inputs without uncertainty."""
+    means = np.array(params["loc"], dtype=float)
+    types = params["uncertainty_type"]
+
+    lognormal = types == sa.LognormalUncertainty.id
+    means[lognormal] = np.exp(params["loc"][lognormal] + params["scale"][lognormal] ** 2 / 2)
+    means[lognormal & params["negative"]] *= -1
+
+    triangular = types == sa.TriangularUncertainty.id
+    means[triangular] = (params["minimum"] + params["loc"] + params["maximum"])[triangular] / 3
+
+    uniform = types == sa.UniformUncertainty.id
+    means[uniform] = (params["minimum"] + params["maximum"])[uniform] / 2
+
+    supported = [
+        sa.UndefinedUncertainty.id, sa.NoUncertainty.id, sa.LognormalUncertainty.id, sa.NormalUncertainty.id,
+        sa.TriangularUncertainty.id, sa.UniformUncertainty.id,
+    ]
+    if not np.all(np.isin(types, supported)):
+        raise ValueError(f"Expected values are not implemented for uncertainty types {set(types) - set(supported)}")
+
+    return means
+
+
+def get_matrix_rows_cols(matrix, positions):
+    """Return row and column indices of `positions` in `matrix.data` of a sparse CSR matrix."""
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))[positions]
+    cols = matrix.indices[positions]
+    return rows, cols
+
+
+def get_sampled_shifts(mapped_matrix):
+    """
+    Find elements of `mapped_matrix` whose variation comes only from uncertainty distributions.
+
+    Return their positions in `mapped_matrix.matrix.data`, and the differences between expected and static values.
+    Elements that are overwritten by static values or that take values from data arrays are excluded, so that the
+    expected value of each returned element is known exactly.
+    """
+    matrix = mapped_matrix.matrix
+    sampled = np.zeros(matrix.nnz, dtype=bool)
+    from_arrays = np.zeros(matrix.nnz, dtype=bool)
+    shifts = np.zeros(matrix.nnz)
+    for group in mapped_matrix.groups:
+        if group.empty:
+            continue
+        row, col, _ = group.calculate()
+        positions = get_csr_positions(matrix, row, col)
+        if not group.package.metadata["sum_inter_duplicates"]:
+            # Values of this group overwrite values of all previous groups
+            sampled[positions] = False
+            from_arrays[positions] = False
+            shifts[positions] = 0
+        if group.is_array():
+            from_arrays[positions] = True
+        elif group.has_distributions:
+            params = group.get_resource_by_suffix("distributions")
+            uncertain = group.apply_masks(params)["uncertainty_type"] > 1
+            _, _, means = group.calculate(get_distribution_means(params))
+            _, _, amounts = group.calculate(group.get_resource_by_suffix("data"))
+            if group.aggregate:
+                # Uncertain and certain inputs are summed up in the same elements
+                _, _, uncertain = group.calculate(np.isin(params["uncertainty_type"], [0, 1], invert=True) * 1.0)
+                uncertain = uncertain > 0
+            np.logical_or.at(sampled, positions, uncertain)
+            np.add.at(shifts, positions, means - amounts)
+    sampled &= ~from_arrays
+    return np.where(sampled)[0], shifts[sampled]
+
+
+def get_linearization(lca):
+    """
+    Linearize the LCIA score of a static `lca` with respect to elements of its matrices sampled from distributions.
+
+    The first-order Taylor approximation of the score is
+
+        score0 - λ^T ΔA s + c^T ΔB s + Δc^T B s,
+
+    where s is the supply array and λ^T = c^T B A^{-1} is the solution of the adjoint system, and c are diagonal
+    elements of the characterization matrix. Only sampled elements of A, B and c are included, so that the expected
+    value of the approximation is known, and it can be used as a control variate.
+    """
+    lca.lci()
+    lca.lcia()
+
+    characterization_factors = lca.characterization_matrix.diagonal()
+    adjoint = get_adjoint(lca)
+    inventory = lca.biosphere_matrix @ lca.supply_array
+
+    linearization = {"score": lca.score, "mean": lca.score}
+    for label in MATRIX_LABELS:
+        mapped_matrix = getattr(lca, label)
+        positions, shifts = get_sampled_shifts(mapped_matrix)
+        rows, cols = get_matrix_rows_cols(mapped_matrix.matrix, positions)
+        if label == "technosphere_mm":
+            weights = -adjoint[rows] * lca.supply_array[cols]
+        elif label == "biosphere_mm":
+            weights = characterization_factors[rows] * lca.supply_array[cols]
+        else:
+            weights = inventory[rows]
+        linearization[label] = {
+            "rows": rows,
+            "cols": cols,
+            "weights": weights,
+            "data": mapped_matrix.matrix.data[positions].copy(),
+        }
+        linearization["mean"] += weights @ shifts
+
+    return linearization
+
+
+def get_linearization_positions(lca, linearization):
+    """Return positions of the linearized elements in the matrices of `lca`, which keep their sparsity pattern."""
+    return {
+        label: get_csr_positions(getattr(lca, label).matrix, linearization[label]["rows"], linearization[label]["cols"])
+        for label in MATRIX_LABELS
+    }
+
+
+def compute_linearized_score(lca, linearization, positions):
+    """Evaluate linearized LCIA score for the current matrices of `lca`."""
+    score = linearization["score"]
+    for label in MATRIX_LABELS:
+        data = getattr(lca, label).matrix.data[positions[label]]
+        score += linearization[label]["weights"] @ (data - linearization[label]["data"])
+    return score
+
+
+def compute_consumption_lcia_linearized(project, iterations, seed=42, datapackages=None):
+    """
+    Compute linearized LCIA scores for the same model inputs as `compute_consumption_lcia` with random sampling.
+
+    Monte Carlo iterations are replayed with the same datapackages and seed, but only matrices are generated, and the
+    linear system is not solved. Return linearized scores, and their expected value.
+    """
+    fu, data_objs = get_consumption_lca_inputs(project)
+    data_objs = add_datapackages(data_objs, datapackages)
+
+    lca_static = bc.LCA(demand=fu, data_objs=data_objs, use_arrays=True, use_distributions=False, seed_override=seed)
+    linearization = get_linearization(lca_static)
+
+    lca = bc.LCA(demand=fu, data_objs=data_objs, use_arrays=True, use_distributions=True, seed_override=seed)
+    # Same sequence of random samples as `lci` and `lcia` in `compute_consumption_lcia`
+    lca.load_lci_data()
+    lca.load_lcia_data()
+    positions = get_linearization_positions(lca, linearization)
+
+    controls = np.zeros(iterations)
+    for i in range(iterations):
+        advance_lca(lca, 1)
+        controls[i] = compute_linearized_score(lca, linearization, positions)
+
+    return controls, linearization["mean"]
+
+
+def get_control_variate_estimates(scores, controls, control_mean, percentiles=PERCENTILES):
+    """
+    Estimate mean, variance and percentiles of `scores` with `controls` of known expected value `control_mean`.
+
+    Each statistic is corrected with its optimal control coefficient. Percentiles are obtained by inverting the
+    control variate estimate of the cumulative distribution function at the sampled scores. The effective sample size
+    is the number of plain MC iterations with the same variance of the mean, n / (1 - ρ^2), where ρ is the correlation
+    between scores and controls.
+    """
+    scores, controls = np.asarray(scores, dtype=float), np.asarray(controls, dtype=float)
+    n = len(scores)
+    control_shift = controls.mean() - control_mean
+    control_variance = controls.var()
+
+    def get_coefficient(values):
+        if control_variance == 0:
+            return 0.0
+        return np.mean((values - values.mean()) * (controls - controls.mean())) / control_variance
+
+    mean = scores.mean() - get_coefficient(scores) * control_shift
+    second_moment = np.mean(scores ** 2) - get_coefficient(scores ** 2) * control_shift
+    variance = (second_moment - mean ** 2) * n / (n - 1)
+
+    # Cumulative distribution function at sorted scores, F(y) = E[1{Y <= y}]
+    order = np.argsort(scores)
+    sorted_scores = scores[order]
+    cdf = np.arange(1, n + 1) / n
+    if control_variance > 0:
+        covariances = np.cumsum(controls[order] - controls.mean()) / n
+        cdf = cdf - covariances / control_variance * control_shift
+    cdf = np.maximum.accumulate(np.clip(cdf, 0, 1))
+    percentile_values = sorted_scores[np.minimum(np.searchsorted(cdf, np.array(percentiles) / 100), n - 1)]
+
+    correlation = np.corrcoef(scores, controls)[0, 1] if control_variance > 0 else 0.0
+
+    estimates = {
+        "iterations": n,
+        "mean": mean,
+        "variance": variance,
+        "correlation": correlation,
+        "effective_sample_size": n / (1 - min(correlation ** 2, 1 - 1e-12)),
+    }
+    estimates.update({f"p{p}": value for p, value in zip(percentiles, percentile_values)})
+
+    print(
+        f"Control variate estimates from {n} MC iterations -- correlation {correlation:.4f}, effective sample size "
+        f"{estimates['effective_sample_size']:.0f}"
+    )
+
+    return estimates
@@ -0,0 +1,210 @@
+import json
+import hashlib
+import numpy as np
+from scipy.stats import norm
+
+# Percentiles of LCIA scores that are monitored during MC simulations
+PERCENTILES = (5, 50, 95)
+
+
+class RunningStatistics:
+    """Mean and variance of a stream of values with the Welford algorithm."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        for value in np.atleast_1d(values):
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Combine statistics of two independent streams, see Chan et al. (1979)."""
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def standard_error(self):
+        return np.sqrt(self.variance / self.count) if self.count > 1 else np.nan
+
+    @property
+    def relative_standard_error(self):
+        return self.standard_error / abs(self.mean) if self.mean != 0 else np.nan
+
+
+class QuantileSketch:
+    """
+    Mergeable sketch of a stream of values for approximate quantiles.
+
+    Values are kept in levels, where each value at level `h` represents `2**h` values of the stream. When a level holds
+    `capacity` values, they are sorted and every second value is moved to the next level. Rank error is in the order
+    of `log2(count / capacity) / capacity`.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.levels = [[]]
+        self.count = 0
+        self.num_compactions = 0
+
+    def update(self, values):
+        values = np.atleast_1d(values).tolist()
+        self.levels[0].extend(values)
+        self.count += len(values)
+        self.compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].extend(items)
+        self.count += other.count
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) >= self.capacity:
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items = sorted(items)
+                # Keep one value at this level if their number is odd, so that total weight does not change
+                self.levels[level] = [items.pop()] if len(items) % 2 else []
+                # Alternate which values are kept to avoid a systematic bias
+                self.levels[level + 1].extend(items[self.num_compactions % 2::2])
+                self.num_compactions += 1
+            level += 1
+
+    def quantile(self, q):
+        """Return approximate quantiles `q` in [0, 1] of all values seen so far."""
+        values = np.hstack([np.array(items, dtype=float) for items in self.levels])
+        if len(values) == 0:
+            return np.full(np.shape(q), np.nan)
+        weights = np.hstack([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values)
+        values, weights = values[order], weights[order]
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(q, ranks, values)
+
+
+class ConvergenceMonitor:
+    """
+    Streaming statistics of MC scores, with a stopping rule based on a target precision.
+
+    Simulations are converged when the relative standard error of the mean is below `rtol_mean`, and the width of the
+    confidence interval of each monitored percentile, relative to the median, is below `rtol_percentiles`. Targets that
+    are None are not checked. Confidence intervals of percentiles are computed from binomial order statistics.
+    Convergence is checked every `check_every` values, and not before `min_iterations` values.
+    """
+    def __init__(
+            self, rtol_mean=None, rtol_percentiles=None, percentiles=PERCENTILES, confidence=0.95, min_iterations=100,
+            check_every=100, capacity=1000,
+    ):
+        if rtol_mean is None and rtol_percentiles is None:
+            raise ValueError("At least one of `rtol_mean` and `rtol_percentiles` must be given")
+        self.rtol_mean = rtol_mean
+        self.rtol_percentiles = rtol_percentiles
+        self.percentiles = percentiles
+        self.confidence = confidence
+        self.z = norm.ppf(0.5 + confidence / 2)
+        self.min_iterations = max(min_iterations, 2)
+        self.check_every = check_every
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        """Forget all values seen so far."""
+        self.statistics = RunningStatistics()
+        self.sketch = QuantileSketch(self.capacity)
+        self.converged = False
+        self.next_check = 0
+
+    @property
+    def settings(self):
+        """Targets and stopping rule of the monitor, which determine where early-stopped runs end."""
+        return {
+            "rtol_mean": self.rtol_mean,
+            "rtol_percentiles": self.rtol_percentiles,
+            "percentiles": [float(p) for p in self.percentiles],
+            "confidence": self.confidence,
+            "min_iterations": self.min_iterations,
+            "check_every": self.check_every,
+        }
+
+    @property
+    def tag(self):
+        """Short hash of `settings`, used in names of cached scores of early-stopped runs."""
+        return hashlib.sha256(json.dumps(self.settings, sort_keys=True).encode()).hexdigest()[:8]
+
+    @property
+    def num_iterations(self):
+        return self.statistics.count
+
+    def update(self, values):
+        """Add new `values`, and return True if the target precision is reached."""
+        self.statistics.update(values)
+        self.sketch.update(values)
+        if self.num_iterations >= max(self.min_iterations, self.next_check):
+            self.converged = self.check()
+            self.next_check = self.num_iterations + self.check_every
+        return self.converged
+
+    def merge(self, other):
+        self.statistics.merge(other.statistics)
+        self.sketch.merge(other.sketch)
+        self.converged = self.num_iterations >= self.min_iterations and self.check()
+        return self.converged
+
+    def get_percentile_intervals(self):
+        """Return confidence intervals of monitored percentiles, one row per percentile."""
+        n = self.num_iterations
+        q = np.array(self.percentiles) / 100
+        half_width = self.z * np.sqrt(q * (1 - q) / n)
+        return np.vstack([self.sketch.quantile(np.clip(q - half_width, 0, 1)),
+                          self.sketch.quantile(np.clip(q + half_width, 0, 1))]).T
+
+    def get_percentile_rtols(self):
+        intervals = self.get_percentile_intervals()
+        median = self.sketch.quantile(0.5)
+        return (intervals[:, 1] - intervals[:, 0]) / abs(median)
+
+    def check(self):
+        converged = True
+        if self.rtol_mean is not None:
+            converged &= bool(self.statistics.relative_standard_error <= self.rtol_mean)
+        if self.rtol_percentiles is not None:
+            converged &= bool(np.all(self.get_percentile_rtols() <= self.rtol_percentiles))
+        return converged
+
+    def summary(self):
+        percentiles = self.sketch.quantile(np.array(self.percentiles) / 100)
+        dict_ = {
+            "iterations": self.num_iterations,
+            "converged": self.converged,
+            "mean": self.statistics.mean,
+            "std": np.sqrt(self.statistics.variance),
+            "relative_standard_error": self.statistics.relative_standard_error,
+        }
+        dict_.update({f"p{p}": value for p, value in zip(self.percentiles, percentiles)})
+        return dict_
+
+    def report(self):
+        summary = self.summary()
+        status = "Converged" if summary["converged"] else "Not converged"
+        print(
+            f"{status} after {summary['iterations']} MC iterations -- mean {summary['mean']:.4e}, "
+            f"relative standard error {summary['relative_standard_error']:.2e}, "
+            + ", ".join(f"p{p} {summary[f'p{p}']:.4e}" for p in self.percentiles)
+        )
@@ -9,10 +9,12 @@ import os
 
 from .entso_data_converter import ENTSODataConverter
 from .add_residual_mix import add_swiss_residual_mix
+from ..instrumentation import instrumented, phase
 
 BENTSO_DATA_DIR = os.environ["BENTSO_DATA_DIR"]
 DATA_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "datapackages"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
+FP_TIMESERIES = DATA_DIR / "entsoe-timeseries.zip"
 
 
 def create_average_entso_datapackages(project, years=(2019, 2020, 2021)):
@@ -80,7 +82,7 @@ def create_timeseries_entso_datapackages(project, years=(2019, 2020, 2021)):
 
     # Start with average datapackages
     dp = bwp.create_datapackage(
-        fs=ZipFS(str(DATA_DIR / "entsoe-timeseries.zip"), write=True),
+        fs=ZipFS(str(FP_TIMESERIES), write=True),
         name="2019-2021 ENTSO generation and trade timeseries",
         # set seed to have reproducible (though not sequential) sampling
         seed=42,
@@ -131,42 +133,50 @@ def create_timeseries_entso_datapackages(project, years=(2019, 2020, 2021)):
     dp.finalize_serialization()
 
 
-def generate_entsoe_datapackage(name, num_samples, seed=42, directory=None):
+@instrumented(DATA_DIR, "directory")
+def generate_entsoe_datapackage(name, num_samples, seed=42, directory=None, fp_timeseries=None):
+    """Resample hours of ENTSO-E timeseries, by default from `create_timeseries_entso_datapackages`."""
 
     directory = directory or DATA_DIR
+    fp_timeseries = fp_timeseries or FP_TIMESERIES
 
     fp_datapackage = directory / f"{name}-{seed}-{num_samples}.zip"
 
     if not fp_datapackage.exists():
 
-        dp_timeseries = bwp.load_datapackage(ZipFS(str(DATA_DIR / "entsoe-timeseries.zip")))
+        with phase("loading"):
+            dp_timeseries = bwp.load_datapackage(ZipFS(str(fp_timeseries)))
 
-        data = dp_timeseries.get_resource("timeseries ENTSO electricity values.data")[0]
-        indices = dp_timeseries.get_resource("timeseries ENTSO electricity values.indices")[0]
-        flip = dp_timeseries.get_resource("timeseries ENTSO electricity values.flip")[0]
+            data = dp_timeseries.get_resource("timeseries ENTSO electricity values.data")[0]
+            indices = dp_timeseries.get_resource("timeseries ENTSO electricity values.indices")[0]
+            flip = dp_timeseries.get_resource("timeseries ENTSO electricity values.flip")[0]
 
-        np.random.seed(seed)
-        inds = np.random.choice(data.shape[1], num_samples, replace=True)
+        with phase("sampling"):
+            np.random.seed(seed)
+            inds = np.random.choice(data.shape[1], num_samples, replace=True)
+            data_array = data[:, inds]
 
-        dp = bwp.create_datapackage(
-            fs=ZipFS(str(fp_datapackage), write=True),
-            name=name,
-            seed=seed,
-            sequential=True,
-        )
+        with phase("serialization"):
+            dp = bwp.create_datapackage(
+                fs=ZipFS(str(fp_datapackage), write=True),
+                name=name,
+                seed=seed,
+                sequential=True,
+            )
 
-        dp.add_persistent_array(
-            matrix='technosphere_matrix',
-            name=name,
-            indices_array=indices,
-            data_array=data[:, inds],
-            flip_array=flip,
-        )
+            dp.add_persistent_array(
+                matrix='technosphere_matrix',
+                name=name,
+                indices_array=indices,
+                data_array=data_array,
+                flip_array=flip,
+            )
 
-        dp.finalize_serialization()
+            dp.finalize_serialization()
 
     else:
 
-        dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
+        with phase("loading"):
+            dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
 
     return dp
@@ -14,9 +14,11 @@ from pathlib import Path
 from ..constants import *
 from ..utils import (
     update_fig_axes, COLOR_BRIGHT_PINK_RGB, COLOR_DARKGRAY_HEX, COLOR_PSI_LPURPLE, COLOR_PSI_LPURPLE_OPAQUE,
-    COLOR_DARKGRAY_HEX_OPAQUE, COLOR_BLACK_HEX,
+    COLOR_DARKGRAY_HEX_OPAQUE, COLOR_BLACK_HEX, METHOD,
 )
 from .utils import get_one_activity
+from ..solvers import get_lca_class
+from ..monte_carlo import compute_lcia_methods
 
 DAYTIME_MASK = np.hstack([
     np.zeros(DAYTIME_START_AM, dtype=bool),
@@ -268,9 +270,8 @@ def create_ecoinvent_original_dp(project):
 def compute_static_score(project, use_entsoe=False, location="CH"):
     """Compute deterministic LCIA score."""
     bd.projects.set_current(project)
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     activity = get_one_activity("ecoinvent 3.8 cutoff", name="market for electricity, low voltage", location=location)
-    fu, data_objs, _ = bd.prepare_lca_inputs({activity: 1}, method=method, remapping=False)
+    fu, data_objs, _ = bd.prepare_lca_inputs({activity: 1}, method=METHOD, remapping=False)
 
     if use_entsoe:
         dp = bwp.load_datapackage(ZipFS(str(DATA_DIR / "entsoe-average.zip")))
@@ -289,11 +290,16 @@ def compute_static_score(project, use_entsoe=False, location="CH"):
     return lca.score
 
 
-def compute_low_voltage_lcia(project, dp, iterations=1000, seed=None, location="CH"):
+def compute_low_voltage_lcia(
+        project, dp, iterations=1000, seed=None, location="CH", solver="direct", solver_options=None, methods=None,
+):
     """
     Compute climate change scores for the activity `market for electricity, low voltage, CH` based on ENTSOE or
     ecoinvent data in dp.
 
+    If a list of LCIA `methods` is given, scores of all methods are computed from the same inventories, and returned
+    as a dictionary, see `akula.monte_carlo.compute_lcia_methods`.
+
     Note
     ====
     If we set seed_override to a random seed, and use_distributions=True, then we can reproduce LCIA scores,
@@ -305,19 +311,25 @@ def compute_low_voltage_lcia(project, dp, iterations=1000, seed=None, location="
     """
 
     bd.projects.set_current(project)
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     activity = get_one_activity("ecoinvent 3.8 cutoff", name="market for electricity, low voltage", location=location)
 
-    fu, data_objs, _ = bd.prepare_lca_inputs({activity: 1}, method=method, remapping=False)
+    fu, data_objs, _ = bd.prepare_lca_inputs(
+        {activity: 1}, method=METHOD if methods is None else None, remapping=False
+    )
 
-    lca = bc.LCA(
+    lca = get_lca_class(solver)(
         demand=fu,
         data_objs=data_objs + [dp],
         use_arrays=True,
         use_distributions=True,
         seed_override=seed,
+        **(solver_options or dict()),
     )
     lca.lci()
+
+    if methods is not None:
+        return compute_lcia_methods(lca, methods, iterations)
+
     lca.lcia()
 
     scores = [lca.score for _ in zip(range(iterations), lca)]
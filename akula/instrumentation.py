@@ -0,0 +1,353 @@
+import json
+import inspect
+import functools
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+LOG_NAME = "instrumentation.jsonl"
+
+# Instrumentation is opt-in, see `enable_instrumentation`
+SETTINGS = dict(enabled=False)
+
+# Recorder of the run that is currently instrumented
+CURRENT_RUN = dict()
+
+
+def enable_instrumentation(enabled=True):
+    """Switch instrumentation of LCA iterations and pipeline stages on or off for all following runs."""
+    SETTINGS["enabled"] = enabled
+
+
+def read_process_status(field):
+    """Return `field` of ``/proc/self/status`` in MB, e.g. "VmRSS" or "VmHWM", or None where it is not available."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    # Values are given in kB
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset peak resident set size of this process to its current value, return False where it is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_current_rss():
+    """Return current resident set size of this process in MB, or None where it is not available."""
+    return read_process_status("VmRSS")
+
+
+def get_peak_rss():
+    """Return peak resident set size of this process and of its terminated child processes in MB."""
+    # `ru_maxrss` is given in kB on Linux
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+class RunRecorder:
+    """
+    Wall time spent in named phases of one run, e.g. sampling, matrix building, solving and LCIA.
+
+    Phases can be nested, and the time of a phase excludes the time of phases nested in it, so that times of all phases
+    add up to at most the wall time of the run. Phases are tracked separately in each thread, and times of threads
+    that run in parallel, e.g. in `akula.prefetch.PrefetchingIterator`, are summed up. Phases and iterations of worker
+    processes are added with `merge`, see `instrument_worker`.
+    """
+    def __init__(self, name, **parameters):
+        self.name = name
+        self.parameters = parameters
+        self.times = dict()
+        self.calls = dict()
+        self.iterations = 0
+        self.peak_rss_workers = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Peaks of earlier runs in this process are not reported for this run
+        self.peak_rss_reset = reset_peak_rss()
+        self.peak_rss_children_start = get_peak_rss()["peak_rss_children_mb"]
+        self.start = perf_counter()
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def phase(self, name):
+        # Time of phases nested in this one is collected in the last element of the stack
+        self.stack.append(0.0)
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - t0
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            with self.lock:
+                self.times[name] = self.times.get(name, 0.0) + elapsed - nested
+                self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_iterations(self, num_iterations=1):
+        with self.lock:
+            self.iterations += num_iterations
+
+    def merge(self, record):
+        """Add phases and iterations of a `record` of a worker process, and keep the largest peak memory of workers."""
+        with self.lock:
+            for name, dict_ in record["phases"].items():
+                self.times[name] = self.times.get(name, 0.0) + dict_["time"]
+                self.calls[name] = self.calls.get(name, 0) + dict_["calls"]
+            self.iterations += record["iterations"]
+            self.peak_rss_workers = max(self.peak_rss_workers or 0.0, record["peak_rss_mb"])
+
+    def get_record(self):
+        wall_time = perf_counter() - self.start
+        record = {
+            "run": self.name,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "parameters": self.parameters,
+            "wall_time": wall_time,
+            "phases": {name: {"time": time, "calls": self.calls[name]} for name, time in self.times.items()},
+            "iterations": self.iterations,
+            "iterations_per_second": self.iterations / wall_time if self.iterations and wall_time > 0 else None,
+        }
+        record.update(self.get_peak_rss())
+        record["peak_rss_workers_mb"] = self.peak_rss_workers
+        return record
+
+    def get_peak_rss(self):
+        """
+        Return peak resident set size during this run, and of child processes that terminated during this run in MB.
+
+        Where the peak cannot be reset, i.e. outside Linux, the peak of the whole process is reported, and marked so in
+        "peak_rss_scope". Peak of child processes is None, if none of them used more memory than earlier children.
+        """
+        peak_rss = get_peak_rss()
+        peak_rss_run = read_process_status("VmHWM") if self.peak_rss_reset else None
+        children = peak_rss["peak_rss_children_mb"]
+        return {
+            "peak_rss_mb": peak_rss["peak_rss_mb"] if peak_rss_run is None else peak_rss_run,
+            "peak_rss_scope": "process" if peak_rss_run is None else "run",
+            "peak_rss_children_mb": children if children > self.peak_rss_children_start else None,
+        }
+
+
+@contextmanager
+def instrument_run(name, directory, **parameters):
+    """
+    Record phases of the run `name`, and append its record to the JSON-lines log in `directory` at the end.
+
+    Yields the recorder, whose `record` is set at the end of the run. If another run is already instrumented, this run
+    is recorded as one of its phases instead, and None is yielded.
+    """
+    if "recorder" in CURRENT_RUN:
+        with phase(name):
+            yield None
+        return
+
+    recorder = RunRecorder(name, **parameters)
+    CURRENT_RUN["recorder"] = recorder
+    try:
+        yield recorder
+    finally:
+        del CURRENT_RUN["recorder"]
+        recorder.record = recorder.get_record()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / LOG_NAME, "a") as f:
+            f.write(json.dumps(recorder.record, default=str) + "\n")
+
+
+def instrumented(directory, directory_arg=None):
+    """
+    Decorator that instruments all calls of a function when instrumentation is enabled.
+
+    Records are written to the value of the argument `directory_arg` of the function if it is given, and to
+    `directory` otherwise. Arguments of the function that are numbers, strings or booleans are saved as parameters.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not SETTINGS["enabled"]:
+                return function(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            run_directory = (arguments.arguments.get(directory_arg) if directory_arg else None) or directory
+            parameters = {
+                key: value for key, value in arguments.arguments.items()
+                if isinstance(value, (bool, int, float, str))
+            }
+            with instrument_run(function.__name__, run_directory, **parameters):
+                return function(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def instrument_worker():
+    """
+    Record phases of a task in a worker process that is forked from an instrumented run.
+
+    Yields a new recorder, or None if the parent run is not instrumented. Its `get_record` should be returned to the
+    parent process, and added to the parent run with `merge_worker_record`. Pool workers are reused for several tasks,
+    so the recorder inherited from the parent is restored at the end.
+    """
+    parent = CURRENT_RUN.get("recorder")
+    if parent is None:
+        yield None
+        return
+
+    recorder = RunRecorder(parent.name)
+    CURRENT_RUN["recorder"] = recorder
+    try:
+        yield recorder
+    finally:
+        CURRENT_RUN["recorder"] = parent
+
+
+def merge_worker_record(record):
+    """Add phases and iterations of a `record` of a worker process to the current run, if it is instrumented."""
+    recorder = CURRENT_RUN.get("recorder")
+    if recorder is not None and record is not None:
+        recorder.merge(record)
+
+
+@contextmanager
+def phase(name):
+    """Record wall time of a phase of the current run, or do nothing if no run is instrumented."""
+    recorder = CURRENT_RUN.get("recorder")
+    if recorder is None:
+        yield
+        return
+    with recorder.phase(name):
+        yield
+
+
+def add_iterations(num_iterations=1):
+    recorder = CURRENT_RUN.get("recorder")
+    if recorder is not None:
+        recorder.add_iterations(num_iterations)
+
+
+def timed(name, function):
+    """Wrap `function` such that each call is recorded as phase `name`."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with phase(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def instrument_lca(lca):
+    """
+    Record phases of all following iterations of `lca`, if a run is instrumented.
+
+    Drawing samples and indexing data arrays of resource groups is recorded as "sampling", writing them to the
+    matrices as "matrix_building", the technosphere solve as "solving", the remaining LCI calculation as "inventory",
+    and LCIA calculation as "lcia". Each LCI calculation of an iteration counts as one iteration, the one in `lci` that
+    sets up the calculation does not. Methods are wrapped on the `lca` object and its mapped matrices, so the LCA class
+    is not changed.
+    """
+    if "recorder" not in CURRENT_RUN:
+        return lca
+
+    lca.solve_linear_system = timed("solving", lca.solve_linear_system)
+
+    setup = dict(depth=0)
+    lci, lci_calculation = lca.lci, timed("inventory", lca.lci_calculation)
+
+    def lci_wrapper(*args, **kwargs):
+        setup["depth"] += 1
+        try:
+            return lci(*args, **kwargs)
+        finally:
+            setup["depth"] -= 1
+
+    def lci_calculation_wrapper(*args, **kwargs):
+        if not setup["depth"]:
+            add_iterations(1)
+        return lci_calculation(*args, **kwargs)
+
+    lca.lci = lci_wrapper
+    lca.lci_calculation = lci_calculation_wrapper
+    lca.lcia_calculation = timed("lcia", lca.lcia_calculation)
+
+    def instrument_mapped_matrix(mapped_matrix):
+        # Mapped matrices that are kept by `load_lci_data` and `load_lcia_data` are already wrapped
+        if getattr(mapped_matrix, "instrumented", False):
+            return
+        mapped_matrix.instrumented = True
+        mapped_matrix.iterate_indexers = timed("sampling", mapped_matrix.iterate_indexers)
+        mapped_matrix.rebuild_matrix = timed("matrix_building", mapped_matrix.rebuild_matrix)
+        for group in mapped_matrix.groups:
+            group.calculate = timed("sampling", group.calculate)
+
+    for label in lca.matrix_labels:
+        if hasattr(lca, label):
+            instrument_mapped_matrix(getattr(lca, label))
+
+    # Mapped matrices are created in `load_lci_data` and `load_lcia_data`
+    for name in ["load_lci_data", "load_lcia_data"]:
+        load_data = getattr(lca, name)
+
+        def wrapper(*args, load_data=load_data, **kwargs):
+            with phase("loading"):
+                load_data(*args, **kwargs)
+            for label in lca.matrix_labels:
+                if hasattr(lca, label):
+                    instrument_mapped_matrix(getattr(lca, label))
+
+        setattr(lca, name, wrapper)
+
+    return lca
+
+
+def read_instrumentation_log(directory):
+    """Return all records from the instrumentation log in `directory`."""
+    with open(Path(directory) / LOG_NAME, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_instrumentation_summary(directory, run=None, last=None):
+    """Print a breakdown of wall time per phase for records of `run` in `directory`, or only for the `last` ones."""
+    records = [record for record in read_instrumentation_log(directory) if run is None or record["run"] == run]
+    if last is not None:
+        records = records[-last:]
+
+    for record in records:
+        wall_time = record["wall_time"]
+        print(f"{record['run']} -- {record['created']}, wall time {wall_time:.2f} s")
+        print(f"    {'phase':<20} {'time, s':>10} {'share':>8} {'calls':>10}")
+        phases = sorted(record["phases"].items(), key=lambda item: -item[1]["time"])
+        for name, dict_ in phases:
+            share = 100 * dict_["time"] / wall_time
+            print(f"    {name:<20} {dict_['time']:>10.2f} {share:>7.1f}% {dict_['calls']:>10}")
+        other = wall_time - sum(dict_["time"] for dict_ in record["phases"].values())
+        print(f"    {'other':<20} {other:>10.2f} {100 * other / wall_time:>7.1f}%")
+        speed = record["iterations_per_second"]
+        speed = "" if speed is None else f", {speed:.2f} iterations/s"
+        children = record["peak_rss_children_mb"]
+        children = "" if children is None else f", children {children:.0f} MB"
+        workers = record.get("peak_rss_workers_mb")
+        children += "" if workers is None else f", workers {workers:.0f} MB"
+        print(f"    {record['iterations']} iterations{speed}, peak RSS {record['peak_rss_mb']:.0f} MB{children}")
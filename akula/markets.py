@@ -13,10 +13,11 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 from .utils import (
-    read_pickle, write_pickle,
+    read_pickle, write_pickle, get_index_positions,
     update_fig_axes, COLOR_DARKGRAY_HEX, COLOR_PSI_LPURPLE, COLOR_PSI_DGREEN,
 )
 from .electricity.utils import get_one_activity
+from .instrumentation import instrumented, phase
 
 DATA_DIR = Path(__file__).parent.parent.resolve() / "data" / "datapackages"
 PERCENTILES = [5, 95]
@@ -291,6 +292,7 @@ def get_dirichlet_scales(markets):
     return dirichlet_scales
 
 
+@instrumented(DATA_DIR, "directory")
 def generate_markets_datapackage(name, num_samples, seed=42, for_entsoe=False, fit_lognormal=False, directory=None):
 
     directory = directory or DATA_DIR
@@ -298,54 +300,62 @@ def generate_markets_datapackage(name, num_samples, seed=42, for_entsoe=False, f
 
     if not fp_datapackage.exists():
 
-        fp_markets = directory / f"{name}.pickle"
-        if fp_markets.exists():
-            markets = read_pickle(fp_markets)
-        else:
-            if for_entsoe:
-                markets = find_entsoe_markets(similar_fuzzy, fit_lognormal=fit_lognormal)
+        with phase("candidate_discovery"):
+            fp_markets = directory / f"{name}.pickle"
+            if fp_markets.exists():
+                markets = read_pickle(fp_markets)
             else:
-                markets = find_markets("ecoinvent 3.8 cutoff", similar_fuzzy)
-            write_pickle(markets, fp_markets)
-
-        data, indices, flip = generate_market_samples(markets, num_samples, seed=seed)
-
-        dp = bwp.create_datapackage(
-            fs=ZipFS(str(fp_datapackage), write=True),
-            name=name,
-            seed=seed,
-            sequential=True,
-        )
+                if for_entsoe:
+                    markets = find_entsoe_markets(similar_fuzzy, fit_lognormal=fit_lognormal)
+                else:
+                    markets = find_markets("ecoinvent 3.8 cutoff", similar_fuzzy)
+                write_pickle(markets, fp_markets)
+
+        with phase("sampling"):
+            data, indices, flip = generate_market_samples(markets, num_samples, seed=seed)
+
+        with phase("serialization"):
+            dp = bwp.create_datapackage(
+                fs=ZipFS(str(fp_datapackage), write=True),
+                name=name,
+                seed=seed,
+                sequential=True,
+            )
 
-        dp.add_persistent_array(
-            matrix="technosphere_matrix",
-            data_array=data,
-            # Resource group name that will show up in provenance
-            name=name,
-            indices_array=indices,
-            flip_array=flip,
-        )
+            dp.add_persistent_array(
+                matrix="technosphere_matrix",
+                data_array=data,
+                # Resource group name that will show up in provenance
+                name=name,
+                indices_array=indices,
+                flip_array=flip,
+            )
 
-        dp.finalize_serialization()
+            dp.finalize_serialization()
 
     else:
 
-        dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
+        with phase("loading"):
+            dp = bwp.load_datapackage(ZipFS(str(fp_datapackage)))
 
     return dp
 
 
 def check_dirichlet_samples(markets, indices, data_array):
+    market_indices = []
     for market, exchanges in markets.items():
         col = market.id
-        where = []
+        rows = []
         for exc in exchanges:
             try:
-                where.append(np.where(indices == np.array((exc.input.id, col), dtype=bwp.INDICES_DTYPE))[0][0])
+                rows.append(exc.input.id)
             except AttributeError:
-                where.append(np.where(indices == np.array((bd.get_activity(exc["input"]).id, col),
-                                                          dtype=bwp.INDICES_DTYPE))[0][0])
-        where = np.array(where)
+                rows.append(bd.get_activity(exc["input"]).id)
+        market_indices.append(np.array([(row, col) for row in rows], dtype=bwp.INDICES_DTYPE))
+    positions = np.split(
+        get_index_positions(indices, np.hstack(market_indices)), np.cumsum([len(x) for x in market_indices])[:-1]
+    )
+    for where in positions:
         sum_ = data_array[where].sum(axis=0)
         assert np.allclose(min(sum_), max(sum_))
 
@@ -577,9 +587,7 @@ def plot_dirichlet_entsoe_samples(act_id, dp_entsoe, dp_dirichlet, num_bins=100)
 
     # Extract ENTSO-E data for the given activity and its exchanges
     indices_entsoe = dp_entsoe.get_resource('entsoe.indices')[0]
-    where = []
-    for inds in indices_act:
-        where.append(np.where(indices_entsoe == inds)[0][0])
+    where = get_index_positions(indices_entsoe, indices_act)
     data_entsoe = dp_entsoe.get_resource('entsoe.data')[0]
     data_entsoe = data_entsoe[where, :]
 
@@ -766,9 +774,7 @@ def plot_markets_validation(dp_entsoe, dp_dirichlet, location="DK", plot_zoomed=
         data_dirichlet_col = data_dirichlet[mask, :]
 
         # Extract ENTSO-E data for the given activity and its exchanges
-        where = []
-        for inds in indices_act:
-            where.append(np.where(indices_entsoe == inds)[0][0])
+        where = get_index_positions(indices_entsoe, indices_act)
         data_entsoe_col = data_entsoe[where, :]
 
         # Fit lognormal distributions to ENTSO-E data
@@ -1072,9 +1078,7 @@ def plot_markets_validation_ch(dp_entsoe, dp_dirichlet, location="CH",
         data_dirichlet_col = data_dirichlet[mask, :]
 
         # Extract ENTSO-E data for the given activity and its exchanges
-        where = []
-        for inds in indices_act:
-            where.append(np.where(indices_entsoe == inds)[0][0])
+        where = get_index_positions(indices_entsoe, indices_act)
         data_entsoe_col = data_entsoe[where, :]
 
         # Fit lognormal distributions to ENTSO-E data
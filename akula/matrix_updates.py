@@ -0,0 +1,109 @@
+import numpy as np
+from time import perf_counter
+
+from .utils import get_csr_positions
+from .instrumentation import phase
+
+
+def get_group_positions(mapped_matrix):
+    """
+    Return positions in `mapped_matrix.matrix.data` of the rows and columns of each resource group.
+
+    Rows and columns of a group, after masking and aggregation, are the same in all iterations, so positions are found
+    once from `group.row_matrix` and `group.col_matrix`, which are masked and aggregated when the group is mapped, as
+    in `group.calculate`. Unlike `calculate`, this does not change the current data of the group.
+    """
+    positions = []
+    for group in mapped_matrix.groups:
+        if group.empty:
+            positions.append(np.array([], dtype=np.int64))
+            continue
+        positions.append(get_csr_positions(mapped_matrix.matrix, group.row_matrix, group.col_matrix))
+    return positions
+
+
+def rebuild_matrix_inplace(mapped_matrix, arrays, positions):
+    """
+    Same as `mapped_matrix.rebuild_matrix()` for rows, columns and data of resource groups in `arrays`, but new data
+    is scattered directly into `mapped_matrix.matrix.data` at precomputed `positions`, see `get_group_positions`.
+    """
+    data = mapped_matrix.matrix.data
+    data *= 0
+    for group, (_, _, values), group_positions in zip(mapped_matrix.groups, arrays, positions):
+        if group.package.metadata["sum_inter_duplicates"]:
+            # Same as `matrix[row, col] += values` of scipy, where the last of duplicate elements is kept
+            data[group_positions] = data[group_positions] + values
+        else:
+            data[group_positions] = values
+
+
+def use_inplace_updates(lca):
+    """
+    Update all matrices of `lca` in place in the following MC iterations, without rebuilding them from COO data.
+
+    The sparsity pattern of LCA matrices does not change between iterations, so only values of resource groups, e.g.
+    columns of sequential datapackages from sampling modules, are written to the `data` arrays of the CSR matrices.
+    Matrices are the same as with `next(lca)`. `lca` must be prepared with `lci` and `lcia` beforehand.
+    """
+    for label in lca.matrix_labels:
+        if not hasattr(lca, label):
+            continue
+        mapped_matrix = getattr(lca, label)
+        mapped_matrix.group_positions = get_group_positions(mapped_matrix)
+
+        def rebuild_matrix(mapped_matrix=mapped_matrix):
+            with phase("matrix_building"):
+                arrays = [group.calculate() for group in mapped_matrix.groups]
+                rebuild_matrix_inplace(mapped_matrix, arrays, mapped_matrix.group_positions)
+
+        # Replaces `MappedMatrix.rebuild_matrix` that is called in `next(mapped_matrix)`
+        mapped_matrix.rebuild_matrix = rebuild_matrix
+    return lca
+
+
+def time_matrix_updates(lca, iterations=100):
+    """
+    Compare time per MC iteration of rebuilding the matrices of `lca` and of updating them in place.
+
+    Both updates are applied to the same samples, and resulting matrices are checked to be equal. Samples are drawn
+    from `lca`, so its resource groups are `iterations` ahead afterwards.
+    """
+    labels = [label for label in lca.matrix_labels if hasattr(lca, label)]
+    positions = {label: get_group_positions(getattr(lca, label)) for label in labels}
+    time_rebuild, time_inplace = 0.0, 0.0
+
+    for _ in range(iterations):
+        for label in labels:
+            mapped_matrix = getattr(lca, label)
+            mapped_matrix.iterate_indexers()
+            arrays = [group.calculate() for group in mapped_matrix.groups]
+
+            t0 = perf_counter()
+            mapped_matrix.matrix.data *= 0
+            for group, (row, col, values) in zip(mapped_matrix.groups, arrays):
+                if group.package.metadata["sum_inter_duplicates"]:
+                    mapped_matrix.matrix[row, col] += values
+                else:
+                    mapped_matrix.matrix[row, col] = values
+            t1 = perf_counter()
+            rebuilt = mapped_matrix.matrix.data.copy()
+
+            t2 = perf_counter()
+            rebuild_matrix_inplace(mapped_matrix, arrays, positions[label])
+            t3 = perf_counter()
+            if not np.allclose(rebuilt, mapped_matrix.matrix.data):
+                raise ValueError(f"In-place update of {label} differs from rebuilding the matrix")
+
+            time_rebuild += t1 - t0
+            time_inplace += t3 - t2
+
+    dict_ = {
+        "rebuild": time_rebuild / iterations,
+        "inplace": time_inplace / iterations,
+        "saved": (time_rebuild - time_inplace) / iterations,
+    }
+    print(
+        f"Matrix updates per MC iteration -- rebuild {1e3 * dict_['rebuild']:.2f} ms, in place "
+        f"{1e3 * dict_['inplace']:.2f} ms, saved {1e3 * dict_['saved']:.2f} ms"
+    )
+    return dict_
@@ -1,63 +1,447 @@
 import bw2data as bd
 import bw2calc as bc
+import matrix_utils as mu
+from bw2calc.utils import consistent_global_index
 import pickle
+import multiprocessing
+from matrix_utils.indexers import SequentialIndexer, MAX_SIGNED_32BIT_INT
 from pathlib import Path
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import numpy as np
 
-from .utils import update_fig_axes, COLOR_PSI_BLUE, COLOR_DARKGRAY_HEX, get_consumption_activity
+from .utils import update_fig_axes, COLOR_PSI_BLUE, COLOR_DARKGRAY_HEX, get_consumption_activity, METHOD
+from .solvers import get_lca_class, solve_multiple_demands
+from .score_store import ScoreStore, iterate_lca_to_store
+from .qmc import create_qmc_datapackage
+from .prefetch import PrefetchingIterator
+from .matrix_updates import use_inplace_updates
+from .instrumentation import instrumented, instrument_lca, instrument_worker, merge_worker_record
 
 MC_DIR = Path(__file__).parent.parent.resolve() / "data" / "monte-carlo" / "sampling-modules"
 MC_DIR.mkdir(parents=True, exist_ok=True)
 
+MC_CHUNK_SIZE = 500
 
-def compute_consumption_lcia(project, iterations, seed=42, datapackages=None):
+# Inputs shared with forked worker processes in `compute_lcia_parallel`
+PARALLEL_INPUTS = dict()
+
+
+def get_consumption_lca_inputs(project, datapackages=None, method=METHOD):
+    """Prepare functional unit and datapackages of the average Swiss household consumption."""
     bd.projects.set_current(project)
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     activity = get_consumption_activity()
 
     fu, data_objs, _ = bd.prepare_lca_inputs({activity: 1}, method=method, remapping=False)
+    data_objs = add_datapackages(data_objs, datapackages)
+
+    return fu, data_objs
+
 
+def add_datapackages(data_objs, datapackages=None):
+    """Append one datapackage or a list of `datapackages` to `data_objs`."""
     if datapackages is not None:
         if type(datapackages) is list:
             data_objs += datapackages
         else:
             data_objs.append(datapackages)
+    return data_objs
+
+
+def get_multi_demand_lca_inputs(project, activities, datapackages=None, method=METHOD):
+    """Prepare functional units for each of the demand `activities`, and shared datapackages."""
+    bd.projects.set_current(project)
+
+    fus, data_objs, _ = bd.prepare_lca_inputs(
+        demands=[{activity: 1} for activity in activities], method=method, remapping=False
+    )
+    data_objs = add_datapackages(data_objs, datapackages)
+
+    return fus, data_objs
+
+
+def get_multi_demand_lca(fus, data_objs, seed=None, stochastic=True):
+    """
+    Load LCA matrices for all functional units in `fus` without solving the technosphere system.
 
+    Returns LCA object and demand matrix, where each column is the demand array of one functional unit.
+    """
     lca = bc.LCA(
+        demand={key: 1 for fu in fus for key in fu},
+        data_objs=data_objs,
+        use_arrays=stochastic,
+        use_distributions=stochastic,
+        seed_override=seed,
+    )
+    lca.load_lci_data()
+    lca.load_lcia_data()
+
+    demand_matrix = np.zeros((len(lca.dicts.product), len(fus)))
+    for i, fu in enumerate(fus):
+        lca.build_demand_array(fu)
+        demand_matrix[:, i] = lca.demand_array
+
+    return lca, demand_matrix
+
+
+def compute_multi_demand_scores(lca, demand_matrix):
+    """Solve technosphere system for all demands with one factorization, and return LCIA score of each demand."""
+    supply_matrix = solve_multiple_demands(lca.technosphere_matrix, demand_matrix)
+    characterized_biosphere = np.asarray(
+        (lca.characterization_matrix @ lca.biosphere_matrix).sum(axis=0)
+    ).flatten()
+    return characterized_biosphere @ supply_matrix
+
+
+def compute_multi_demand_lcia(project, activities, iterations=None, seed=42, datapackages=None):
+    """
+    Compute LCIA scores for several demand `activities` at once, e.g. all sectors of the Swiss household consumption.
+
+    Without `iterations`, deterministic scores with shape (demands,) are returned. Otherwise, Monte Carlo simulations
+    are run, and scores with shape (iterations, demands) are returned. Samples are taken in the same order as in
+    `compute_consumption_lcia`, so scores of the same `seed` and `datapackages` are based on the same LCA matrices.
+    """
+    fus, data_objs = get_multi_demand_lca_inputs(project, activities, datapackages)
+
+    if iterations is None:
+        lca, demand_matrix = get_multi_demand_lca(fus, data_objs, stochastic=False)
+        return compute_multi_demand_scores(lca, demand_matrix)
+
+    lca, demand_matrix = get_multi_demand_lca(fus, data_objs, seed)
+
+    scores = np.zeros((iterations, len(fus)))
+    for i in range(iterations):
+        next(lca)
+        scores[i, :] = compute_multi_demand_scores(lca, demand_matrix)
+
+    return scores
+
+
+@instrumented(MC_DIR, "store_dir")
+def compute_consumption_lcia(
+        project, iterations, seed=42, datapackages=None, num_workers=1, chunk_size=MC_CHUNK_SIZE, solver="direct",
+        solver_options=None, store_dir=None, convergence=None, sampling_method="random", prefetch=False,
+        inplace_updates=False,
+):
+    """
+    Run Monte Carlo simulations for the average Swiss household consumption and return LCIA scores.
+
+    `solver` selects how the technosphere system is solved in each iteration, see `akula.solvers.LCA_SOLVERS`, and
+    `solver_options` are passed to the corresponding LCA class, e.g. `dict(rtol=1e-6, maxiter=50)` for "iterative".
+
+    If `num_workers` is larger than 1, iterations are split into chunks of `chunk_size` that are computed in a process
+    pool, see `compute_lcia_parallel`. Scores for a given `seed` and `chunk_size` do not depend on `num_workers`, but
+    they differ from the serial run.
+
+    If `store_dir` is given, scores are periodically written to a `ScoreStore` in this directory, and an interrupted
+    run resumes from the last written iteration. In this case scores are returned as a memory-mapped array. Resuming
+    with another mode (serial or parallel), `chunk_size` of parallel runs or `sampling_method` raises an error.
+
+    If a `convergence` monitor is given, see `akula.convergence.ConvergenceMonitor`, `iterations` is the maximum number
+    of MC iterations, and simulations stop as soon as the target precision of LCIA scores is reached. Stored scores of
+    a run that stopped early, but don't reach the target precision of `convergence`, are resumed.
+
+    If `sampling_method` is "latin_hypercube" or "sobol", uncertain technosphere, biosphere and characterization inputs
+    are taken from a sequential datapackage with a low-discrepancy design instead of random sampling, see
+    `akula.qmc.create_qmc_datapackage`. Sampling modules in `datapackages` replace these values as before.
+
+    If `prefetch` is True, samples of the next iteration are drawn in a background thread while the current iteration
+    is solved, see `akula.prefetch.PrefetchingIterator`. Scores are the same as without prefetching.
+
+    If `inplace_updates` is True, new values are written directly to the data arrays of the CSR matrices in each
+    iteration, instead of rebuilding the matrices, see `akula.matrix_updates.use_inplace_updates`.
+    """
+    use_distributions = sampling_method == "random"
+    fu, data_objs = get_consumption_lca_inputs(project)
+    if not use_distributions:
+        dp_qmc = create_qmc_datapackage(project, iterations, sampling_method, seed)
+        data_objs = add_datapackages(data_objs, dp_qmc)
+    data_objs = add_datapackages(data_objs, datapackages)
+
+    store = None
+    if store_dir is not None:
+        parallel = num_workers > 1
+        store = ScoreStore(
+            store_dir, project, seed, iterations, data_objs, mode="parallel" if parallel else "serial",
+            chunk_size=chunk_size if parallel else None, sampling_method=sampling_method, convergence=convergence,
+        )
+        if store.complete:
+            scores = store.read()
+            if convergence is None:
+                return scores
+            convergence.update(scores)
+            if convergence.converged or len(scores) >= iterations:
+                convergence.report()
+                return scores
+            # Scores were stopped early with looser targets, continue the same random stream
+            print(f"Stored scores do not reach the target precision, resuming MC simulations in {store.directory}")
+            store.reopen()
+            convergence.reset()
+
+    if num_workers > 1:
+        scores = compute_lcia_parallel(
+            fu, data_objs, iterations, seed, num_workers, chunk_size, solver, solver_options, store, convergence,
+            use_distributions, inplace_updates, prefetch,
+        )
+        if convergence is not None:
+            convergence.report()
+        return scores
+
+    lca = get_lca_class(solver)(
         demand=fu,
         data_objs=data_objs,
         use_arrays=True,
-        use_distributions=True,
+        use_distributions=use_distributions,
         seed_override=seed,
+        **(solver_options or dict()),
     )
+    instrument_lca(lca)
     lca.lci()
     lca.lcia()
+    if inplace_updates:
+        use_inplace_updates(lca)
+
+    if not use_distributions:
+        # Take points of the design in order, starting from the first one
+        set_sequential_offset(lca, 0, names=[dp_qmc.metadata["name"]])
+        lca.keep_first_iteration()
 
-    scores = [lca.score for _ in zip(range(iterations), lca)]
+    if store is not None:
+        scores = iterate_lca_to_store(lca, iterations, store, convergence=convergence, prefetch=prefetch)
+    else:
+        iterator = PrefetchingIterator(lca, iterations) if prefetch else lca
+        if convergence is not None:
+            scores = []
+            for _ in zip(range(iterations), iterator):
+                scores.append(lca.score)
+                if convergence.update(lca.score):
+                    break
+        else:
+            scores = [lca.score for _ in zip(range(iterations), iterator)]
+        if prefetch:
+            iterator.close()
+
+    if convergence is not None:
+        convergence.report()
+
+    return scores
+
+
+def get_characterization_mm(lca, method):
+    """Create characterization matrix of the LCIA `method` from its own datapackage, with biosphere rows of `lca`."""
+    packages = [bd.Method(method).datapackage()]
+    global_index = consistent_global_index(packages)
+    return mu.MappedMatrix(
+        packages=packages,
+        matrix="characterization_matrix",
+        use_arrays=lca.use_arrays,
+        use_distributions=lca.use_distributions,
+        seed_override=lca.seed_override,
+        row_mapper=lca.biosphere_mm.row_mapper,
+        diagonal=True,
+        custom_filter=(lambda x: x["col"] == global_index) if global_index is not None else None,
+    )
+
+
+def compute_lcia_methods(lca, methods, iterations):
+    """
+    Iterate `lca` and return a dictionary with LCIA scores of all `methods` computed from the same inventories.
+
+    Characterization factors of each method are sampled with the same seed as the inventory, so that scores of one
+    method are the same as in a separate run with this method, e.g. with `compute_consumption_lcia`.
+    """
+    characterization_mms = {method: get_characterization_mm(lca, method) for method in methods}
+    scores = {method: np.zeros(iterations) for method in methods}
+
+    for i in range(iterations):
+        next(lca)
+        for method, mm in characterization_mms.items():
+            next(mm)
+            scores[method][i] = (mm.matrix @ lca.inventory).sum()
 
     return scores
 
 
-def compute_scores(project, option, iterations, seed=42, datapackage=None):
+def compute_consumption_lcia_methods(
+        project, methods, iterations, seed=42, datapackages=None, solver="direct", solver_options=None,
+):
+    """
+    Run Monte Carlo simulations for the average Swiss household consumption, and return LCIA scores for all `methods`.
+
+    Technosphere system is solved only once per iteration for all methods. Characterization matrices are built only
+    from datapackages of the methods, and `datapackages` modify only the inventory.
+    """
+    fu, data_objs = get_consumption_lca_inputs(project, datapackages, method=None)
+
+    lca = get_lca_class(solver)(
+        demand=fu,
+        data_objs=data_objs,
+        use_arrays=True,
+        use_distributions=True,
+        seed_override=seed,
+        **(solver_options or dict()),
+    )
+    lca.lci()
+
+    return compute_lcia_methods(lca, methods, iterations)
+
+
+def get_chunk_seeds(seed, num_chunks):
+    """Generate independent random seeds for `num_chunks` chunks of MC iterations from one `seed`."""
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_chunks)
+    # Seeds must be positive, because `seed_override=0` is ignored by matrix_utils
+    seeds = [int(ss.generate_state(1)[0] % MAX_SIGNED_32BIT_INT) + 1 for ss in seed_sequences]
+    return seeds
+
+
+def set_sequential_offset(lca, offset, names=None):
+    """
+    Take data from sequential datapackages starting from the column `offset`, even if `seed_override` is set.
+
+    If `names` are given, only datapackages with these names are changed.
+    """
+    for matrix in ["technosphere_mm", "biosphere_mm", "characterization_mm"]:
+        obj = getattr(lca, matrix)
+        for package, groups in obj.packages.items():
+            if package.metadata["sequential"] and (names is None or package.metadata["name"] in names):
+                package.indexer = SequentialIndexer(offset=offset)
+                for group in groups:
+                    group.add_indexer(package.indexer)
+        obj.rebuild_matrix()
+
+
+def compute_lcia_chunk(task):
+    """
+    Compute LCIA scores for one chunk of MC iterations in a worker process.
+
+    Returns scores, and the instrumentation record of the chunk if the parent run is instrumented, see
+    `akula.instrumentation.instrument_worker`.
+    """
+    start, iterations, seed = task
+    fu, data_objs = PARALLEL_INPUTS["fu"], PARALLEL_INPUTS["data_objs"]
+    solver, solver_options = PARALLEL_INPUTS["solver"], PARALLEL_INPUTS["solver_options"]
+
+    with instrument_worker() as recorder:
+        lca = get_lca_class(solver)(
+            demand=fu,
+            data_objs=data_objs,
+            use_arrays=True,
+            use_distributions=PARALLEL_INPUTS["use_distributions"],
+            seed_override=seed,
+            **(solver_options or dict()),
+        )
+        instrument_lca(lca)
+        lca.lci()
+        lca.lcia()
+        if PARALLEL_INPUTS["inplace_updates"]:
+            use_inplace_updates(lca)
+
+        # Column `start + i` of sequential datapackages is used in the iteration `start + i`
+        set_sequential_offset(lca, start)
+        lca.keep_first_iteration()
+
+        iterator = PrefetchingIterator(lca, iterations) if PARALLEL_INPUTS["prefetch"] else lca
+        scores = [lca.score for _ in zip(range(iterations), iterator)]
+        if PARALLEL_INPUTS["prefetch"]:
+            iterator.close()
+
+    return scores, None if recorder is None else recorder.get_record()
+
+
+def compute_lcia_parallel(
+        fu, data_objs, iterations, seed, num_workers, chunk_size=MC_CHUNK_SIZE, solver="direct", solver_options=None,
+        store=None, convergence=None, use_distributions=True, inplace_updates=False, prefetch=False,
+):
+    """
+    Run Monte Carlo simulations in a process pool, and return LCIA scores in the order of iterations.
+
+    Each chunk of `chunk_size` iterations is computed with its own LCA object built from `fu` and `data_objs`, and its
+    own random seed derived from `seed`. Sequential datapackages are read column by column, such that the chunk that
+    starts at iteration `start` takes columns `start, start+1, ...`. This way LCIA scores can be aligned with the data
+    arrays of sequential datapackages.
+
+    Worker processes are forked, so that datapackages are inherited from the parent process instead of being pickled.
+
+    If `store` is given, scores of each chunk are appended to it as soon as all previous chunks are done, and chunks
+    that are already in the store are skipped. If a `convergence` monitor is given, chunks are added to it in the order
+    of iterations, and no further chunks are used once it reports convergence. If `prefetch` is True, each worker
+    draws samples of its next iteration in a background thread, see `akula.prefetch.PrefetchingIterator`. If the run
+    is instrumented, phases and iterations of finished chunks are added to it, see `akula.instrumentation`.
+    """
+    starts = np.arange(0, iterations, chunk_size)
+    seeds = get_chunk_seeds(seed, len(starts))
+    tasks = [
+        (int(start), int(min(chunk_size, iterations - start)), chunk_seed) for start, chunk_seed in zip(starts, seeds)
+    ]
+
+    if store is not None:
+        if store.num_iterations % chunk_size != 0:
+            raise ValueError(f"Score store in {store.directory} was written with a different chunk size")
+        tasks = [task for task in tasks if task[0] >= store.num_iterations]
+        if convergence is not None and store.num_iterations > 0 and convergence.update(store.read()):
+            tasks = []
+
+    results = []
+    PARALLEL_INPUTS.update(
+        fu=fu, data_objs=data_objs, solver=solver, solver_options=solver_options, use_distributions=use_distributions,
+        inplace_updates=inplace_updates, prefetch=prefetch,
+    )
+    try:
+        with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+            for chunk_scores, record in pool.imap(compute_lcia_chunk, tasks, chunksize=1):
+                merge_worker_record(record)
+                if store is not None:
+                    store.append(chunk_scores)
+                else:
+                    results.append(chunk_scores)
+                if convergence is not None and convergence.update(chunk_scores):
+                    # Remaining workers are terminated when the pool is closed
+                    break
+    finally:
+        PARALLEL_INPUTS.clear()
+
+    if store is not None:
+        store.finalize()
+        scores = store.read()
+    else:
+        scores = [score for chunk_scores in results for score in chunk_scores]
+    assert len(scores) == iterations or convergence is not None
+
+    return scores
+
+
+def compute_scores(
+        project, option, iterations, seed=42, datapackage=None, num_workers=1, solver="direct", solver_options=None,
+):
     fp = MC_DIR / f"{option}-{seed}-{iterations}.pickle"
     if fp.exists():
+        # Scores of older runs
         with open(fp, "rb") as f:
             scores = pickle.load(f)
     else:
-        scores = compute_consumption_lcia(project, iterations, seed, datapackage)
-        with open(fp, "wb") as f:
-            pickle.dump(scores, f)
+        scores = compute_consumption_lcia(
+            project, iterations, seed, datapackage, num_workers, solver=solver, solver_options=solver_options,
+            store_dir=MC_DIR / f"{option}-{seed}-{iterations}",
+        )
     return scores
 
 
+def get_paired_scores(Y0, YS, offset=0):
+    """
+    Return LCIA scores of two MC runs with the same seed for the iterations that both of them ran.
+
+    Runs that stop early with a convergence monitor have fewer scores, but their iterations are the first ones of the
+    runs with the same seed, so that scores stay paired.
+    """
+    num_iterations = min(len(Y0), len(YS))
+    return np.array(Y0[:num_iterations]) + offset, np.array(YS[:num_iterations]) + offset
+
+
 def plot_lcia_scores_from_two_cases(Y0, YS, offset=0):
 
-    Y0 = np.array(Y0) + offset
-    YS = np.array(YS) + offset
+    Y0, YS = get_paired_scores(Y0, YS, offset)
 
-    start, end = 0, 50
+    start, end = 0, min(50, len(Y0))
     axis_text = r"$\text{LCIA scores}$"
 
     color1 = COLOR_PSI_BLUE
@@ -101,8 +485,7 @@ def plot_lcia_scores_from_two_cases(Y0, YS, offset=0):
 
 def plot_lcia_scores_from_two_cases_partial(Y0, YS, yaxis_text, offset=0):
 
-    Y0 = np.array(Y0) + offset
-    YS = np.array(YS) + offset
+    Y0, YS = get_paired_scores(Y0, YS, offset)
 
     color2 = COLOR_DARKGRAY_HEX
 
@@ -16,6 +16,7 @@ from fs.zipfs import ZipFS
 from stats_arrays import uncertainty_choices
 from tqdm import tqdm
 from .utils import read_pickle, write_pickle
+from .instrumentation import instrumented, phase
 
 DATA_DIR = Path(__file__).parent.parent.resolve() / "data" / "datapackages"
 FP_PARAMETERS = DATA_DIR / "ecoinvent-parameters.pickle"
@@ -227,15 +228,16 @@ def add_tech_bio_data(
     return technosphere_data, biosphere_data
 
 
-def get_parameterized_values(input_data, num_samples, mask=None, seed=42):
+def get_parameterized_values(input_data, num_samples, mask=None, seed=42, fp_parameters=FP_PARAMETERS):
     tech_data, bio_data = [], []
     params_data = {}
 
-    lookup_cache = get_lookup_cache()
+    with phase("candidate_discovery"):
+        lookup_cache = get_lookup_cache()
 
-    parameters_list = get_parameters(input_data)
-    if mask is not None:
-        parameters_list = parameters_list[mask]
+        parameters_list = get_parameters(input_data, fp_parameters)
+        if mask is not None:
+            parameters_list = parameters_list[mask]
 
     for element in tqdm(parameters_list):
 
@@ -293,9 +295,9 @@ def get_dp_arrays(dict_):
     return indices, data, flip
 
 
-def get_parameters(input_data=None):
-    if FP_PARAMETERS.exists():
-        parameters_list = read_pickle(FP_PARAMETERS)
+def get_parameters(input_data=None, fp=FP_PARAMETERS):
+    if fp.exists():
+        parameters_list = read_pickle(fp)
     else:
         found, errors, unreasonable, missing = 0, 0, 0, 0
 
@@ -346,7 +348,7 @@ def get_parameters(input_data=None):
             > Activities whose formulas produce unreasonable values: {unreasonable}
             > Activities whose formulas contain missing references: {missing}
         """)
-        write_pickle(parameters_list, FP_PARAMETERS)
+        write_pickle(parameters_list, fp)
     return parameters_list
 
 
@@ -462,7 +464,13 @@ def generate_local_sa_datapackage(input_data, const_factor=10.0):
     dp.finalize_serialization()
 
 
-def generate_parameterization_datapackage(filepath, name, num_samples, seed=42, directory=None):
+@instrumented(DATA_DIR, "directory")
+def generate_parameterization_datapackage(filepath, name, num_samples, seed=42, directory=None, input_data=None):
+    """
+    Sample parameters of ecoinvent activities from ecospold2 files in `filepath`, and exchanges whose formulas depend
+    on them. Raw `input_data` in the format of `get_ecoinvent_raw_data`, e.g. of a fixture database, is used instead
+    of the ecospold2 files if given, and its parameterized activities are cached in `directory`.
+    """
 
     directory = directory or DATA_DIR
 
@@ -471,58 +479,69 @@ def generate_parameterization_datapackage(filepath, name, num_samples, seed=42,
 
     if not fp_parameters_datapackage.exists() or not fp_exchanges_datapackage.exists():
 
-        ei_raw_data = get_ecoinvent_raw_data(filepath)
-        tech_data, bio_data, params_data = get_parameterized_values(ei_raw_data, num_samples=num_samples, seed=seed)
+        if input_data is None:
+            with phase("loading"):
+                input_data = get_ecoinvent_raw_data(filepath)
+            fp_parameters = FP_PARAMETERS
+        else:
+            fp_parameters = directory / f"{name}-parameters.pickle"
 
-        # 1. Create datapackage with parameters values
-        pdp = bwp.create_datapackage(
-            fs=ZipFS(str(fp_parameters_datapackage), write=True),
-            seed=seed,
-            sequential=True,
-        )
-        pdp.add_persistent_array(
-            # matrix="technosphere_matrix",
-            matrix="parameters",
-            data_array=np.vstack(list(params_data.values())),
-            name=f"ecoinvent-parameters",
-            indices_array=np.array(list(params_data), dtype=PARAMS_DTYPE),
-            flip_array=np.ones(len(params_data), dtype=bool),
-        )
+        with phase("sampling"):
+            tech_data, bio_data, params_data = get_parameterized_values(
+                input_data, num_samples=num_samples, seed=seed, fp_parameters=fp_parameters,
+            )
 
-        # 2. Create datapackage with parameterized exchanges
-        edp = bwp.create_datapackage(
-            fs=ZipFS(str(fp_exchanges_datapackage), write=True),
-            seed=seed,
-            sequential=True,
-        )
+        with phase("serialization"):
+            # 1. Create datapackage with parameters values
+            pdp = bwp.create_datapackage(
+                fs=ZipFS(str(fp_parameters_datapackage), write=True),
+                seed=seed,
+                sequential=True,
+            )
+            pdp.add_persistent_array(
+                # matrix="technosphere_matrix",
+                matrix="parameters",
+                data_array=np.vstack(list(params_data.values())),
+                name=f"ecoinvent-parameters",
+                indices_array=np.array(list(params_data), dtype=PARAMS_DTYPE),
+                flip_array=np.ones(len(params_data), dtype=bool),
+            )
 
-        indices = np.empty(len(tech_data), dtype=bwp.INDICES_DTYPE)
-        indices[:] = [x for x, y, z, _ in tech_data]
-        edp.add_persistent_array(
-            matrix="technosphere_matrix",
-            data_array=np.vstack([y for x, y, z, _ in tech_data]),
-            name="parameterized-tech",
-            indices_array=indices,
-            flip_array=np.hstack([z for x, y, z, _ in tech_data]),
-        )
+            # 2. Create datapackage with parameterized exchanges
+            edp = bwp.create_datapackage(
+                fs=ZipFS(str(fp_exchanges_datapackage), write=True),
+                seed=seed,
+                sequential=True,
+            )
 
-        indices = np.empty(len(bio_data), dtype=bwp.INDICES_DTYPE)
-        indices[:] = [x for x, y, z, _ in bio_data]
-        edp.add_persistent_array(
-            matrix="biosphere_matrix",
-            data_array=np.vstack([y for x, y, z, _ in bio_data]),
-            name="parameterized-bio",
-            indices_array=indices,
-            flip_array=np.hstack([z for x, y, z, _ in bio_data]),
-        )
+            indices = np.empty(len(tech_data), dtype=bwp.INDICES_DTYPE)
+            indices[:] = [x for x, y, z, _ in tech_data]
+            edp.add_persistent_array(
+                matrix="technosphere_matrix",
+                data_array=np.vstack([y for x, y, z, _ in tech_data]),
+                name="parameterized-tech",
+                indices_array=indices,
+                flip_array=np.hstack([z for x, y, z, _ in tech_data]),
+            )
+
+            indices = np.empty(len(bio_data), dtype=bwp.INDICES_DTYPE)
+            indices[:] = [x for x, y, z, _ in bio_data]
+            edp.add_persistent_array(
+                matrix="biosphere_matrix",
+                data_array=np.vstack([y for x, y, z, _ in bio_data]),
+                name="parameterized-bio",
+                indices_array=indices,
+                flip_array=np.hstack([z for x, y, z, _ in bio_data]),
+            )
 
-        pdp.finalize_serialization()
-        edp.finalize_serialization()
+            pdp.finalize_serialization()
+            edp.finalize_serialization()
 
     else:
 
-        pdp = bwp.load_datapackage(ZipFS(str(fp_parameters_datapackage)))
-        edp = bwp.load_datapackage(ZipFS(str(fp_exchanges_datapackage)))
+        with phase("loading"):
+            pdp = bwp.load_datapackage(ZipFS(str(fp_parameters_datapackage)))
+            edp = bwp.load_datapackage(ZipFS(str(fp_exchanges_datapackage)))
 
     return pdp, edp
 
@@ -0,0 +1,107 @@
+import queue
+import threading
+
+from .matrix_updates import rebuild_matrix_inplace
+from .instrumentation import phase
+
+# Number of iterations whose samples are prepared ahead of the current solve
+PREFETCH_QUEUE_SIZE = 2
+
+
+def sample_mapped_matrix(mapped_matrix):
+    """Advance indexers of `mapped_matrix` and return rows, columns and data of all its resource groups."""
+    mapped_matrix.iterate_indexers()
+    return [group.calculate() for group in mapped_matrix.groups]
+
+
+def rebuild_mapped_matrix(mapped_matrix, arrays):
+    """Same as `mapped_matrix.rebuild_matrix()`, but with rows, columns and data that were computed beforehand."""
+    if hasattr(mapped_matrix, "group_positions"):
+        # Matrix is updated in place, see `akula.matrix_updates.use_inplace_updates`
+        return rebuild_matrix_inplace(mapped_matrix, arrays, mapped_matrix.group_positions)
+    mapped_matrix.matrix.data *= 0
+    for group, (row, col, data) in zip(mapped_matrix.groups, arrays):
+        if group.package.metadata["sum_inter_duplicates"]:
+            mapped_matrix.matrix[row, col] += data
+        else:
+            mapped_matrix.matrix[row, col] = data
+
+
+class PrefetchingIterator:
+    """
+    Iterate `lca` for `iterations` MC iterations, and sample data of the next iteration while the current one is solved.
+
+    A worker thread draws samples and indexes data arrays of all resource groups, in the same order as `next(lca)`,
+    and puts them into a queue of at most `queue_size` iterations. The main thread rebuilds the matrices from these
+    samples and solves the LCI and LCIA problems, so that scores are identical to a serial run with the same seed.
+    Matrices are only modified by the main thread, between two solves.
+
+    `lca` must be prepared with `lci` and `lcia` beforehand. Each call of `next` updates `lca.score` like `next(lca)`,
+    and the iterator can be used in place of `lca` in loops, e.g. `[lca.score for _ in PrefetchingIterator(lca, n)]`.
+    Call `close` when iterations are stopped early, to stop the worker thread.
+    """
+    def __init__(self, lca, iterations, queue_size=PREFETCH_QUEUE_SIZE):
+        self.lca = lca
+        self.iterations = iterations
+        self.count = 0
+        self.labels = [label for label in lca.matrix_labels if hasattr(lca, label)]
+        # First iteration reuses current matrices, see `bc.LCA.keep_first_iteration`
+        self.keep_first = getattr(lca, "keep_first_iteration_flag", False)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.error = None
+        num_sampled = iterations - 1 if self.keep_first else iterations
+        self.thread = threading.Thread(target=self.sample, args=(num_sampled,), daemon=True)
+        self.thread.start()
+
+    def sample(self, num_sampled):
+        try:
+            for _ in range(num_sampled):
+                arrays = {label: sample_mapped_matrix(getattr(self.lca, label)) for label in self.labels}
+                if not self.put(arrays):
+                    return
+        except Exception as e:
+            self.error = e
+            self.put(None)
+
+    def put(self, item):
+        """Put `item` into the queue, waiting for free space until the iterator is closed."""
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.count >= self.iterations:
+            self.close()
+            raise StopIteration
+
+        if self.keep_first and self.count == 0:
+            delattr(self.lca, "keep_first_iteration_flag")
+        else:
+            arrays = self.queue.get()
+            if arrays is None:
+                self.close()
+                raise RuntimeError("Sampling of MC iteration failed in the prefetching thread") from self.error
+            with phase("matrix_building"):
+                for label in self.labels:
+                    rebuild_mapped_matrix(getattr(self.lca, label), arrays[label])
+            if hasattr(self.lca, "after_matrix_iteration"):
+                self.lca.after_matrix_iteration()
+
+        if hasattr(self.lca, "inventory"):
+            self.lca.lci_calculation()
+        if hasattr(self.lca, "characterized_inventory"):
+            self.lca.lcia_calculation()
+        self.count += 1
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
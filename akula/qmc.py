@@ -0,0 +1,183 @@
+import numpy as np
+import bw2data as bd
+import bw2calc as bc
+import bw_processing as bwp
+import stats_arrays as sa
+from fs.zipfs import ZipFS
+from pathlib import Path
+from scipy.stats import qmc
+
+from .utils import get_consumption_activity, get_project_tag, METHOD
+
+QMC_DIR = Path(__file__).parent.parent.resolve() / "data" / "monte-carlo" / "qmc"
+QMC_DIR.mkdir(parents=True, exist_ok=True)
+
+SAMPLING_METHODS = ("random", "latin_hypercube", "sobol")
+
+# Distributions that can be sampled with their inverse CDFs
+PPF_DISTRIBUTIONS = {
+    dist.id: dist for dist in [
+        sa.LognormalUncertainty, sa.NormalUncertainty, sa.TriangularUncertainty, sa.UniformUncertainty,
+    ]
+}
+CERTAIN_DISTRIBUTIONS = [sa.UndefinedUncertainty.id, sa.NoUncertainty.id]
+
+# Uniform samples are kept away from 0 and 1, where inverse CDFs of unbounded distributions are infinite
+UNIFORM_EPSILON = 1e-10
+
+MATRIX_TYPES = ("technosphere", "biosphere", "characterization")
+
+
+def get_uniform_samples(num_dims, num_samples, sampling_method="sobol", seed=42):
+    """
+    Return uniform samples on (0, 1) with `num_dims` rows and `num_samples` columns.
+
+    Sampling methods are pseudo-random ("random"), Latin hypercube ("latin_hypercube") and scrambled Sobol' ("sobol").
+    Scipy supports Sobol' sequences with up to 21201 dimensions, remaining dimensions are padded with a Latin hypercube
+    design. Sobol' sequences are balanced when `num_samples` is a power of 2.
+    """
+    if sampling_method == "random":
+        samples = np.random.default_rng(seed).random((num_samples, num_dims))
+    elif sampling_method == "latin_hypercube":
+        samples = qmc.LatinHypercube(num_dims, seed=seed).random(num_samples)
+    elif sampling_method == "sobol":
+        num_dims_sobol = min(num_dims, qmc.Sobol.MAXDIM)
+        samples = qmc.Sobol(num_dims_sobol, scramble=True, seed=seed).random(num_samples)
+        if num_dims > num_dims_sobol:
+            print(f"Padding {num_dims_sobol} Sobol' dimensions with {num_dims - num_dims_sobol} Latin hypercube ones")
+            padding = qmc.LatinHypercube(num_dims - num_dims_sobol, seed=seed + 1).random(num_samples)
+            samples = np.hstack([samples, padding])
+    else:
+        raise ValueError(f"Unknown sampling method {sampling_method}, choose one of {SAMPLING_METHODS}")
+    return np.clip(samples.T, UNIFORM_EPSILON, 1 - UNIFORM_EPSILON)
+
+
+def get_ppf_samples(params, uniforms):
+    """
+    Map `uniforms` to samples from uncertainty distributions in `params` with stats_arrays inverse CDFs.
+
+    Each row of `uniforms` corresponds to a row in `params`. Bounds of lognormal and normal distributions are applied
+    by clipping, instead of resampling as in stats_arrays.
+    """
+    samples = np.zeros(uniforms.shape)
+    for uncertainty_type in np.unique(params["uncertainty_type"]):
+        if uncertainty_type not in PPF_DISTRIBUTIONS:
+            raise ValueError(f"Inverse CDF sampling is not supported for uncertainty type {uncertainty_type}")
+        where = np.where(params["uncertainty_type"] == uncertainty_type)[0]
+        dist = PPF_DISTRIBUTIONS[uncertainty_type]
+        if dist is sa.LognormalUncertainty:
+            # Lognormal inverse CDF is vectorized only for one column of percentages
+            for j in range(uniforms.shape[1]):
+                samples[where, j] = dist.ppf(params[where], uniforms[where, j].copy()).ravel()
+        else:
+            samples[where] = dist.ppf(params[where], uniforms[where])
+    if params.dtype.names and "minimum" in params.dtype.names:
+        minimum = np.where(np.isnan(params["minimum"]), -np.inf, params["minimum"])
+        maximum = np.where(np.isnan(params["maximum"]), np.inf, params["maximum"])
+        samples = np.clip(samples, minimum[:, np.newaxis], maximum[:, np.newaxis])
+    return samples
+
+
+def get_qmc_samples(params, amounts, num_samples, sampling_method="sobol", seed=42):
+    """Sample all uncertain entries of `params` with `sampling_method`, and repeat `amounts` of all other entries."""
+    uncertain = ~np.isin(params["uncertainty_type"], CERTAIN_DISTRIBUTIONS)
+    samples = np.tile(np.asarray(amounts, dtype=float)[:, np.newaxis], (1, num_samples))
+    uniforms = get_uniform_samples(int(uncertain.sum()), num_samples, sampling_method, seed)
+    samples[uncertain] = get_ppf_samples(params[uncertain], uniforms)
+    return samples
+
+
+def get_uncertain_groups(mapped_matrix):
+    """Return resource groups of `mapped_matrix` that are vectors with uncertainty distributions."""
+    return [
+        group for group in mapped_matrix.groups
+        if (not group.empty) and (not group.is_array()) and group.has_distributions
+    ]
+
+
+def get_uncertain_inputs(mapped_matrix, matrix_type):
+    """
+    Return indices, amounts, uncertainty parameters and flip (only technosphere) of uncertain inputs of `mapped_matrix`.
+
+    Inputs of uncertain groups with `CERTAIN_DISTRIBUTIONS` are left out, so that they don't take columns of the design.
+    """
+    indices, amounts, params, flip = [], [], [], []
+    for group in get_uncertain_groups(mapped_matrix):
+        distributions = group.get_resource_by_suffix("distributions")
+        uncertain = ~np.isin(distributions["uncertainty_type"], CERTAIN_DISTRIBUTIONS)
+        indices.append(group.get_resource_by_suffix("indices")[uncertain])
+        amounts.append(group.get_resource_by_suffix("data")[uncertain])
+        params.append(distributions[uncertain])
+        if matrix_type == "technosphere":
+            flip.append(group.get_resource_by_suffix("flip")[uncertain])
+    flip = np.hstack(flip) if flip else None
+    return np.hstack(indices), np.hstack(amounts), np.hstack(params), flip
+
+
+def create_qmc_datapackage(project, num_samples, sampling_method="sobol", seed=42, method=METHOD):
+    """
+    Create sequential datapackage with samples of all uncertain technosphere, biosphere and characterization inputs.
+
+    One design of `sampling_method` covers inputs of all matrices, and uniform samples are mapped to input values with
+    inverse CDFs of their uncertainty distributions. The datapackage should be used with `use_distributions=False`, so
+    that its columns replace random samples of the ecoinvent and LCIA method datapackages. Datapackages are cached
+    per `project` and LCIA `method`, because indices of inputs differ between them.
+    """
+    name = f"qmc.{get_project_tag(project, method)}.{sampling_method}.{seed}.{num_samples}"
+    fp = QMC_DIR / f"{name}.zip"
+
+    if fp.exists():
+        return bwp.load_datapackage(ZipFS(str(fp)))
+
+    bd.projects.set_current(project)
+    activity = get_consumption_activity()
+    fu, pkgs, _ = bd.prepare_lca_inputs({activity: 1}, method=method, remapping=False)
+    lca = bc.LCA(demand=fu, data_objs=pkgs)
+    lca.load_lci_data()
+    lca.load_lcia_data()
+
+    indices, params, amounts, flip, sizes = [], [], [], [], []
+    for matrix_type in MATRIX_TYPES:
+        matrix_indices, matrix_amounts, matrix_params, matrix_flip = get_uncertain_inputs(
+            getattr(lca, f"{matrix_type}_mm"), matrix_type
+        )
+        indices.append(matrix_indices)
+        amounts.append(matrix_amounts)
+        params.append(matrix_params)
+        if matrix_type == "technosphere":
+            flip.append(matrix_flip)
+        sizes.append(len(matrix_indices))
+
+    samples = get_qmc_samples(np.hstack(params), np.hstack(amounts), num_samples, sampling_method, seed)
+    ends = np.cumsum(sizes)
+
+    dp = bwp.create_datapackage(
+        fs=ZipFS(str(fp), write=True),
+        name=name,
+        seed=seed,
+        sequential=True,
+    )
+    for i, matrix_type in enumerate(MATRIX_TYPES):
+        data_array = samples[ends[i] - sizes[i]:ends[i]]
+        if matrix_type == "technosphere":
+            dp.add_persistent_array(
+                matrix=f"{matrix_type}_matrix",
+                data_array=data_array,
+                name=f"{name}.{matrix_type}",
+                indices_array=indices[i],
+                flip_array=flip[0],
+            )
+        else:
+            dp.add_persistent_array(
+                matrix=f"{matrix_type}_matrix",
+                data_array=data_array,
+                name=f"{name}.{matrix_type}",
+                indices_array=indices[i],
+            )
+    [
+        d.update({"global_index": 1}) for d in dp.metadata['resources']
+        if d['matrix'] == "characterization_matrix"
+    ]
+    dp.finalize_serialization()
+
+    return dp
@@ -0,0 +1,188 @@
+import json
+import os
+import hashlib
+import numpy as np
+from pathlib import Path
+
+from .prefetch import PrefetchingIterator
+from .instrumentation import phase
+
+MANIFEST_NAME = "manifest.json"
+SCORES_NAME = "scores.npy"
+
+# Number of MC iterations after which scores are written to disk
+FLUSH_EVERY = 100
+
+
+def get_datapackage_fingerprint(dp):
+    """Return short hash of datapackage metadata that does not depend on its random id and creation time."""
+    metadata = {k: v for k, v in dp.metadata.items() if k not in ["id", "created"]}
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class ScoreStore:
+    """
+    Append-only store of Monte Carlo scores in a `directory`.
+
+    Scores are written in chunks to `.npy` files, and the list of complete chunks is kept in a JSON manifest, together
+    with the project, seed, number of iterations and fingerprints of datapackages used in the simulations. The `mode`
+    of the run ("serial" or "parallel"), the `chunk_size` of parallel runs and the `sampling_method` are kept as well,
+    because they change the random streams for the same seed. Reopening an existing store with different settings
+    raises an error. Settings of a `convergence` monitor are only recorded, because early-stopped runs can be resumed
+    with other targets. After `finalize`, all chunks are merged into one file, and `read` returns scores as a
+    memory-mapped array.
+    """
+    def __init__(
+            self, directory, project=None, seed=None, iterations=None, datapackages=None, mode=None, chunk_size=None,
+            sampling_method=None, convergence=None,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        settings = {
+            "project": project,
+            "seed": None if seed is None else int(seed),
+            "iterations": None if iterations is None else int(iterations),
+            "fingerprints": None if datapackages is None else [get_datapackage_fingerprint(dp) for dp in datapackages],
+            "mode": mode,
+            "chunk_size": None if chunk_size is None else int(chunk_size),
+            "sampling_method": sampling_method,
+        }
+
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+            for key, value in settings.items():
+                # Settings that are not given are not checked, e.g. when scores are only read
+                if value is not None and self.manifest.get(key) != value:
+                    raise ValueError(
+                        f"Score store in {self.directory} was created with different {key}, remove it to start over"
+                    )
+        else:
+            self.manifest = dict(**settings, convergence=None, chunks=[], complete=False)
+        if convergence is not None:
+            self.manifest["convergence"] = convergence.settings
+        self.write_manifest()
+
+    @property
+    def manifest_path(self):
+        return self.directory / MANIFEST_NAME
+
+    @property
+    def complete(self):
+        return self.manifest["complete"]
+
+    @property
+    def num_iterations(self):
+        """Number of scores that are safely written to disk."""
+        if self.complete:
+            return len(self.read())
+        chunks = self.manifest["chunks"]
+        return chunks[-1]["end"] if chunks else 0
+
+    def write_manifest(self):
+        # Write to a temporary file first, so that the manifest is never left half-written
+        fp_temp = self.manifest_path.with_suffix(".tmp")
+        with open(fp_temp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(fp_temp, self.manifest_path)
+
+    def append(self, scores):
+        """Write `scores` to a new chunk, and register it in the manifest."""
+        if self.complete:
+            raise ValueError(f"Score store in {self.directory} is already finalized")
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            return
+        start = self.num_iterations
+        end = start + len(scores)
+        name = f"scores.{start:09d}_{end:09d}.npy"
+        fp_temp = self.directory / f"{name}.tmp"
+        with phase("storing"), open(fp_temp, "wb") as f:
+            np.save(f, scores)
+        os.replace(fp_temp, self.directory / name)
+        self.manifest["chunks"].append({"file": name, "start": start, "end": end})
+        self.write_manifest()
+
+    def finalize(self):
+        """Merge all chunks into one `.npy` file."""
+        if self.complete:
+            return
+        fp_temp = self.directory / f"{SCORES_NAME}.tmp"
+        scores = np.lib.format.open_memmap(fp_temp, mode="w+", dtype=np.float64, shape=(self.num_iterations,))
+        for chunk in self.manifest["chunks"]:
+            scores[chunk["start"]:chunk["end"]] = np.load(self.directory / chunk["file"])
+        scores.flush()
+        del scores
+        os.replace(fp_temp, self.directory / SCORES_NAME)
+
+        chunks = self.manifest["chunks"]
+        self.manifest.update(chunks=[], complete=True)
+        self.write_manifest()
+        for chunk in chunks:
+            (self.directory / chunk["file"]).unlink()
+
+    def reopen(self):
+        """Turn merged scores of a finalized store back into one chunk, so that more scores can be appended."""
+        if not self.complete:
+            return
+        num_iterations = self.num_iterations
+        name = f"scores.{0:09d}_{num_iterations:09d}.npy"
+        os.replace(self.directory / SCORES_NAME, self.directory / name)
+        self.manifest.update(chunks=[{"file": name, "start": 0, "end": num_iterations}], complete=False)
+        self.write_manifest()
+
+    def read(self):
+        """Return all scores written to disk, as a memory-mapped array if the store is finalized."""
+        if self.complete:
+            return np.load(self.directory / SCORES_NAME, mmap_mode="r")
+        chunks = [np.load(self.directory / chunk["file"], mmap_mode="r") for chunk in self.manifest["chunks"]]
+        return np.concatenate(chunks) if chunks else np.array([], dtype=np.float64)
+
+
+def advance_lca(lca, num_iterations):
+    """Iterate all matrices of `lca` by `num_iterations` without solving the linear system."""
+    if num_iterations > 0 and getattr(lca, "keep_first_iteration_flag", False):
+        # First iteration reuses current matrices
+        delattr(lca, "keep_first_iteration_flag")
+        num_iterations -= 1
+    for label in lca.matrix_labels:
+        if hasattr(lca, label):
+            mm = getattr(lca, label)
+            for _ in range(num_iterations):
+                next(mm)
+
+
+def iterate_lca_to_store(lca, iterations, store, flush_every=FLUSH_EVERY, convergence=None, prefetch=False):
+    """
+    Iterate `lca` and append LCIA scores to `store`, resuming after the last iteration that was written to disk.
+
+    Scores are the same as `[lca.score for _ in zip(range(iterations), lca)]` for an uninterrupted run. If a
+    `convergence` monitor is given, iterations stop as soon as it reports convergence. If `prefetch` is True, samples
+    of the next iteration are drawn in a background thread, see `akula.prefetch.PrefetchingIterator`.
+    """
+    start = store.num_iterations
+    if start > 0:
+        print(f"Resuming MC simulations from iteration {start} in {store.directory}")
+        if convergence is not None:
+            convergence.update(store.read())
+    advance_lca(lca, start)
+
+    iterator = PrefetchingIterator(lca, iterations - start) if prefetch else lca
+    scores = []
+    for _ in range(start, iterations):
+        if convergence is not None and convergence.converged:
+            break
+        next(iterator)
+        scores.append(lca.score)
+        if convergence is not None:
+            convergence.update(lca.score)
+        if len(scores) == flush_every:
+            store.append(scores)
+            scores = []
+    if prefetch:
+        iterator.close()
+    store.append(scores)
+    store.finalize()
+
+    return store.read()
@@ -7,11 +7,20 @@ from .validation import (
     run_mc_simulations_wo_noninf,
     run_mc_simulations_wo_lowinf_lsa,
     run_mc_simulations_wo_lowinf_xgb,
+    run_mc_simulations_crn,
+    get_noninf_masks,
+    get_lowinf_lsa_masks,
+    get_lowinf_xgb_masks,
     create_all_datapackages,
 )
 from .high_dimensional_screening import (
     run_mc_simulations_screening,
     train_xgboost_model,
+    run_screening_incremental,
     get_masks_wo_lowinf_xgb,
+    get_feature_store,
+    get_feature_layout,
 )
+from .feature_store import FeatureStore
 from .ranking import get_ranked_list
+from .variance_propagation import get_first_order_variances, get_explained_variance
@@ -0,0 +1,135 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+
+from ..utils import get_index_positions
+
+MANIFEST_NAME = "manifest.json"
+FEATURES_NAME = "features.npy"
+
+# Number of MC iterations that are read at once in `FeatureStore.iter_row_blocks`
+ROW_BLOCK_SIZE = 5_000
+
+
+class FeatureStore:
+    """
+    Memory-mapped store of features X of high-dimensional screening in a `directory`, with one row per MC iteration
+    and one column per model input.
+
+    Columns are grouped into blocks of input types, e.g. technosphere, biosphere, characterization and
+    parameterization, in the order of `indices`. Indices of each block are saved next to the features, together with
+    `masks` of independent inputs that are replaced by sampling modules. Features are written batch by batch into one
+    `.npy` file, and batches that are written are registered in a JSON manifest, so that building the store can be
+    resumed. Rows are read in blocks, so that X is never loaded into memory as a whole.
+    """
+    def __init__(self, directory, num_iterations=None, indices=None, masks=None, dtype=np.float64):
+        self.directory = Path(directory)
+
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+            if num_iterations is not None and self.manifest["num_iterations"] != num_iterations:
+                raise ValueError(
+                    f"Feature store in {self.directory} has a different number of iterations, remove it to start over"
+                )
+        elif indices is None or num_iterations is None:
+            raise ValueError(f"Feature store in {self.directory} does not exist")
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            blocks, start = [], 0
+            for name, block_indices in indices.items():
+                np.save(self.directory / f"indices.{name}.npy", block_indices)
+                blocks.append({"name": name, "start": start, "end": start + len(block_indices)})
+                start += len(block_indices)
+            masks = masks or {}
+            for name, mask in masks.items():
+                np.save(self.directory / f"mask.{name}.npy", mask)
+
+            np.lib.format.open_memmap(
+                self.directory / FEATURES_NAME, mode="w+", dtype=dtype, shape=(num_iterations, start),
+            ).flush()
+            self.manifest = dict(
+                num_iterations=int(num_iterations), num_features=start, dtype=np.dtype(dtype).str, blocks=blocks,
+                masks=list(masks), batches=[], complete=False,
+            )
+            self.write_manifest()
+
+    @property
+    def manifest_path(self):
+        return self.directory / MANIFEST_NAME
+
+    @property
+    def complete(self):
+        return self.manifest["complete"]
+
+    @property
+    def num_iterations(self):
+        return self.manifest["num_iterations"]
+
+    @property
+    def num_features(self):
+        return self.manifest["num_features"]
+
+    @property
+    def features(self):
+        """Read-only memory-mapped features with shape ``(num_iterations, num_features)``."""
+        if not self.complete:
+            raise ValueError(f"Feature store in {self.directory} is not complete")
+        return np.load(self.directory / FEATURES_NAME, mmap_mode="r")
+
+    def write_manifest(self):
+        # Write to a temporary file first, so that the manifest is never left half-written
+        fp_temp = self.manifest_path.with_suffix(".tmp")
+        with open(fp_temp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(fp_temp, self.manifest_path)
+
+    def has_batch(self, start):
+        return any(batch["start"] == start for batch in self.manifest["batches"])
+
+    def write_batch(self, start, data):
+        """Write `data` of one MC batch, with model inputs in rows as in datapackages, to rows from `start` on."""
+        if data.shape[0] != self.num_features:
+            raise ValueError(f"Batch has {data.shape[0]} inputs, but the feature store has {self.num_features}")
+        end = start + data.shape[1]
+        features = np.load(self.directory / FEATURES_NAME, mmap_mode="r+")
+        features[start:end] = data.T
+        features.flush()
+        del features
+
+        self.manifest["batches"].append({"start": int(start), "end": int(end)})
+        self.manifest["complete"] = sum(b["end"] - b["start"] for b in self.manifest["batches"]) == self.num_iterations
+        self.write_manifest()
+
+    def get_indices(self):
+        """Return dictionary with indices of model inputs in each block, in the order of columns."""
+        return {
+            block["name"]: np.load(self.directory / f"indices.{block['name']}.npy")
+            for block in self.manifest["blocks"]
+        }
+
+    def get_masks(self):
+        """Return dictionary with masks of independent inputs that are kept, i.e. not replaced by sampling modules."""
+        return {name: np.load(self.directory / f"mask.{name}.npy") for name in self.manifest["masks"]}
+
+    def get_block(self, name):
+        """Return first and last column of the block `name`."""
+        block = [block for block in self.manifest["blocks"] if block["name"] == name][0]
+        return block["start"], block["end"]
+
+    def get_columns(self, name, indices):
+        """Return columns of model inputs with `indices` from the block `name`."""
+        start, _ = self.get_block(name)
+        return start + get_index_positions(np.load(self.directory / f"indices.{name}.npy"), indices)
+
+    def read(self, start=0, stop=None, columns=None):
+        """Read rows from `start` to `stop` into memory, with all columns or only the given `columns`."""
+        rows = self.features[start:stop]
+        return np.array(rows) if columns is None else rows[:, columns]
+
+    def iter_row_blocks(self, block_size=ROW_BLOCK_SIZE, start=0, stop=None):
+        """Iterate over rows from `start` to `stop` in blocks of `block_size` rows, yielding first row and block."""
+        stop = self.num_iterations if stop is None else stop
+        for block_start in range(start, stop, block_size):
+            yield block_start, self.read(block_start, min(block_start + block_size, stop))
@@ -6,12 +6,17 @@ import bw2calc as bc
 from fs.zipfs import ZipFS
 from matrix_utils.resource_group import FakeRNG
 import xgboost as xgb
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, explained_variance_score
 import json
 
-from .utils import get_mask
-from ..utils import read_pickle, write_pickle, get_consumption_activity
+from .utils import get_mask, get_noninf_tag, get_screening_method_tag
+from .feature_store import FeatureStore, MANIFEST_NAME as FEATURES_MANIFEST_NAME
+from .xgboost_streaming import MAX_BIN, get_quantized_store, get_external_dmatrix, predict_in_blocks
+from ..utils import read_pickle, write_pickle, get_consumption_activity, METHOD
+from ..solvers import get_lca_class
+from ..score_store import ScoreStore, iterate_lca_to_store
+from ..qmc import get_qmc_samples
+from ..instrumentation import instrumented, instrument_lca
 from ..sensitivity_analysis import create_all_datapackages
 from .remove_lowly_influential import get_tmask_wo_lowinf, get_bmask_wo_lowinf, get_cmask_wo_lowinf, get_pmask_wo_lowinf
 
@@ -29,12 +34,11 @@ MC_BATCH_SIZE = 5_000
 N_BATCH_CONST = 2_000
 
 
-def get_lca_stochastic(project, seed):
+def get_lca_stochastic(project, seed, method=METHOD):
 
     bd.projects.set_current(project)
 
     act = get_consumption_activity()
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     fu_mapped, pkgs, _ = bd.prepare_lca_inputs(demand={act: 1}, method=method, remapping=False)
 
     lca = bc.LCA(demand=fu_mapped, data_objs=pkgs, use_distributions=True, seed_override=seed)
@@ -44,10 +48,30 @@ def get_lca_stochastic(project, seed):
     return lca
 
 
-def create_background_datapackage(project, matrix_type, mask, num_samples, seed=42):
+def get_background_name(matrix_type, seed, num_samples, sampling_method="random", screening_method="sct"):
+    """Return name of the datapackage with samples of background inputs of the `matrix_type` matrix."""
+    name = get_screening_method_tag(matrix_type, screening_method)
+    if sampling_method != "random":
+        name = f"{name}.{sampling_method}"
+    return f"{name}.{seed}.{num_samples}"
 
-    name = f"{matrix_type}.{seed}.{num_samples}"
-    fp = SCREENING_DIR / f"{name}.zip"
+
+def create_background_datapackage(
+        project, matrix_type, mask, num_samples, seed=42, sampling_method="random", screening_method="sct",
+        directory=None,
+):
+    """
+    Create sequential datapackage with samples of `mask`ed background inputs of the `matrix_type` matrix.
+
+    If `sampling_method` is "latin_hypercube" or "sobol", samples come from a low-discrepancy design mapped through
+    inverse CDFs of uncertainty distributions, see `akula.qmc`, instead of the random number generators of the LCA.
+    The `screening_method` that found the `mask` is part of the name, so that datapackages of other masks are not
+    reused. Datapackages are written to `directory`, which is `SCREENING_DIR` by default.
+    """
+
+    directory = directory or SCREENING_DIR
+    name = get_background_name(matrix_type, seed, num_samples, sampling_method, screening_method)
+    fp = directory / f"{name}.zip"
 
     if fp.exists():
         dp = bwp.load_datapackage(ZipFS(str(fp)))
@@ -70,16 +94,25 @@ def create_background_datapackage(project, matrix_type, mask, num_samples, seed=
             if (not isinstance(group.rng, FakeRNG)) and (not group.empty) and (len(group.package.data) == num_resources)
         ])
 
-        data = []
-        np.random.seed(seed)
-        for _ in range(num_samples):
-            next(obj)
-            idata = []
-            for group in obj.groups:
-                if (not isinstance(group.rng, FakeRNG)) and (not group.empty):
-                    idata.append(group.rng.random_data)
-            data.append(np.hstack(idata)[mask])
-        data_array = np.vstack(data).T
+        if sampling_method == "random":
+            data = []
+            np.random.seed(seed)
+            for _ in range(num_samples):
+                next(obj)
+                idata = []
+                for group in obj.groups:
+                    if (not isinstance(group.rng, FakeRNG)) and (not group.empty):
+                        idata.append(group.rng.random_data)
+                data.append(np.hstack(idata)[mask])
+            data_array = np.vstack(data).T
+        else:
+            groups = [
+                group for group in obj.groups if (not isinstance(group.rng, FakeRNG)) and (not group.empty)
+                and (len(group.package.data) == num_resources)
+            ]
+            params = np.hstack([group.package.data[2] for group in groups])[mask]
+            amounts = np.hstack([group.package.data[1] for group in groups])[mask]
+            data_array = get_qmc_samples(params, amounts, num_samples, sampling_method, seed)
 
         if matrix_type == "technosphere":
             flip_array = np.hstack([
@@ -111,30 +144,54 @@ def create_background_datapackage(project, matrix_type, mask, num_samples, seed=
     return dp
 
 
-def create_tech_bio_cf_datapackages(project, factor, cutoff, max_calc, iterations, seed, num_lowinf):
+def create_tech_bio_cf_datapackages(
+        project, factor, cutoff, max_calc, iterations, seed, num_lowinf, screening_method="sct", masks=None,
+        directory=None,
+):
+    """
+    Create background datapackages of TECH, BIO and CF inputs that vary in screening.
 
-    tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
+    Masks of inputs are read from the results of local SA, unless `masks` with TECH, BIO and CF masks are given, e.g.
+    in benchmarks. Datapackages are written to `directory`, see `create_background_datapackage`.
+    """
 
-    fp_tech = GSA_DIR / f"mask.tech.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
-    fp_bio = GSA_DIR / f"mask.bio.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
-    fp_cf = GSA_DIR / f"mask.cf.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
+    if masks is None:
+        tag = get_noninf_tag(cutoff, max_calc, screening_method)
 
-    tmask = read_pickle(fp_tech)
-    bmask = read_pickle(fp_bio)
-    cmask = read_pickle(fp_cf)
+        fp_tech = GSA_DIR / f"mask.tech.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
+        fp_bio = GSA_DIR / f"mask.bio.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
+        fp_cf = GSA_DIR / f"mask.cf.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
 
-    tdp = create_background_datapackage(project, "technosphere", tmask, iterations, seed)
-    bdp = create_background_datapackage(project, "biosphere", bmask, iterations, seed)
-    cdp = create_background_datapackage(project, "characterization", cmask, iterations, seed)
+        masks = {
+            "technosphere": read_pickle(fp_tech),
+            "biosphere": read_pickle(fp_bio),
+            "characterization": read_pickle(fp_cf),
+        }
+
+    tdp = create_background_datapackage(
+        project, "technosphere", masks["technosphere"], iterations, seed, screening_method=screening_method,
+        directory=directory,
+    )
+    bdp = create_background_datapackage(
+        project, "biosphere", masks["biosphere"], iterations, seed, screening_method=screening_method,
+        directory=directory,
+    )
+    cdp = create_background_datapackage(
+        project, "characterization", masks["characterization"], iterations, seed, screening_method=screening_method,
+        directory=directory,
+    )
 
     return [tdp, bdp, cdp]
 
 
 def get_datapackages_screening(
-        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations,
+        screening_method="sct", masks=None, directory=None,
 ):
-    """Create all datapackages for high-dimensional screening."""
-    dp_base = create_tech_bio_cf_datapackages(project, factor, cutoff, max_calc, iterations, seed, num_lowinf)
+    """Create all datapackages for high-dimensional screening, see `create_tech_bio_cf_datapackages`."""
+    dp_base = create_tech_bio_cf_datapackages(
+        project, factor, cutoff, max_calc, iterations, seed, num_lowinf, screening_method, masks, directory
+    )
     dps = dp_base
     if correlations:
         dp_modules = create_all_datapackages(fp_ecoinvent, project, iterations, seed, SCREENING_DIR_CORR)
@@ -142,32 +199,51 @@ def get_datapackages_screening(
     return dps
 
 
+@instrumented(SCREENING_DIR, "store_dir")
 def compute_consumption_lcia_screening(
-        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver="direct",
+        solver_options=None, screening_method="sct", store_dir=None, masks=None, directory=None,
 ):
+    """
+    Run MC simulations with background inputs from sequential datapackages of high-dimensional screening.
+
+    `masks` and `directory` are passed to `get_datapackages_screening`, and scores are written to a `ScoreStore` in
+    `store_dir` if it is given.
+    """
 
     bd.projects.set_current(project)
 
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     activity = get_consumption_activity()
-    fu, pkgs, _ = bd.prepare_lca_inputs({activity: 1}, method=method, remapping=False)
+    fu, pkgs, _ = bd.prepare_lca_inputs({activity: 1}, method=METHOD, remapping=False)
 
     datapackages = get_datapackages_screening(
-        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, screening_method,
+        masks, directory,
     )
 
-    lca = bc.LCA(
+    store = None
+    if store_dir is not None:
+        store = ScoreStore(store_dir, project, seed, iterations, pkgs + datapackages, mode="serial")
+        if store.complete:
+            return store.read()
+
+    lca = get_lca_class(solver)(
         demand=fu,
         data_objs=pkgs + datapackages,
         use_arrays=True,
         use_distributions=False,
         # seed_override=seed,
+        **(solver_options or dict()),
     )
+    instrument_lca(lca)
     lca.lci()
     lca.lcia()
 
     lca.keep_first_iteration()
 
+    if store is not None:
+        return iterate_lca_to_store(lca, iterations, store)
+
     scores = [lca.score for _ in zip(range(iterations), lca)]
 
     return scores
@@ -184,51 +260,81 @@ def get_random_seeds(iterations, seed):
     return starts, n_batches, seeds
 
 
+def get_scores_name(num_lowinf, seed, iterations, screening_method="sct"):
+    """Return name of LCIA scores of high-dimensional screening."""
+    tag = get_screening_method_tag(f"without_lowinf.{num_lowinf}", screening_method)
+    return f"scores.{tag}.{seed}.{iterations}"
+
+
+def get_scores_batch(
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver="direct",
+        solver_options=None, screening_method="sct",
+):
+    """Return LCIA scores of one MC batch for screening, computed or read from scores of older runs."""
+    directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
+    name = get_scores_name(num_lowinf, seed, iterations, screening_method)
+    fp = directory / f"{name}.pickle"
+    if fp.exists():
+        return read_pickle(fp)
+    return compute_consumption_lcia_screening(
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver,
+        solver_options, screening_method, store_dir=directory / name,
+    )
+
+
 def run_mc_simulations_screening(
-        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations,
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver="direct",
+        solver_options=None, screening_method="sct",
 ):
-    """Run Monte Carlo simulations for high-dimensional screening."""
+    """
+    Run Monte Carlo simulations for high-dimensional screening.
+
+    Scores of each batch are written to a `ScoreStore`, so that interrupted simulations resume from the last written
+    iteration. Scores of all batches are then merged into one store and returned as a memory-mapped array.
+    """
     directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
-    fp = directory / f"scores.without_lowinf.{num_lowinf}.{seed}.{iterations}.pickle"
+    name = get_scores_name(num_lowinf, seed, iterations, screening_method)
+    fp = directory / f"{name}.pickle"
 
     if fp.exists():
-        scores = read_pickle(fp)
+        # Scores of older runs
+        return read_pickle(fp)
 
-    else:
-        scores = []
+    store_dir = directory / name
+    store = ScoreStore(store_dir, project, seed, iterations)
+
+    if not store.complete:
         starts, n_batches, seeds = get_random_seeds(iterations, seed)
 
         for i in range(n_batches):
             current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - starts[i]
+            if starts[i] + current_iterations <= store.num_iterations:
+                continue
             print(f"MC simulations for screening -- random seed {i+1:2d} / {n_batches:2d} -- {seeds[i]}")
+            scores_current = get_scores_batch(
+                project, fp_ecoinvent, factor, cutoff, max_calc, current_iterations, seeds[i], num_lowinf,
+                correlations, solver, solver_options, screening_method,
+            )
+            store.append(scores_current)
 
-            fp_current = directory / f"scores.without_lowinf.{num_lowinf}.{seeds[i]}.{current_iterations}.pickle"
-
-            if fp_current.exists():
-                scores_current = read_pickle(fp_current)
-            else:
-                scores_current = compute_consumption_lcia_screening(
-                    project, fp_ecoinvent, factor, cutoff, max_calc, current_iterations, seeds[i],
-                    num_lowinf, correlations
-                )
-                write_pickle(scores_current, fp_current)
-
-            scores += scores_current
+        store.finalize()
 
-        write_pickle(scores, fp)
+    return store.read()
 
-    return scores
 
-
-def get_y_scores(iterations, seed, num_lowinf, correlations):
+def get_y_scores(iterations, seed, num_lowinf, correlations, screening_method="sct"):
     directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
-    fp = directory / f"scores.without_lowinf.{num_lowinf}.{seed}.{iterations}.pickle"
-    scores = np.array(read_pickle(fp))
+    name = get_scores_name(num_lowinf, seed, iterations, screening_method)
+    fp = directory / f"{name}.pickle"
+    if fp.exists():
+        scores = np.array(read_pickle(fp))
+    else:
+        scores = ScoreStore(directory / name).read()
     return scores
 
 
-def get_x_data_technosphere(iterations, seed):
-    name = f"technosphere.{seed}.{iterations}"
+def get_x_data_technosphere(iterations, seed, screening_method="sct"):
+    name = get_background_name("technosphere", seed, iterations, screening_method=screening_method)
     fp = SCREENING_DIR / f"{name}.zip"
     dp = bwp.load_datapackage(ZipFS(str(fp)))
     indices = dp.get_resource(f"{name}.indices")[0]
@@ -236,8 +342,8 @@ def get_x_data_technosphere(iterations, seed):
     return data, indices
 
 
-def get_x_data_biosphere(iterations, seed):
-    name = f"biosphere.{seed}.{iterations}"
+def get_x_data_biosphere(iterations, seed, screening_method="sct"):
+    name = get_background_name("biosphere", seed, iterations, screening_method=screening_method)
     fp = SCREENING_DIR / f"{name}.zip"
     dp = bwp.load_datapackage(ZipFS(str(fp)))
     indices = dp.get_resource(f"{name}.indices")[0]
@@ -245,8 +351,8 @@ def get_x_data_biosphere(iterations, seed):
     return data, indices
 
 
-def get_x_data_characterization(iterations, seed):
-    name = f"characterization.{seed}.{iterations}"
+def get_x_data_characterization(iterations, seed, screening_method="sct"):
+    name = get_background_name("characterization", seed, iterations, screening_method=screening_method)
     fp = SCREENING_DIR / f"{name}.zip"
     dp = bwp.load_datapackage(ZipFS(str(fp)))
     indices = dp.get_resource(f"{name}.indices")[0]
@@ -293,88 +399,24 @@ def get_x_data_markets(iterations, seed):
     return data, indices
 
 
-def get_x_data_independent(iterations, seed):
-
-    starts, n_batches, seeds = get_random_seeds(iterations, seed)
-
-    data_technosphere = []
-    data_biosphere = []
-    data_characterization = []
-    tech_indices, bio_indices, cf_indices = None, None, None
-
-    for i in range(n_batches):
-        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - starts[i]
-
-        # if i < 5:
-        #     continue
-
-        tech_data, tech_indices = get_x_data_technosphere(current_iterations, seeds[i])
-        bio_data, bio_indices = get_x_data_biosphere(current_iterations, seeds[i])
-        cf_data, cf_indices = get_x_data_characterization(current_iterations, seeds[i])
-
-        data_technosphere.append(tech_data)
-        data_biosphere.append(bio_data)
-        data_characterization.append(cf_data)
-
-    data_technosphere = np.hstack(data_technosphere)
-    data_biosphere = np.hstack(data_biosphere)
-    data_characterization = np.hstack(data_characterization)
-
-    data = np.vstack([
-        data_technosphere,
-        data_biosphere,
-        data_characterization,
-    ])
+def get_x_batch_independent(iterations, seed, screening_method="sct"):
+    """Return samples of TECH, BIO and CF inputs of one MC batch, with inputs in rows, and their indices."""
+    tech_data, tech_indices = get_x_data_technosphere(iterations, seed, screening_method)
+    bio_data, bio_indices = get_x_data_biosphere(iterations, seed, screening_method)
+    cf_data, cf_indices = get_x_data_characterization(iterations, seed, screening_method)
 
+    data = np.vstack([tech_data, bio_data, cf_data])
     indices = {
         "technosphere": tech_indices,
         "biosphere": bio_indices,
         "characterization": cf_indices,
     }
-
     return data, indices
 
 
-def get_x_data_correlated(iterations, seed):
-
-    data_indp, indices_indp = get_x_data_independent(iterations, seed)
-    len_tech = len(indices_indp["technosphere"])
-    len_bio = len(indices_indp["biosphere"])
-
-    data_technosphere, tech_indices = data_indp[:len_tech, :], indices_indp["technosphere"]
-    data_biosphere, bio_indices = data_indp[len_tech:len_tech+len_bio], indices_indp["biosphere"]
-    data_characterization, cf_indices = data_indp[len_tech+len_bio:], indices_indp["characterization"]
-
-    starts, n_batches, seeds = get_random_seeds(iterations, seed)
-
-    data_parameterization = []
-    data_combustion = []
-    data_entsoe = []
-    data_markets = []
-    ptech_indices, pbio_indices, pindices = None, None, None
-    ctech_indices, cbio_indices, etech_indices, mtech_indices = None, None, None, None
-
-    for i in range(n_batches):
-        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - starts[i]
-
-        # if i < 5:
-        #     continue
-
-        pdata, pindices, ptech_indices, pbio_indices = get_x_data_parameterization(current_iterations, seeds[i])
-        ctech_data, ctech_indices, cbio_indices = get_x_data_combustion(current_iterations, seeds[i])
-        etech_data, etech_indices = get_x_data_entsoe(current_iterations, seeds[i])
-        mtech_data, mtech_indices = get_x_data_markets(current_iterations, seeds[i])
-
-        data_parameterization.append(pdata)
-        data_combustion.append(ctech_data)
-        data_entsoe.append(etech_data)
-        data_markets.append(mtech_data)
-
-    data_parameterization = np.hstack(data_parameterization)
-    data_combustion = np.hstack(data_combustion)
-    data_entsoe = np.hstack(data_entsoe)
-    data_markets = np.hstack(data_markets)
-
+def get_replacement_masks(tech_indices, bio_indices, ptech_indices, pbio_indices, ctech_indices, cbio_indices,
+                          etech_indices, mtech_indices):
+    """Return masks of independent TECH and BIO inputs that are kept, i.e. not replaced by sampling modules."""
     # 1. Parameterized exchanges from technosphere and biosphere should be removed, because they are dependent inputs
     ptech_mask = get_mask(tech_indices, ptech_indices)
     pbio_mask = get_mask(bio_indices, pbio_indices)
@@ -387,58 +429,285 @@ def get_x_data_correlated(iterations, seed):
     # 4 Market data should replace respective technosphere exchanges
     mtech_mask = get_mask(tech_indices, mtech_indices)
     # Collect masks from all sampling modules
-    tech_mask = ~(ptech_mask | ctech_mask | etech_mask | mtech_mask)
-    bio_mask = ~(pbio_mask | cbio_mask)
+    return {
+        "technosphere": ~(ptech_mask | ctech_mask | etech_mask | mtech_mask),
+        "biosphere": ~(pbio_mask | cbio_mask),
+    }
 
-    data_technosphere = np.vstack([data_technosphere[tech_mask, :], data_combustion, data_entsoe, data_markets])
-    data_biosphere = data_biosphere[bio_mask, :]
-    data = np.vstack([
-        data_technosphere,
-        data_biosphere,
-        data_characterization,
-        data_parameterization
-    ])
 
-    tech_indices = np.hstack([tech_indices[tech_mask], ctech_indices, etech_indices, mtech_indices],
+def get_correlated_indices(indices_indp, pindices, ptech_indices, pbio_indices, ctech_indices, cbio_indices,
+                           etech_indices, mtech_indices):
+    """
+    Return indices of all inputs in the order of rows of `get_x_batch_correlated`, and masks of independent inputs that
+    are kept.
+    """
+    tech_indices, bio_indices, cf_indices = indices_indp.values()
+    masks = get_replacement_masks(
+        tech_indices, bio_indices, ptech_indices, pbio_indices, ctech_indices, cbio_indices, etech_indices,
+        mtech_indices,
+    )
+    tech_indices = np.hstack([tech_indices[masks["technosphere"]], ctech_indices, etech_indices, mtech_indices],
                              dtype=bwp.INDICES_DTYPE)
-    bio_indices = bio_indices[bio_mask]
     indices = {
         "technosphere": tech_indices,
-        "biosphere": bio_indices,
+        "biosphere": bio_indices[masks["biosphere"]],
         "characterization": cf_indices,
         "parameterization": pindices,
     }
+    return indices, masks
 
-    return data, indices
 
+def get_x_batch_correlated(iterations, seed, screening_method="sct"):
+    """
+    Return samples of all inputs of one MC batch, with inputs in rows, their indices, and masks of independent inputs
+    that are kept. Independent TECH and BIO inputs that are sampled by sampling modules are replaced with their samples.
+    """
+    data_indp, indices_indp = get_x_batch_independent(iterations, seed, screening_method)
+    tech_indices, bio_indices, cf_indices = indices_indp.values()
+    len_tech, len_bio = len(tech_indices), len(bio_indices)
+
+    data_technosphere = data_indp[:len_tech, :]
+    data_biosphere = data_indp[len_tech:len_tech+len_bio]
+    data_characterization = data_indp[len_tech+len_bio:]
 
-def get_x_data(iterations, seed, correlations):
+    data_parameterization, pindices, ptech_indices, pbio_indices = get_x_data_parameterization(iterations, seed)
+    data_combustion, ctech_indices, cbio_indices = get_x_data_combustion(iterations, seed)
+    data_entsoe, etech_indices = get_x_data_entsoe(iterations, seed)
+    data_markets, mtech_indices = get_x_data_markets(iterations, seed)
+
+    indices, masks = get_correlated_indices(
+        indices_indp, pindices, ptech_indices, pbio_indices, ctech_indices, cbio_indices, etech_indices, mtech_indices,
+    )
+
+    data = np.vstack([
+        data_technosphere[masks["technosphere"], :],
+        data_combustion,
+        data_entsoe,
+        data_markets,
+        data_biosphere[masks["biosphere"], :],
+        data_characterization,
+        data_parameterization,
+    ])
+
+    return data, indices, masks
+
+
+def get_x_batch(iterations, seed, correlations, screening_method="sct"):
+    if correlations:
+        return get_x_batch_correlated(iterations, seed, screening_method)
+    data, indices = get_x_batch_independent(iterations, seed, screening_method)
+    return data, indices, {}
+
+
+def get_x_data_independent(iterations, seed, screening_method="sct"):
+    starts, n_batches, seeds = get_random_seeds(iterations, seed)
+    data, indices = [], None
+    for i in range(n_batches):
+        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - starts[i]
+        batch_data, indices = get_x_batch_independent(current_iterations, seeds[i], screening_method)
+        data.append(batch_data)
+    return np.hstack(data), indices
+
+
+def get_x_data_correlated(iterations, seed, screening_method="sct"):
+    starts, n_batches, seeds = get_random_seeds(iterations, seed)
+    data, indices = [], None
+    for i in range(n_batches):
+        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - starts[i]
+        batch_data, indices, _ = get_x_batch_correlated(current_iterations, seeds[i], screening_method)
+        data.append(batch_data)
+    return np.hstack(data), indices
+
+
+def get_x_data(iterations, seed, correlations, screening_method="sct"):
     """Read input data from datapackages and return indices and data."""
     if correlations:
-        return get_x_data_correlated(iterations, seed)
+        return get_x_data_correlated(iterations, seed, screening_method)
     else:
-        return get_x_data_independent(iterations, seed)
+        return get_x_data_independent(iterations, seed, screening_method)
+
+
+def get_indices_resource(fp, name):
+    """Read only the indices array of resource group `name` from the datapackage in `fp`, without any data arrays."""
+    dp = bwp.load_datapackage(ZipFS(str(fp)), proxy=True)
+    return dp.get_resource(f"{name}.indices")[0]
+
+
+def get_x_indices_independent(iterations, seed, screening_method="sct"):
+    """Same indices as in `get_x_batch_independent`, read without data arrays."""
+    indices = dict()
+    for matrix_type in ["technosphere", "biosphere", "characterization"]:
+        name = get_background_name(matrix_type, seed, iterations, screening_method=screening_method)
+        indices[matrix_type] = get_indices_resource(SCREENING_DIR / f"{name}.zip", name)
+    return indices
+
+
+def get_x_indices_correlated(iterations, seed, screening_method="sct"):
+    """Same indices as in `get_x_batch_correlated`, read without data arrays."""
+    indices_indp = get_x_indices_independent(iterations, seed, screening_method)
+    fp_parameters = SCREENING_DIR_CORR / f"parameterization-parameters-{seed}-{iterations}.zip"
+    fp_exchanges = SCREENING_DIR_CORR / f"parameterization-exchanges-{seed}-{iterations}.zip"
+    fp_combustion = SCREENING_DIR_CORR / f"combustion-{seed}-{iterations}.zip"
+    indices, _ = get_correlated_indices(
+        indices_indp,
+        get_indices_resource(fp_parameters, "ecoinvent-parameters"),
+        get_indices_resource(fp_exchanges, "parameterized-tech"),
+        get_indices_resource(fp_exchanges, "parameterized-bio"),
+        get_indices_resource(fp_combustion, "combustion-tech"),
+        get_indices_resource(fp_combustion, "combustion-bio"),
+        get_indices_resource(SCREENING_DIR_CORR / f"entsoe-{seed}-{iterations}.zip", "entsoe"),
+        get_indices_resource(SCREENING_DIR_CORR / f"markets-{seed}-{iterations}.zip", "markets"),
+    )
+    return indices
 
 
-def train_xgboost_model(tag, iterations, seed, num_lowinf, correlations, test_size=0.2):
-    """Train gradient boosted tree regressor."""
+def get_feature_layout(iterations, seed, correlations, screening_method="sct"):
+    """
+    Return indices of model inputs in each block of features X, in the order of columns, and first and last columns
+    of each block.
 
+    Columns are the same as in `get_x_data`, but only indices arrays of the first MC batch are read from datapackages,
+    and the layout is cached on disk, so that feature positions are mapped to LCA inputs without reading any samples.
+    """
     directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
-    fp = directory / f"xgboost_model.{tag}.pickle"
+    fp = directory / f"{get_screening_method_tag('features.layout', screening_method)}.{seed}.{iterations}.pickle"
+    if fp.exists():
+        indices = read_pickle(fp)
+    else:
+        _, _, seeds = get_random_seeds(iterations, seed)
+        batch_iterations = min(MC_BATCH_SIZE, iterations)
+        if correlations:
+            indices = get_x_indices_correlated(batch_iterations, seeds[0], screening_method)
+        else:
+            indices = get_x_indices_independent(batch_iterations, seeds[0], screening_method)
+        write_pickle(indices, fp)
+
+    offsets, start = dict(), 0
+    for key, inds in indices.items():
+        offsets[key] = (start, start + len(inds))
+        start += len(inds)
+    return indices, offsets
 
-    # Read X and Y data
-    X, _ = get_x_data(iterations, seed, correlations)
-    X = X.T
-    Y = get_y_scores(iterations, seed, num_lowinf, correlations)
-    X_train, X_test, Y_train, Y_test = train_test_split(
-        X, Y, test_size=test_size, random_state=seed, shuffle=False,
+
+def get_features_name(seed, iterations, screening_method="sct"):
+    """Return name of the store of features X of high-dimensional screening."""
+    return f"{get_screening_method_tag('features', screening_method)}.{seed}.{iterations}"
+
+
+def get_feature_store(iterations, seed, correlations, screening_method="sct", dtype=np.float64):
+    """
+    Return store of features X of high-dimensional screening, with one row per MC iteration, see `FeatureStore`.
+
+    The store is built batch by batch from the datapackages of all MC batches, with the same columns as `get_x_data`,
+    so that at most one batch is held in memory. Building is resumed from the last batch that was written to disk.
+    """
+    directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
+    fp = directory / get_features_name(seed, iterations, screening_method)
+    store = FeatureStore(fp, iterations) if (fp / FEATURES_MANIFEST_NAME).exists() else None
+    if store is not None and store.complete:
+        return store
+
+    starts, n_batches, seeds = get_random_seeds(iterations, seed)
+    for i in range(n_batches):
+        start = int(starts[i])
+        if store is not None and store.has_batch(start):
+            continue
+        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else iterations - start
+        data, indices, masks = get_x_batch(current_iterations, seeds[i], correlations, screening_method)
+        if store is None:
+            store = FeatureStore(fp, iterations, indices, masks, dtype)
+        print(f"Writing features of MC batch {i + 1}/{n_batches}")
+        store.write_batch(start, data)
+    return store
+
+
+def get_quantized_feature_store(iterations, seed, correlations, screening_method="sct", max_bin=MAX_BIN):
+    """Return features X of high-dimensional screening quantized into `max_bin` bins, see `get_quantized_store`."""
+    directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
+    store = get_feature_store(iterations, seed, correlations, screening_method)
+    name = f"{get_features_name(seed, iterations, screening_method)}.quantized.{max_bin}"
+    return get_quantized_store(store, directory / name, max_bin)
+
+
+def get_dmatrices(iterations, seed, correlations, Y, num_train, streaming, screening_method="sct"):
+    """
+    Return training and testing ``DMatrix`` of high-dimensional screening, and functions that predict their scores.
+
+    If `streaming` is True, XGBoost reads features through external memory, block by block of rows. Features are
+    quantized once on disk and reused by all model tags, temporary pages of XGBoost are written next to them.
+    """
+    if streaming:
+        # Predictions are computed on quantized features, as the model is trained on them
+        qstore = get_quantized_feature_store(iterations, seed, correlations, screening_method)
+        dtrain = get_external_dmatrix(qstore, Y, 0, num_train, qstore.directory / "xgboost-cache" / "train")
+        dtest = get_external_dmatrix(qstore, Y, num_train, len(Y), qstore.directory / "xgboost-cache" / "test")
+
+        def predict_train(model):
+            return predict_in_blocks(model, qstore, 0, num_train)
+
+        def predict_test(model):
+            return predict_in_blocks(model, qstore, num_train, len(Y))
+
+    else:
+        store = get_feature_store(iterations, seed, correlations, screening_method)
+        X_train, X_test = store.read(0, num_train), store.read(num_train, len(Y))
+        dtrain = xgb.DMatrix(X_train, Y[:num_train])
+        dtest = xgb.DMatrix(X_test, Y[num_train:])
+
+        def predict_train(model):
+            return model.predict(xgb.DMatrix(X_train))
+
+        def predict_test(model):
+            return model.predict(xgb.DMatrix(X_test))
+
+    return dtrain, dtest, predict_train, predict_test
+
+
+def get_xgboost_params(base_score, seed):
+    """Return parameters of gradient boosted tree regressors of high-dimensional screening."""
+    params = dict(
+        base_score=base_score,        # the initial prediction score of all instances, global bias
+        n_estimators=600,             # number of gradient boosted trees
+        max_depth=6,                  # maximum tree depth for base learners
+        learning_rate=0.1,           # boosting learning rate, xgb's `eta`
+        verbosity=3,                  # degree of verbosity, valid values are 0 (silent) - 3 (debug)
+        # booster='gbtree',           # specify which booster to use: gbtree, gblinear or dart
+        gamma=10,                      # minimum loss reduction to make further partition on a leaf node of the tree
+        subsample=0.7,                # subsample ratio of the training instance
+        colsample_bytree=0.1,           # subsample ratio of columns when constructing each tree
+        reg_alpha=0,                  # L1 regularization term on weights (xgb’s alpha)
+        reg_lambda=0,                 # L2 regularization term on weights (xgb’s lambda)
+        # importance_type="gain",     # for tree models: “gain”, “weight”, “cover”, “total_gain” or “total_cover”
+        early_stopping_rounds=50,     # improve validation metric at least once in every early_stopping_rounds
+        # eval_metric=["rmse"],
+        random_state=seed,
+        # tree_method="hist",
+        objective='reg:squarederror',
+        min_child_weight=500,
     )
-    del X, Y
+    return params
+
+
+def train_xgboost_model(
+        tag, iterations, seed, num_lowinf, correlations, test_size=0.2, streaming=False, screening_method="sct",
+):
+    """
+    Train gradient boosted tree regressor.
 
-    dtrain = xgb.DMatrix(X_train, Y_train)
-    dtest = xgb.DMatrix(X_test, Y_test)
-    X_dtrain = xgb.DMatrix(X_train)
-    X_dtest = xgb.DMatrix(X_test)
+    If `streaming` is True, the model is trained with the ``hist`` tree method on quantized features that are read from
+    external memory, so that peak memory does not grow with the number of iterations, see `get_dmatrices`.
+    """
+
+    directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
+    fp = directory / f"xgboost_model.{tag}.pickle"
+
+    # Split X and Y data into training and testing rows without shuffling, as in `train_test_split`
+    Y = get_y_scores(iterations, seed, num_lowinf, correlations, screening_method)
+    num_train = len(Y) - int(np.ceil(test_size * len(Y)))
+    Y_train, Y_test = Y[:num_train], Y[num_train:]
+    dtrain, dtest, predict_train, predict_test = get_dmatrices(
+        iterations, seed, correlations, Y, num_train, streaming, screening_method
+    )
 
     if fp.exists():
         model = xgb.Booster()
@@ -447,26 +716,9 @@ def train_xgboost_model(tag, iterations, seed, num_lowinf, correlations, test_si
     else:
         # Define the model
         fp_params = directory / f"xgboost_model.{tag}.params.json"
-        params = dict(
-            base_score=np.mean(Y_train),  # the initial prediction score of all instances, global bias
-            n_estimators=600,             # number of gradient boosted trees
-            max_depth=6,                  # maximum tree depth for base learners
-            learning_rate=0.1,           # boosting learning rate, xgb's `eta`
-            verbosity=3,                  # degree of verbosity, valid values are 0 (silent) - 3 (debug)
-            # booster='gbtree',           # specify which booster to use: gbtree, gblinear or dart
-            gamma=10,                      # minimum loss reduction to make further partition on a leaf node of the tree
-            subsample=0.7,                # subsample ratio of the training instance
-            colsample_bytree=0.1,           # subsample ratio of columns when constructing each tree
-            reg_alpha=0,                  # L1 regularization term on weights (xgb’s alpha)
-            reg_lambda=0,                 # L2 regularization term on weights (xgb’s lambda)
-            # importance_type="gain",     # for tree models: “gain”, “weight”, “cover”, “total_gain” or “total_cover”
-            early_stopping_rounds=50,     # improve validation metric at least once in every early_stopping_rounds
-            # eval_metric=["rmse"],
-            random_state=seed,
-            # tree_method="hist",
-            objective='reg:squarederror',
-            min_child_weight=500,
-        )
+        params = get_xgboost_params(np.mean(Y_train), seed)
+        if streaming:
+            params.update(tree_method="hist", max_bin=MAX_BIN)
 
         # Write params into a json file
         with open(fp_params, 'w') as f:
@@ -481,8 +733,8 @@ def train_xgboost_model(tag, iterations, seed, num_lowinf, correlations, test_si
         model.save_model(fp)
 
     # Print results
-    y_prediction_train = model.predict(X_dtrain)
-    y_prediction_test = model.predict(X_dtest)
+    y_prediction_train = predict_train(model)
+    y_prediction_test = predict_test(model)
     R2_train = r2_score(Y_train, y_prediction_train)
     R2_test = r2_score(Y_test, y_prediction_test)
     explained_variance_train = explained_variance_score(Y_train, y_prediction_train)
@@ -496,7 +748,105 @@ def train_xgboost_model(tag, iterations, seed, num_lowinf, correlations, test_si
     return model
 
 
-def get_influential_indices(dict_inf, num_inf, iterations, seed, correlations):
+def get_top_features(model, num_inf):
+    """Return positions of `num_inf` features with the highest total gain in the `model`, ordered by importance."""
+    dict_inf = model.get_score(importance_type="total_gain")
+    list_inf = sorted(dict_inf.items(), key=lambda item: item[1], reverse=True)[:num_inf]
+    return [int(key[1:]) for key, _ in list_inf]
+
+
+def run_screening_incremental(
+        project, fp_ecoinvent, factor, cutoff, max_calc, max_iterations, seed, num_lowinf, correlations, tag,
+        num_inf=200, test_size=0.2, rounds_per_batch=100, min_overlap=0.95, patience=2, solver="direct",
+        solver_options=None, screening_method="sct",
+):
+    """
+    Run MC simulations for high-dimensional screening batch by batch, and continue boosting the XGBoost model with
+    each new batch, until the ranking of the top `num_inf` inputs converges or `max_iterations` are reached.
+
+    The last `test_size` fraction of the first batch is held out to compute R2 of the model after each batch. The
+    ranking has converged when top `num_inf` inputs of consecutive batches overlap by at least `min_overlap` for
+    `patience` batches in a row. Batches have the same seeds as in `run_mc_simulations_screening`, so that scores and
+    features of the iterations that were run can be used as usual, e.g. in `get_masks_wo_lowinf_xgb` with `tag`.
+
+    Returns the model and the number of iterations that were run.
+    """
+    directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
+    fp_model = directory / f"xgboost_model.{tag}.pickle"
+    fp_history = directory / f"xgboost_model.{tag}.incremental.json"
+
+    if fp_model.exists() and fp_history.exists():
+        with open(fp_history, "r") as f:
+            history = json.load(f)
+        model = xgb.Booster()
+        model.load_model(fp_model)
+        return model, history["iterations"]
+
+    starts, n_batches, seeds = get_random_seeds(max_iterations, seed)
+    history = dict(num_inf=num_inf, min_overlap=min_overlap, patience=patience, batches=[], converged=False)
+    model, top_previous, num_stable = None, None, 0
+
+    for i in range(n_batches):
+        current_iterations = MC_BATCH_SIZE if i < n_batches - 1 else max_iterations - int(starts[i])
+        print(f"Incremental screening -- random seed {i+1:2d} / {n_batches:2d} -- {seeds[i]}")
+
+        Y = np.array(get_scores_batch(
+            project, fp_ecoinvent, factor, cutoff, max_calc, current_iterations, seeds[i], num_lowinf,
+            correlations, solver, solver_options, screening_method,
+        ))
+        data, _, _ = get_x_batch(current_iterations, seeds[i], correlations, screening_method)
+        X = data.T
+
+        if model is None:
+            num_train = len(Y) - int(np.ceil(test_size * len(Y)))
+            dtest, Y_test = xgb.DMatrix(X[num_train:], Y[num_train:]), Y[num_train:]
+            X, Y = X[:num_train], Y[:num_train]
+            params = get_xgboost_params(np.mean(Y), seed)
+
+        # Continue boosting from the current model with the new batch only, so that one batch is held in memory
+        dtrain = xgb.DMatrix(X, Y)
+        del data, X
+        model = xgb.train(
+            params, dtrain, num_boost_round=rounds_per_batch, evals=[(dtest, "eval"), (dtrain, "train")],
+            verbose_eval=False, early_stopping_rounds=params["early_stopping_rounds"], xgb_model=model,
+        )
+
+        R2_test = r2_score(Y_test, model.predict(dtest))
+        top = get_top_features(model, num_inf)
+        overlap = None if top_previous is None else len(set(top) & set(top_previous)) / max(len(top), 1)
+        num_stable = num_stable + 1 if overlap is not None and overlap >= min_overlap else 0
+        top_previous = top
+
+        history["batches"].append(dict(
+            seed=seeds[i], iterations=int(starts[i]) + current_iterations, num_trees=model.num_boosted_rounds(),
+            r2_test=float(R2_test), overlap=overlap,
+        ))
+        print(f"    R2 test: {R2_test:.3f}, overlap of top {num_inf} inputs: {overlap}")
+        if num_stable >= patience:
+            history["converged"] = True
+            break
+
+    iterations = history["batches"][-1]["iterations"]
+    history["iterations"] = iterations
+    if not history["converged"]:
+        print(f"Ranking of top {num_inf} inputs did not converge in {max_iterations} iterations")
+
+    # Merge scores of all batches that were run, so that they are read as for `iterations`
+    run_mc_simulations_screening(
+        project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver,
+        solver_options, screening_method,
+    )
+
+    with open(directory / f"xgboost_model.{tag}.params.json", "w") as f:
+        json.dump(params, f)
+    model.save_model(fp_model)
+    with open(fp_history, "w") as f:
+        json.dump(history, f, indent=2)
+
+    return model, iterations
+
+
+def get_influential_indices(dict_inf, num_inf, iterations, seed, correlations, screening_method="sct"):
     # Determine top `num_lowinf_xgb` influential model inputs
     try:
         dict_inf = {int(key[1:]): value for key, value in dict_inf.items()}
@@ -506,20 +856,18 @@ def get_influential_indices(dict_inf, num_inf, iterations, seed, correlations):
     where_inf = np.array([element[0] for element in list_inf])
 
     # Attribute influential inputs to correct input types
-    _, indices = get_x_data(iterations, seed, correlations)
-    start = 0
+    indices, offsets = get_feature_layout(iterations, seed, correlations, screening_method)
     indices_inf = dict()
     for key, inds in indices.items():
-        size = len(inds)
-        mask = np.logical_and(where_inf >= start, where_inf < start + size)
+        start, end = offsets[key]
+        mask = np.logical_and(where_inf >= start, where_inf < end)
         where = where_inf[mask] - start
         indices_inf[key] = np.sort(inds[where])
-        start += size
 
     return indices_inf
 
 
-def get_inds_wo_lowinf_xgb(tag, iterations, seed, num_lowinf_xgb, correlations):
+def get_inds_wo_lowinf_xgb(tag, iterations, seed, num_lowinf_xgb, correlations, screening_method="sct"):
 
     gsa_directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
     screening_directory = SCREENING_DIR_CORR if correlations else SCREENING_DIR_INDP
@@ -549,7 +897,9 @@ def get_inds_wo_lowinf_xgb(tag, iterations, seed, num_lowinf_xgb, correlations):
         model.load_model(fp)
         dict_inf = model.get_score(importance_type="total_gain")
 
-        indices_inf = get_influential_indices(dict_inf, num_lowinf_xgb, iterations, seed, correlations)
+        indices_inf = get_influential_indices(
+            dict_inf, num_lowinf_xgb, iterations, seed, correlations, screening_method
+        )
 
         tindices = indices_inf["technosphere"]
         bindices = indices_inf["biosphere"]
@@ -569,7 +919,8 @@ def get_inds_wo_lowinf_xgb(tag, iterations, seed, num_lowinf_xgb, correlations):
 
 
 def get_masks_wo_lowinf_xgb(
-        project, tag, iterations_screening, iterations_validation, seed, num_lowinf_xgb, correlations
+        project, tag, iterations_screening, iterations_validation, seed, num_lowinf_xgb, correlations,
+        screening_method="sct",
 ):
 
     directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
@@ -592,7 +943,7 @@ def get_masks_wo_lowinf_xgb(
 
     else:
         tindices_wo_lowinf, bindices_wo_lowinf, cindices_wo_lowinf, pindices_wo_lowinf = get_inds_wo_lowinf_xgb(
-            tag, iterations_screening, seed, num_lowinf_xgb, correlations
+            tag, iterations_screening, seed, num_lowinf_xgb, correlations, screening_method
         )
 
         # Derive masks
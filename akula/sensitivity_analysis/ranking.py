@@ -4,13 +4,15 @@ import xgboost as xgb
 import shap
 from pathlib import Path
 import bw2data as bd
-from sklearn.model_selection import train_test_split
 from scipy.special import softmax
 import country_converter as coco
 import logging
 
 from ..utils import read_pickle, write_pickle, get_locations_ecoinvent
-from .high_dimensional_screening import get_x_data, get_y_scores
+from .high_dimensional_screening import (
+    get_y_scores, get_feature_store, get_feature_layout, get_quantized_feature_store,
+)
+from .xgboost_streaming import read_dequantized
 
 GSA_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "sensitivity-analysis"
 GSA_DIR_CORR = GSA_DIR / "correlated"
@@ -20,7 +22,14 @@ SCREENING_DIR_CORR = SCREENING_DIR / "correlated"
 SCREENING_DIR_INDP = SCREENING_DIR / "independent"
 
 
-def compute_shap_values(tag, iterations, seed, num_lowinf_lsa, correlations, test_size=0.2):
+def compute_shap_values(
+        tag, iterations, seed, num_lowinf_lsa, correlations, test_size=0.2, streaming=False, screening_method="sct",
+):
+    """
+    Compute SHAP values of the XGBoost model `tag` on its training rows.
+
+    Models trained with `streaming` are explained on the same quantized features they were trained on.
+    """
 
     gsa_directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
 
@@ -35,14 +44,15 @@ def compute_shap_values(tag, iterations, seed, num_lowinf_lsa, correlations, tes
         model = xgb.Booster()
         model.load_model(fp_model)
 
-        # Read X and Y data
-        X, indices = get_x_data(iterations, seed, correlations)
-        X = X.T
-        Y = get_y_scores(iterations, seed, num_lowinf_lsa, correlations)
-        X_train, _, Y_train, _ = train_test_split(
-            X, Y, test_size=test_size, random_state=seed, shuffle=False,
-        )
-        del X, Y
+        # Read X and Y data, only training rows are used, as in `train_xgboost_model`
+        Y = get_y_scores(iterations, seed, num_lowinf_lsa, correlations, screening_method)
+        num_train = len(Y) - int(np.ceil(test_size * len(Y)))
+        if streaming:
+            qstore = get_quantized_feature_store(iterations, seed, correlations, screening_method)
+            X_train = read_dequantized(qstore, 0, num_train)
+        else:
+            X_train = get_feature_store(iterations, seed, correlations, screening_method).read(0, num_train)
+        Y_train = Y[:num_train]
 
         dtrain = xgb.DMatrix(X_train, Y_train)
 
@@ -80,29 +90,29 @@ def get_feature_importances_shap_values(shap_values, features, num_inf):
     return feature_importances_norm
 
 
-def get_influential_shapley(dict_inf, num_inf, iterations, seed, correlations):
+def get_influential_shapley(dict_inf, num_inf, iterations, seed, correlations, screening_method="sct"):
     list_inf = sorted(dict_inf.items(), key=lambda item: item[1], reverse=True)[:num_inf]
     where_inf = np.array([element[0] for element in list_inf])
 
     # Attribute influential inputs to correct input types
-    _, indices = get_x_data(iterations, seed, correlations)
-    start = 0
+    indices, offsets = get_feature_layout(iterations, seed, correlations, screening_method)
     indices_inf = dict()
     for key, inds in indices.items():
-        size = len(inds)
-        mask = np.logical_and(where_inf >= start, where_inf < start + size)
+        start, end = offsets[key]
+        mask = np.logical_and(where_inf >= start, where_inf < end)
         where = where_inf[mask] - start
         list_ = list()
         for element in where:
             ind = inds[element]
             list_.append((ind[0], ind[1], dict_inf[element+start]))
         indices_inf[key] = list_
-        start += size
 
     return indices_inf
 
 
-def get_ranked_list(project, tag, iterations, seed, num_lowinf_lsa, num_inf, correlations):
+def get_ranked_list(
+        project, tag, iterations, seed, num_lowinf_lsa, num_inf, correlations, streaming=False, screening_method="sct",
+):
 
     directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
     fp = directory / f"ranking.model_{tag}.{num_inf}.{seed}.{iterations}.csv"
@@ -115,12 +125,16 @@ def get_ranked_list(project, tag, iterations, seed, num_lowinf_lsa, num_inf, cor
         locations = get_locations_ecoinvent()
 
         # Compute feature importance values
-        shap_values = compute_shap_values(tag, iterations, seed, num_lowinf_lsa, correlations)
+        shap_values = compute_shap_values(
+            tag, iterations, seed, num_lowinf_lsa, correlations, streaming=streaming, screening_method=screening_method
+        )
         features = np.arange(num_lowinf_lsa)
         feature_importances = get_feature_importances_shap_values(shap_values, features, num_inf)
 
         # Get top `num_inf` features with highest shapley value scores
-        top_features = get_influential_shapley(feature_importances, num_inf, iterations, seed, correlations)
+        top_features = get_influential_shapley(
+            feature_importances, num_inf, iterations, seed, correlations, screening_method
+        )
 
         write_pickle(top_features, directory / f"ranking.indices.model_{tag}.{num_inf}.{seed}.{iterations}.pickle")
 
@@ -1,13 +1,16 @@
 import numpy as np
 import bw2data as bd
 import bw2calc as bc
+from bw2calc.utils import consistent_global_index
 import bw_processing as bwp
 from fs.zipfs import ZipFS
 from copy import deepcopy
 from pathlib import Path
+from scipy.sparse.linalg import splu
 
-from .utils import get_mask
-from ..utils import read_pickle, write_pickle, get_fu_pkgs, get_lca
+from .utils import get_mask, get_noninf_tag
+from ..utils import read_pickle, write_pickle, get_fu_pkgs, get_lca, get_adjoint, METHOD
+from ..instrumentation import instrumented, instrument_lca
 
 GSA_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "sensitivity-analysis"
 DATA_DIR = Path(__file__).parent.parent.parent.resolve() / "data"
@@ -70,6 +73,7 @@ class LocalSensitivityAnalysisSampler:
         return self.masked_indices[self.index]
 
 
+@instrumented(GSA_DIR)
 def run_local_sa(
         matrix_type,
         fu_mapped,
@@ -133,6 +137,7 @@ def run_local_sa(
                 [d.update({"global_index": 1}) for d in dp.metadata['resources']]
 
             lca = bc.LCA(demand=fu_mapped, data_objs=packages + [dp])
+            instrument_lca(lca)
             lca.lci()
             lca.lcia()
 
@@ -156,10 +161,162 @@ def run_local_sa(
     return scores
 
 
-def get_scores_local_sa_technosphere(mask, project, factor, tag):
-    """Wrapper function to run MC simulations by varying 1 input at a time (local SA) for TECHNOSPHERE."""
+def get_input_positions(lca, matrix_type, indices):
+    """
+    Return rows and columns of TECH, BIO or CF inputs with datapackage `indices` in the matrices of a static `lca`,
+    and which of the inputs are found there. Columns of CF inputs are None.
+    """
+    if matrix_type == "technosphere":
+        rows = lca.technosphere_mm.row_mapper.map_array(indices["row"])
+        cols = lca.technosphere_mm.col_mapper.map_array(indices["col"])
+        found = (rows != -1) & (cols != -1)
+    elif matrix_type == "biosphere":
+        rows = lca.biosphere_mm.row_mapper.map_array(indices["row"])
+        cols = lca.technosphere_mm.col_mapper.map_array(indices["col"])
+        found = (rows != -1) & (cols != -1)
+    else:
+        rows = lca.biosphere_mm.row_mapper.map_array(indices["row"])
+        cols = None
+        found = rows != -1
+        global_index = consistent_global_index(lca.packages)
+        if global_index is not None:
+            found &= indices["col"] == global_index
+    return rows, cols, found
 
-    fp = GSA_DIR / f"scores.tech.lsa.{tag}.factor_{factor}.pickle"
+
+def get_sensitivities(lca, matrix_type, indices, flip=None, adjoint=None):
+    """
+    Return derivatives of the LCIA score of a static `lca` wrt TECH, BIO or CF inputs with datapackage `indices`.
+
+    Derivatives are -λ_i s_j for technosphere inputs a_ij, c_i s_j for biosphere inputs b_ij, and g_i for
+    characterization factors c_i. Here s is the supply array, λ is the solution of the adjoint system, see
+    `akula.utils.get_adjoint`, and g is the life cycle inventory summed over all activities. Signs of technosphere
+    inputs are changed where `flip` is True. Inputs that are not in the matrices do not change the score.
+    """
+    rows, cols, found = get_input_positions(lca, matrix_type, indices)
+    sensitivities = np.zeros(len(indices))
+
+    if matrix_type == "technosphere":
+        adjoint = get_adjoint(lca) if adjoint is None else adjoint
+        signs = np.ones(len(indices)) if flip is None else np.where(flip, -1, 1)
+        sensitivities[found] = -adjoint[rows[found]] * lca.supply_array[cols[found]] * signs[found]
+    elif matrix_type == "biosphere":
+        characterization_factors = lca.characterization_matrix.diagonal()
+        sensitivities[found] = characterization_factors[rows[found]] * lca.supply_array[cols[found]]
+    else:
+        inventory = np.asarray(lca.inventory.sum(axis=1)).flatten()
+        sensitivities[found] = inventory[rows[found]]
+
+    return sensitivities
+
+
+def run_local_sa_analytic(matrix_type, fu_mapped, packages, indices, data, distributions, mask, factor=10):
+    """
+    Compute LSA scores for BIO or CF inputs in closed form, and return them in the same format as `run_local_sa`.
+
+    LCIA score is linear wrt biosphere and characterization inputs. Multiplying biosphere input b_ij by `factor` changes
+    the score by (factor-1) * b_ij * s_j * c_i, and multiplying characterization factor c_i by (factor-1) * c_i * g_i,
+    where s is the supply array and g is the life cycle inventory summed over all activities. Hence, scores for all
+    inputs are obtained from one deterministic LCA, see `get_sensitivities`.
+    """
+
+    if matrix_type not in ["biosphere", "characterization"]:
+        raise ValueError(f"Analytical local SA is not possible for {matrix_type} inputs")
+
+    lca = bc.LCA(demand=fu_mapped, data_objs=packages)
+    lca.lci()
+    lca.lcia()
+
+    has_uncertainty = LocalSensitivityAnalysisSampler.get_uncertainty_bool(distributions)
+    where = np.where(mask & has_uncertainty)[0]
+    selected = indices[where]
+
+    sensitivities = get_sensitivities(lca, matrix_type, selected)
+    deltas = (factor - 1) * data[where] * sensitivities
+    scores = {tuple(index): np.array([lca.score + delta]) for index, delta in zip(selected, deltas)}
+
+    return scores
+
+
+def get_inverse_elements(lu, rows, cols, block_size=200):
+    """
+    Return elements (A^{-1})_{ji} of the inverse of the factorized matrix A for all pairs in `rows` (i) and `cols` (j).
+
+    Columns of A^{-1} are computed in blocks for the unique `rows`, or rows of A^{-1} for the unique `cols`,
+    depending on which requires fewer solves.
+    """
+    n = lu.shape[0]
+    unique_rows, row_inverse = np.unique(rows, return_inverse=True)
+    unique_cols, col_inverse = np.unique(cols, return_inverse=True)
+    transpose = len(unique_cols) < len(unique_rows)
+    if transpose:
+        unique, inverse, other, trans = unique_cols, col_inverse, rows, "T"
+    else:
+        unique, inverse, other, trans = unique_rows, row_inverse, cols, "N"
+
+    elements = np.zeros(len(rows))
+    for start in range(0, len(unique), block_size):
+        end = min(start + block_size, len(unique))
+        rhs = np.zeros((n, end - start))
+        rhs[unique[start:end], np.arange(end - start)] = 1
+        solution = lu.solve(rhs, trans=trans)
+        current = (inverse >= start) & (inverse < end)
+        elements[current] = solution[other[current], inverse[current] - start]
+
+    return elements
+
+
+def run_local_sa_technosphere_analytic(fu_mapped, packages, indices, data, distributions, mask, flip, factor=10):
+    """
+    Compute LSA scores for TECH inputs exactly with the Sherman-Morrison formula, in the same format as `run_local_sa`.
+
+    Multiplying technosphere input a_ij by `factor` is a rank-1 change δ e_i e_j^T of the technosphere matrix A, with
+    δ = (factor-1) * a_ij. The perturbed score is then
+
+        score - δ λ_i s_j / (1 + δ (A^{-1})_{ji}),
+
+    where s is the supply array and λ^T = c^T B A^{-1} is the solution of the adjoint system. A is factorized once, and
+    only the elements of A^{-1} for the perturbed inputs are computed.
+    """
+
+    lca = bc.LCA(demand=fu_mapped, data_objs=packages)
+    lca.lci()
+    lca.lcia()
+
+    has_uncertainty = LocalSensitivityAnalysisSampler.get_uncertainty_bool(distributions)
+    where = np.where(mask & has_uncertainty)[0]
+    selected = indices[where]
+
+    # Inputs that are not in the technosphere matrix do not change the score
+    rows, cols, found = get_input_positions(lca, "technosphere", selected)
+    rows, cols = rows[found], cols[found]
+
+    lu = splu(lca.technosphere_matrix.tocsc())
+    adjoint = get_adjoint(lca, lu)
+
+    signs = np.where(flip[where][found], -1, 1)
+    deltas = (factor - 1) * data[where][found] * signs
+    inverse_elements = get_inverse_elements(lu, rows, cols)
+
+    perturbed_scores = np.full(len(where), lca.score)
+    perturbed_scores[found] -= deltas * adjoint[rows] * lca.supply_array[cols] / (1 + deltas * inverse_elements)
+
+    scores = {tuple(index): np.array([score]) for index, score in zip(selected, perturbed_scores)}
+
+    return scores
+
+
+def get_scores_local_sa_technosphere(mask, project, factor, tag, analytic=True, directory=None):
+    """
+    Wrapper function to run MC simulations by varying 1 input at a time (local SA) for TECHNOSPHERE.
+
+    If `analytic` is True, scores are computed with the Sherman-Morrison formula in
+    `run_local_sa_technosphere_analytic` instead of running one LCA iteration per input. Scores are cached in
+    `directory`, which is `GSA_DIR` by default.
+    """
+
+    directory = directory or GSA_DIR
+    fp = directory / f"scores.tech.lsa.{tag}.factor_{factor}.pickle"
 
     if fp.exists():
         scores = read_pickle(fp)
@@ -181,10 +338,15 @@ def get_scores_local_sa_technosphere(mask, project, factor, tag):
             else:
                 current_tag = f"tech.lsa.{tag}.factor_{factor}_div"
 
-            fp_i = GSA_DIR / f"scores.{current_tag}.pickle"
+            fp_i = directory / f"scores.{current_tag}.pickle"
 
             if fp_i.exists():
                 scores_i = read_pickle(fp_i)
+            elif analytic:
+                scores_i = run_local_sa_technosphere_analytic(
+                    fu, pkgs, tindices, tdata, tdistributions, mask, tflip, current_factor,
+                )
+                write_pickle(scores_i, fp_i)
             else:
                 scores_i = run_local_sa(
                     "technosphere", fu, pkgs, tindices, tdata, tdistributions, mask, tflip,
@@ -202,15 +364,18 @@ def get_scores_local_sa_technosphere(mask, project, factor, tag):
     return scores
 
 
-def get_scores_local_sa_biosphere(mask, project, factor):
+def get_scores_local_sa_biosphere(mask, project, factor, analytic=True, directory=None):
     """
     Wrapper function to run MC simulations by varying 1 input at a time (local SA) for BIOSPHERE.
 
     Since biosphere inputs are linear wrt to the LCIA score, local sensitivity analysis was performed by multiplying
-    each default input value by only 1 factor.
+    each default input value by only 1 factor. If `analytic` is True, scores are computed in closed form with
+    `run_local_sa_analytic` instead of running one LCA iteration per input. Scores are cached in `directory`, which is
+    `GSA_DIR` by default.
     """
 
-    fp = GSA_DIR / f"scores.bio.lsa.factor_{factor}.pickle"
+    directory = directory or GSA_DIR
+    fp = directory / f"scores.bio.lsa.factor_{factor}.pickle"
 
     if fp.exists():
         scores = read_pickle(fp)
@@ -222,56 +387,67 @@ def get_scores_local_sa_biosphere(mask, project, factor):
         bdata = bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.data')[0]
         bdistributions = bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.distributions')[0]
 
-        tag = f"bio.lsa.factor_{factor}_mult"
-        scores = run_local_sa(
-            "biosphere", fu, pkgs, bindices, bdata, bdistributions, mask, factor=factor, tag=tag
-        )
+        if analytic:
+            scores = run_local_sa_analytic("biosphere", fu, pkgs, bindices, bdata, bdistributions, mask, factor)
+        else:
+            tag = f"bio.lsa.factor_{factor}_mult"
+            scores = run_local_sa(
+                "biosphere", fu, pkgs, bindices, bdata, bdistributions, mask, factor=factor, tag=tag
+            )
 
         write_pickle(scores, fp)
     return scores
 
 
-def get_scores_local_sa_characterization(mask, project, factor):
+def get_scores_local_sa_characterization(mask, project, factor, analytic=True, directory=None):
     """
     Wrapper function to run MC simulations by varying 1 input at a time (local SA) for CHARACTERIZATION FACTORS.
 
     Since characterization inputs are linear wrt to the LCIA score, local sensitivity analysis was performed by
-    multiplying each default input value by only 1 factor.
+    multiplying each default input value by only 1 factor. If `analytic` is True, scores are computed in closed form
+    with `run_local_sa_analytic` instead of running one LCA iteration per input. Scores are cached in `directory`,
+    which is `GSA_DIR` by default.
     """
 
-    fp = GSA_DIR / f"scores.cf.lsa.factor_{factor}.pickle"
+    directory = directory or GSA_DIR
+    fp = directory / f"scores.cf.lsa.factor_{factor}.pickle"
 
     if fp.exists():
         scores = read_pickle(fp)
     else:
         fu, pkgs = get_fu_pkgs(project)
-        cf = bd.Method(("IPCC 2013", "climate change", "GWP 100a", "uncertain")).datapackage()
+        cf = bd.Method(METHOD).datapackage()
         cindices = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.indices')[0]
         cdata = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.data')[0]
         cdistributions = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.distributions')[0]
 
-        tag = f"cf.lsa.factor_{factor}_mult"
-        scores = run_local_sa(
-            "characterization", fu, pkgs, cindices, cdata, cdistributions, mask, factor=factor, tag=tag
-        )
+        if analytic:
+            scores = run_local_sa_analytic("characterization", fu, pkgs, cindices, cdata, cdistributions, mask, factor)
+        else:
+            tag = f"cf.lsa.factor_{factor}_mult"
+            scores = run_local_sa(
+                "characterization", fu, pkgs, cindices, cdata, cdistributions, mask, factor=factor, tag=tag
+            )
 
         write_pickle(scores, fp)
 
     return scores
 
 
-def get_scores_local_sa(project, factor, cutoff, max_calc):
+def get_scores_local_sa(project, factor, cutoff, max_calc, analytic=True, screening_method="sct"):
     """Wrapper function to get all LSA scores for TECH, BIO, and CF."""
 
-    tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
+    tag = get_noninf_tag(cutoff, max_calc, screening_method)
 
-    tmask_wo_noninf = read_pickle(GSA_DIR / f"mask.tech.without_noninf.sct.{tag}.pickle")
+    tmask_wo_noninf = read_pickle(
+        GSA_DIR / f"mask.tech.without_noninf.{screening_method}.cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}.pickle"
+    )
     bmask_wo_noninf = read_pickle(GSA_DIR / "mask.bio.without_noninf.pickle")
     cmask_wo_noninf = read_pickle(GSA_DIR / "mask.cf.without_noninf.pickle")
 
-    tscores = get_scores_local_sa_technosphere(tmask_wo_noninf, project, factor, tag)
-    bscores = get_scores_local_sa_biosphere(bmask_wo_noninf, project, factor)
-    cscores = get_scores_local_sa_characterization(cmask_wo_noninf, project, factor)
+    tscores = get_scores_local_sa_technosphere(tmask_wo_noninf, project, factor, tag, analytic)
+    bscores = get_scores_local_sa_biosphere(bmask_wo_noninf, project, factor, analytic)
+    cscores = get_scores_local_sa_characterization(cmask_wo_noninf, project, factor, analytic)
 
     lsa_scores = {"tech": tscores, "bio": bscores, "cf": cscores}
 
@@ -326,10 +502,10 @@ def get_indices_high_variance(variances, variance_threshold):
     return selected
 
 
-def get_masks_wo_lowinf_lsa(project, factor, cutoff, max_calc, num_lowinf):
+def get_masks_wo_lowinf_lsa(project, factor, cutoff, max_calc, num_lowinf, screening_method="sct"):
     """Wrapper function that collects all masks for TECH, BIO, and CF after removing lowly influential inputs."""
 
-    tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
+    tag = get_noninf_tag(cutoff, max_calc, screening_method)
 
     fp_mask_tech = GSA_DIR / f"mask.tech.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
     fp_mask_bio = GSA_DIR / f"mask.bio.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
@@ -357,7 +533,7 @@ def get_masks_wo_lowinf_lsa(project, factor, cutoff, max_calc, num_lowinf):
             cindices_wo_lowinf = read_pickle(fp_inds_cf)
 
         else:
-            lsa_scores = get_scores_local_sa(project, factor, cutoff, max_calc)
+            lsa_scores = get_scores_local_sa(project, factor, cutoff, max_calc, screening_method=screening_method)
             variances = get_variances_of_lsa_scores(project, lsa_scores)
             variance_threshold = get_variance_threshold(variances, num_lowinf)
             selected = get_indices_high_variance(variances, variance_threshold)
@@ -401,7 +577,7 @@ def get_bmask_wo_lowinf(project, bindices_wo_lowinf):
 
 def get_cmask_wo_lowinf(project, cindices_wo_lowinf):
     bd.projects.set_current(project)
-    cf = bd.Method(("IPCC 2013", "climate change", "GWP 100a", "uncertain")).datapackage()
+    cf = bd.Method(METHOD).datapackage()
     cindices = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.indices')[0]
     mask = get_mask(cindices, cindices_wo_lowinf)
     return mask
@@ -411,7 +587,7 @@ def get_pmask_wo_lowinf(iterations, seed, pindices_wo_lowinf):
     fp = DP_DIR / f"parameterization-parameters-{seed}-{iterations}.zip"
     dp = bwp.load_datapackage(ZipFS(fp))
     pindices = dp.get_resource('ecoinvent-parameters.indices')[0]
-    mask = get_mask(pindices, pindices_wo_lowinf)
+    mask = get_mask(pindices, pindices_wo_lowinf, is_params=True)
     return mask
 
 
@@ -4,19 +4,82 @@ import bw2data as bd
 import bw2calc as bc
 
 from .utils import get_mask
-from ..utils import read_pickle, write_pickle, get_lca
+from ..utils import read_pickle, write_pickle, get_lca, get_adjoint, METHOD
 
 GSA_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "sensitivity-analysis"
 GSA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Supply chain traversal, and contributions of all technosphere edges
+TECH_SCREENING_METHODS = ("sct", "contributions")
 
-def get_tindices_wo_noninf(project, cutoff, max_calc):
-    """Find datapackage indices with the lowest contribution scores obtained with Supply chain traversal."""
 
-    fp = GSA_DIR / f"indices.tech.without_noninf.sct.cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}.pickle"
+def get_tcontributions(project):
+    """
+    Compute impacts carried by all technosphere edges, -a_ij * s_j * λ_i, where s is the supply array and λ is the
+    solution of the adjoint system λ^T = c^T B A^{-1}, i.e. the LCIA score per unit of each product.
+
+    Contributions do not depend on the cutoff, so they are computed only once, and can be used for any cutoff.
+    """
+
+    fp = GSA_DIR / "contributions.tech.pickle"
+
+    if fp.exists():
+        contributions = read_pickle(fp)
+    else:
+        lca = get_lca(project)
+        lca.lci()
+        lca.lcia()
+
+        adjoint = get_adjoint(lca)
+
+        matrix = lca.technosphere_matrix.tocoo()
+        # Production exchanges on the diagonal are not edges of the supply chain graph
+        edges = (matrix.row != matrix.col) & (matrix.data != 0)
+        rows, cols, data = matrix.row[edges], matrix.col[edges], matrix.data[edges]
+
+        product_reversed = lca.dicts.product.reversed
+        activity_reversed = lca.dicts.activity.reversed
+        product_ids = np.array([product_reversed[i] for i in range(matrix.shape[0])])
+        activity_ids = np.array([activity_reversed[j] for j in range(matrix.shape[1])])
+
+        contributions = {
+            "rows": product_ids[rows],
+            "cols": activity_ids[cols],
+            "impacts": -data * lca.supply_array[cols] * adjoint[rows],
+            "score": lca.score,
+        }
+
+        write_pickle(contributions, fp)
+
+    return contributions
+
+
+def get_tindices_wo_noninf_contributions(project, cutoff):
+    """Find datapackage indices of technosphere edges that carry more than `cutoff` of the LCIA score."""
+    contributions = get_tcontributions(project)
+    selected = abs(contributions["impacts"]) > abs(contributions["score"] * cutoff)
+    indices = list(zip(contributions["rows"][selected].tolist(), contributions["cols"][selected].tolist()))
+    return indices
+
+
+def get_tindices_wo_noninf(project, cutoff, max_calc, screening_method="sct"):
+    """
+    Find datapackage indices with the lowest contribution scores obtained with Supply chain traversal.
+
+    With `screening_method="contributions"`, impacts of all technosphere edges are computed directly from supply and
+    adjoint arrays, see `get_tcontributions`, and `max_calc` is not used.
+    """
+
+    if screening_method not in TECH_SCREENING_METHODS:
+        raise ValueError(f"Unknown screening method {screening_method}, possible options are {TECH_SCREENING_METHODS}")
+
+    fp = GSA_DIR / f"indices.tech.without_noninf.{screening_method}.cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}.pickle"
 
     if fp.exists():
         indices = read_pickle(fp)
+    elif screening_method == "contributions":
+        indices = get_tindices_wo_noninf_contributions(project, cutoff)
+        write_pickle(indices, fp)
     else:
         bd.projects.set_current(project)
         lca = get_lca(project)
@@ -106,9 +169,9 @@ def get_cindices_wo_noninf(project):
     return indices
 
 
-def get_tmask_wo_noninf(project, cutoff, max_calc):
+def get_tmask_wo_noninf(project, cutoff, max_calc, screening_method="sct"):
 
-    fp = GSA_DIR / f"mask.tech.without_noninf.sct.cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}.pickle"
+    fp = GSA_DIR / f"mask.tech.without_noninf.{screening_method}.cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}.pickle"
 
     if fp.exists():
         mask = read_pickle(fp)
@@ -117,7 +180,7 @@ def get_tmask_wo_noninf(project, cutoff, max_calc):
         ei = bd.Database("ecoinvent 3.8 cutoff").datapackage()
         tei = ei.filter_by_attribute('matrix', 'technosphere_matrix')
         tindices_ei = tei.get_resource('ecoinvent_3.8_cutoff_technosphere_matrix.indices')[0]
-        tindices_wo_noninf = get_tindices_wo_noninf(project, cutoff, max_calc)
+        tindices_wo_noninf = get_tindices_wo_noninf(project, cutoff, max_calc, screening_method)
         mask = get_mask(tindices_ei, tindices_wo_noninf)
 
         write_pickle(mask, fp)
@@ -152,7 +215,7 @@ def get_cmask_wo_noninf(project):
         mask = read_pickle(fp)
     else:
         bd.projects.set_current(project)
-        cf = bd.Method(("IPCC 2013", "climate change", "GWP 100a", "uncertain")).datapackage()
+        cf = bd.Method(METHOD).datapackage()
         cindices = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.indices')[0]
         cindices_wo_noninf = get_cindices_wo_noninf(project)
         mask = get_mask(cindices, cindices_wo_noninf)
@@ -2,17 +2,26 @@ import numpy as np
 import bw_processing as bwp
 
 from akula.parameterization import PARAMS_DTYPE
+from akula.utils import join_indices
 
 
 def get_mask(all_indices, use_indices, is_params=False):
     """Creates a `mask` such that `all_indices[mask]=use_indices`."""
-    if is_params:
-        use_indices = np.array(use_indices, dtype=PARAMS_DTYPE)
-    else:
-        use_indices = np.array(use_indices, dtype=bwp.INDICES_DTYPE)
-    mask = np.zeros(len(all_indices), dtype=bool)
-    for indices in use_indices:
-        mask_current = all_indices == indices
-        mask = mask | mask_current
+    dtype = PARAMS_DTYPE if is_params else bwp.INDICES_DTYPE
+    use_indices = np.array(use_indices, dtype=dtype)
+    mask, _, _ = join_indices(np.asarray(all_indices, dtype=dtype), use_indices)
     assert mask.sum() <= len(use_indices)
     return mask
+
+
+def get_noninf_tag(cutoff, max_calc, screening_method="sct"):
+    """Return tag of files that depend on the TECH mask without non-influential inputs found with `screening_method`."""
+    tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
+    if screening_method != "sct":
+        tag = f"{screening_method}.{tag}"
+    return tag
+
+
+def get_screening_method_tag(tag, screening_method="sct"):
+    """Add `screening_method` to `tag` of files that depend on its TECH mask, the default SCT leaves `tag` unchanged."""
+    return tag if screening_method == "sct" else f"{tag}.{screening_method}"
@@ -4,8 +4,12 @@ import bw2data as bd
 import bw_processing as bwp
 from fs.zipfs import ZipFS
 
-from ..utils import read_pickle, write_pickle, get_lca_score_shift
-from ..monte_carlo import compute_consumption_lcia
+from .utils import get_noninf_tag, get_screening_method_tag
+from ..utils import read_pickle, write_pickle, get_lca_score_shift, get_csr_positions, METHOD, LABELS_DICT
+from ..monte_carlo import compute_consumption_lcia, get_consumption_lca_inputs
+from ..solvers import get_lca_class
+from ..score_store import advance_lca
+from ..control_variates import compute_consumption_lcia_linearized, get_control_variate_estimates
 from ..parameterization import generate_parameterization_datapackage
 from ..combustion import generate_combustion_datapackage
 from ..electricity import generate_entsoe_datapackage
@@ -31,31 +35,67 @@ def create_all_datapackages(fp_ecoinvent, project, iterations, seed=42, director
     return datapackages
 
 
-def run_mc_simulations_all_inputs(project, fp_ecoinvent, iterations, seed=42, correlations=True):
-    """Run Monte Carlo simulations when all model inputs vary."""
+def get_scores_tag(tag, sampling_method="random", convergence=None):
+    """
+    Return tag of cached LCIA scores of MC runs with `sampling_method`.
+
+    Runs with a `convergence` monitor can stop before `iterations`, so their scores are cached separately from scores
+    of full runs with the same number of `iterations`, and per settings of the monitor, see
+    `akula.convergence.ConvergenceMonitor.tag`.
+    """
+    if sampling_method != "random":
+        tag = f"{tag}.{sampling_method}"
+    if convergence is not None:
+        tag = f"{tag}.early_stopping.{convergence.tag}"
+    return tag
+
+
+def run_mc_simulations_all_inputs(
+        project, fp_ecoinvent, iterations, seed=42, correlations=True, convergence=None, sampling_method="random",
+        control_variates=False,
+):
+    """
+    Run Monte Carlo simulations when all model inputs vary.
+
+    If a `convergence` monitor is given, `iterations` is the maximum number of MC iterations, see
+    `akula.convergence.ConvergenceMonitor`. Background inputs are sampled with `sampling_method`, see `akula.qmc`.
+
+    If `control_variates` is True, also return estimates of the mean, variance and percentiles of LCIA scores that use
+    the linearized LCA model as a control variate, see `get_control_variate_estimates_masked`.
+    """
     directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
-    fp = directory / f"scores.all_inputs.{seed}.{iterations}.pickle"
+    tag = get_scores_tag("all_inputs", sampling_method, convergence)
+    fp = directory / f"scores.{tag}.{seed}.{iterations}.pickle"
     if fp.exists():
         scores = read_pickle(fp)
     else:
         datapackages = []
         if correlations:
             datapackages += create_all_datapackages(fp_ecoinvent, project, iterations, seed)
-        scores = compute_consumption_lcia(project, iterations, seed, datapackages)
+        scores = compute_consumption_lcia(
+            project, iterations, seed, datapackages, convergence=convergence, sampling_method=sampling_method,
+        )
         write_pickle(scores, fp)
 
     masks = {"technosphere": None, "biosphere": None, "characterization": None}
     offset = get_lca_score_shift(project, masks)
 
+    if control_variates:
+        estimates = get_control_variate_estimates_masked(
+            project, fp_ecoinvent, None, scores, iterations, seed, tag, correlations, sampling_method
+        )
+        return np.array(scores) + offset, shift_estimates(estimates, offset)
+
     scores = np.array(scores) + offset
 
     return scores
 
 
-def create_masked_vector_datapackage(project, tmask, bmask, cmask, tag):
+def create_masked_vector_datapackage(project, tmask, bmask, cmask, tag, directory=None):
     """Create datapackages that exclude masked inputs."""
 
-    fp_datapackage = DATA_DIR / f"vector_dp.{tag}.zip"
+    directory = directory or DATA_DIR
+    fp_datapackage = directory / f"vector_dp.{tag}.zip"
 
     bd.projects.set_current(project)
 
@@ -72,7 +112,7 @@ def create_masked_vector_datapackage(project, tmask, bmask, cmask, tag):
     bdata = bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.data')[0]
 
     # Extract CF datapackage values
-    cf = bd.Method(("IPCC 2013", "climate change", "GWP 100a", "uncertain")).datapackage()
+    cf = bd.Method(METHOD).datapackage()
     cindices = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.indices')[0]
     cdata = cf.get_resource('IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data.data')[0]
 
@@ -108,76 +148,99 @@ def create_masked_vector_datapackage(project, tmask, bmask, cmask, tag):
     return dp
 
 
-def create_noninf_datapackage(project, cutoff, max_calc):
-
-    # Extract all masks without non-influential inputs
+def get_noninf_masks(cutoff, max_calc, screening_method="sct"):
+    """Return masks of inputs that remain after removing non-influential inputs."""
     tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
-    fp_tech = GSA_DIR / f"mask.tech.without_noninf.sct.{tag}.pickle"
+    fp_tech = GSA_DIR / f"mask.tech.without_noninf.{screening_method}.{tag}.pickle"
     fp_bio = GSA_DIR / "mask.bio.without_noninf.pickle"
     fp_cf = GSA_DIR / "mask.cf.without_noninf.pickle"
-    tmask = read_pickle(fp_tech)
-    bmask = read_pickle(fp_bio)
-    cmask = read_pickle(fp_cf)
+    masks = {
+        "technosphere": read_pickle(fp_tech),
+        "biosphere": read_pickle(fp_bio),
+        "characterization": read_pickle(fp_cf),
+    }
+    return masks
 
-    tag = "without_noninf"
-    dp = create_masked_vector_datapackage(project, ~tmask, ~bmask, ~cmask, tag)
 
-    masks = {"technosphere": tmask, "biosphere": bmask, "characterization": cmask}
-    offset = get_lca_score_shift(project, masks)
-
-    return dp, offset
-
-
-def create_lowinf_lsa_datapackage(project, factor, cutoff, max_calc, num_lowinf):
-
-    # Extract all masks without non-influential inputs
-    tag = f"cutoff_{cutoff:.0e}.maxcalc_{max_calc:.0e}"
+def get_lowinf_lsa_masks(factor, cutoff, max_calc, num_lowinf, screening_method="sct"):
+    """Return masks of inputs that remain after removing lowly influential inputs with local SA."""
+    tag = get_noninf_tag(cutoff, max_calc, screening_method)
     fp_tech = GSA_DIR / f"mask.tech.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
     fp_bio = GSA_DIR / f"mask.bio.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
     fp_cf = GSA_DIR / f"mask.cf.without_lowinf.{num_lowinf}.lsa.factor_{factor}.{tag}.pickle"
-    tmask = read_pickle(fp_tech)
-    bmask = read_pickle(fp_bio)
-    cmask = read_pickle(fp_cf)
+    masks = {
+        "technosphere": read_pickle(fp_tech),
+        "biosphere": read_pickle(fp_bio),
+        "characterization": read_pickle(fp_cf),
+    }
+    return masks
 
-    tag = f"without_lowinf_lsa.{num_lowinf}"
-    dp = create_masked_vector_datapackage(project, ~tmask, ~bmask, ~cmask, tag)
-
-    masks = {"technosphere": tmask, "biosphere": bmask, "characterization": cmask}
-    offset = get_lca_score_shift(project, masks)
-
-    return dp, offset
-
-
-def create_lowinf_xgb_datapackage(project, num_lowinf, xgb_model_tag, correlations):
 
+def get_lowinf_xgb_masks(num_lowinf, xgb_model_tag, correlations):
+    """Return masks of inputs that remain after removing lowly influential inputs with XGBoost."""
     directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
-
-    # Extract all masks without non-influential inputs
     fp_tech = directory / f"mask.tech.without_lowinf.{num_lowinf}.xgb.model_{xgb_model_tag}.pickle"
     fp_bio = directory / f"mask.bio.without_lowinf.{num_lowinf}.xgb.model_{xgb_model_tag}.pickle"
     fp_cf = directory / f"mask.cf.without_lowinf.{num_lowinf}.xgb.model_{xgb_model_tag}.pickle"
-    tmask = read_pickle(fp_tech)
-    bmask = read_pickle(fp_bio)
-    cmask = read_pickle(fp_cf)
+    masks = {
+        "technosphere": read_pickle(fp_tech),
+        "biosphere": read_pickle(fp_bio),
+        "characterization": read_pickle(fp_cf),
+    }
+    return masks
 
-    tag = f"without_lowinf_xgb.{num_lowinf}"
-    dp = create_masked_vector_datapackage(project, ~tmask, ~bmask, ~cmask, tag)
 
-    masks = {"technosphere": tmask, "biosphere": bmask, "characterization": cmask}
+def create_masked_datapackage_with_offset(project, masks, tag):
+    """Create datapackage that fixes inputs outside of `masks` to their static values, and the LCIA score offset."""
+    tmask, bmask, cmask = masks["technosphere"], masks["biosphere"], masks["characterization"]
+    dp = create_masked_vector_datapackage(project, ~tmask, ~bmask, ~cmask, tag)
     offset = get_lca_score_shift(project, masks)
-
     return dp, offset
 
 
+def create_noninf_datapackage(project, cutoff, max_calc, screening_method="sct"):
+    masks = get_noninf_masks(cutoff, max_calc, screening_method)
+    return create_masked_datapackage_with_offset(
+        project, masks, get_screening_method_tag("without_noninf", screening_method)
+    )
+
+
+def create_lowinf_lsa_datapackage(project, factor, cutoff, max_calc, num_lowinf, screening_method="sct"):
+    masks = get_lowinf_lsa_masks(factor, cutoff, max_calc, num_lowinf, screening_method)
+    return create_masked_datapackage_with_offset(
+        project, masks, get_screening_method_tag(f"without_lowinf_lsa.{num_lowinf}", screening_method)
+    )
+
+
+def create_lowinf_xgb_datapackage(project, num_lowinf, xgb_model_tag, correlations):
+    masks = get_lowinf_xgb_masks(num_lowinf, xgb_model_tag, correlations)
+    return create_masked_datapackage_with_offset(project, masks, f"without_lowinf_xgb.{num_lowinf}")
+
+
 def run_mc_simulations_masked(
-        project, fp_ecoinvent, datapackage_masked, iterations, seed=42, tag="", correlations=True
+        project, fp_ecoinvent, datapackage_masked, iterations, seed=42, tag="", correlations=True, solver="direct",
+        solver_options=None, convergence=None, sampling_method="random", control_variates=False,
 ):
-    """Run Monte Carlo simulations without non-influential inputs, but with all sampling modules."""
+    """
+    Run Monte Carlo simulations without non-influential inputs, but with all sampling modules.
+
+    Only few technosphere exchanges vary in reduced models, so `solver="woodbury"` is usually much faster than
+    refactorizing the technosphere matrix in each iteration, see `akula.solvers.WoodburyLCA`.
+
+    If a `convergence` monitor is given, simulations stop once the target precision is reached, and `iterations` is
+    only the maximum number of MC iterations, see `akula.convergence.ConvergenceMonitor`. Background inputs are sampled
+    with `sampling_method`, see `akula.qmc`.
+
+    If `control_variates` is True, return LCIA scores and their control variate estimates, see
+    `get_control_variate_estimates_masked`.
+    """
 
     directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
+    tag = get_scores_tag(tag, sampling_method, convergence)
     fp = directory / f"scores.{tag}.{seed}.{iterations}.pickle"
 
     if fp.exists():
+        # Scores of older runs
         scores = read_pickle(fp)
     else:
         datapackages = [datapackage_masked]
@@ -185,34 +248,204 @@ def run_mc_simulations_masked(
             datapackages_sampling_modules = create_all_datapackages(fp_ecoinvent, project, iterations, seed)
             datapackages += datapackages_sampling_modules
 
-        scores = compute_consumption_lcia(project, iterations, seed, datapackages)
+        scores = compute_consumption_lcia(
+            project, iterations, seed, datapackages, solver=solver, solver_options=solver_options,
+            store_dir=directory / f"scores.{tag}.{seed}.{iterations}", convergence=convergence,
+            sampling_method=sampling_method,
+        )
 
-        write_pickle(scores, fp)
+    if control_variates:
+        estimates = get_control_variate_estimates_masked(
+            project, fp_ecoinvent, datapackage_masked, scores, iterations, seed, tag, correlations, sampling_method
+        )
+        return scores, estimates
 
     return scores
 
 
-def run_mc_simulations_wo_noninf(project, fp_ecoinvent, cutoff, max_calc, iterations, seed, num_noninf, correlations):
-    datapackage_noninf, offset = create_noninf_datapackage(project, cutoff, max_calc)
-    tag = f"without_noninf.{num_noninf}"
-    scores = run_mc_simulations_masked(project, fp_ecoinvent, datapackage_noninf, iterations, seed, tag, correlations)
+def get_control_variate_estimates_masked(
+        project, fp_ecoinvent, datapackage_masked, scores, iterations, seed, tag, correlations,
+        sampling_method="random",
+):
+    """
+    Estimate mean, variance and percentiles of MC `scores` with the linearized LCA model as a control variate.
+
+    Linearized scores are computed for the same model inputs as `scores` without solving the technosphere system, see
+    `akula.control_variates`. Their expected value is known for inputs sampled from uncertainty distributions, which
+    reduces the variance of the estimates by the factor 1 - ρ^2, where ρ is the correlation between scores and
+    linearized scores. This requires random sampling of background inputs.
+    """
+    if sampling_method != "random":
+        raise ValueError("Control variates are only available for random sampling of background inputs")
+
+    directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
+    fp = directory / f"controls.{tag}.{seed}.{iterations}.pickle"
+
+    if fp.exists():
+        controls, control_mean = read_pickle(fp)
+    else:
+        datapackages = [] if datapackage_masked is None else [datapackage_masked]
+        if correlations:
+            datapackages += create_all_datapackages(fp_ecoinvent, project, iterations, seed)
+        controls, control_mean = compute_consumption_lcia_linearized(project, len(scores), seed, datapackages)
+        write_pickle((controls, control_mean), fp)
+
+    return get_control_variate_estimates(scores, controls, control_mean)
+
+
+def shift_estimates(estimates, offset):
+    """Add `offset` to the estimates of the mean and percentiles of LCIA scores."""
+    return {
+        key: value + offset if key == "mean" or key.startswith("p") else value for key, value in estimates.items()
+    }
+
+
+def run_mc_simulations_wo_noninf(
+    project, fp_ecoinvent, cutoff, max_calc, iterations, seed, num_noninf, correlations, solver="direct",
+    solver_options=None, screening_method="sct", convergence=None, sampling_method="random", control_variates=False,
+):
+    datapackage_noninf, offset = create_noninf_datapackage(project, cutoff, max_calc, screening_method)
+    tag = get_screening_method_tag(f"without_noninf.{num_noninf}", screening_method)
+    scores = run_mc_simulations_masked(
+        project, fp_ecoinvent, datapackage_noninf, iterations, seed, tag, correlations, solver, solver_options,
+        convergence, sampling_method, control_variates,
+    )
+    if control_variates:
+        scores, estimates = scores
+        return np.array(scores) + offset, shift_estimates(estimates, offset)
     scores = np.array(scores) + offset
     return scores
 
 
 def run_mc_simulations_wo_lowinf_lsa(
-    project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations
+    project, fp_ecoinvent, factor, cutoff, max_calc, iterations, seed, num_lowinf, correlations, solver="direct",
+    solver_options=None, screening_method="sct", convergence=None, sampling_method="random", control_variates=False,
 ):
-    datapackage_lowinf, offset = create_lowinf_lsa_datapackage(project, factor, cutoff, max_calc, num_lowinf)
-    tag = f"without_lowinf_lsa.{num_lowinf}"
-    scores = run_mc_simulations_masked(project, fp_ecoinvent, datapackage_lowinf, iterations, seed, tag, correlations)
+    datapackage_lowinf, offset = create_lowinf_lsa_datapackage(
+        project, factor, cutoff, max_calc, num_lowinf, screening_method
+    )
+    tag = get_screening_method_tag(f"without_lowinf_lsa.{num_lowinf}", screening_method)
+    scores = run_mc_simulations_masked(
+        project, fp_ecoinvent, datapackage_lowinf, iterations, seed, tag, correlations, solver, solver_options,
+        convergence, sampling_method, control_variates,
+    )
+    if control_variates:
+        scores, estimates = scores
+        return np.array(scores) + offset, shift_estimates(estimates, offset)
     scores = np.array(scores) + offset
     return scores
 
 
-def run_mc_simulations_wo_lowinf_xgb(project, fp_ecoinvent, xgb_model_tag, iterations, seed, num_lowinf, correlations):
+def run_mc_simulations_wo_lowinf_xgb(
+    project, fp_ecoinvent, xgb_model_tag, iterations, seed, num_lowinf, correlations, solver="direct",
+    solver_options=None, convergence=None, sampling_method="random", control_variates=False,
+):
     datapackage_lowinf, offset = create_lowinf_xgb_datapackage(project, num_lowinf, xgb_model_tag, correlations)
     tag = f"without_lowinf_xgb.model_{xgb_model_tag}.{num_lowinf}"
-    scores = run_mc_simulations_masked(project, fp_ecoinvent, datapackage_lowinf, iterations, seed, tag, correlations)
+    scores = run_mc_simulations_masked(
+        project, fp_ecoinvent, datapackage_lowinf, iterations, seed, tag, correlations, solver, solver_options,
+        convergence, sampling_method, control_variates,
+    )
+    if control_variates:
+        scores, estimates = scores
+        return np.array(scores) + offset, shift_estimates(estimates, offset)
     scores = np.array(scores) + offset
     return scores
+
+
+def get_static_resets(lca, masks):
+    """
+    Return positions in matrix data and static values of inputs that are fixed in a masked scenario.
+
+    Inputs outside of `masks` are fixed to their static values, unless they are overwritten by later datapackages, e.g.
+    by sampling modules, which is the same as appending a masked vector datapackage before sampling modules.
+    """
+    resets = {}
+    for matrix_type, mask in masks.items():
+        if mask is None:
+            continue
+        mapped_matrix = getattr(lca, f"{matrix_type}_mm")
+        matrix = mapped_matrix.matrix
+        k = [group.label for group in mapped_matrix.groups].index(LABELS_DICT[matrix_type])
+        group = mapped_matrix.groups[k]
+
+        fixed = group.apply_masks(~mask)
+        static = group.apply_masks(group.get_resource_by_suffix("data")).astype(float)
+        try:
+            static[group.flip] *= -1
+        except KeyError:
+            # No flip array
+            pass
+        positions = get_csr_positions(matrix, group.row_masked[fixed], group.col_masked[fixed])
+
+        overwritten = np.zeros(matrix.nnz, dtype=bool)
+        for later_group in mapped_matrix.groups[k + 1:]:
+            if not (later_group.empty or later_group.package.metadata["sum_inter_duplicates"]):
+                overwritten[get_csr_positions(matrix, later_group.row_masked, later_group.col_masked)] = True
+        keep = ~overwritten[positions]
+        resets[matrix_type] = (positions[keep], static[fixed][keep])
+
+    return resets
+
+
+def run_mc_simulations_crn(
+        project, fp_ecoinvent, scenarios, iterations, seed=42, correlations=True, solver="direct", solver_options=None,
+):
+    """
+    Run Monte Carlo simulations for several masked scenarios with common random numbers.
+
+    `scenarios` maps scenario names to dictionaries with technosphere, biosphere and characterization masks of inputs
+    that vary, e.g. from `get_noninf_masks`, or to None if all inputs vary. Inputs are sampled once per iteration, and
+    each scenario is solved after fixing its masked inputs to static values. Scores of all scenarios are therefore
+    paired by iteration, and differences between scenarios are much less noisy than with independent simulations.
+
+    Return dictionary with LCIA scores of each scenario, including the offset from `get_lca_score_shift`.
+    """
+    directory = GSA_DIR_CORR if correlations else GSA_DIR_INDP
+    fps = {name: directory / f"scores.crn.{name}.{seed}.{iterations}.pickle" for name in scenarios}
+    all_inputs = {"technosphere": None, "biosphere": None, "characterization": None}
+    scenarios = {name: all_inputs if masks is None else masks for name, masks in scenarios.items()}
+
+    if all(fp.exists() for fp in fps.values()):
+        scores = {name: read_pickle(fp) for name, fp in fps.items()}
+
+    else:
+        datapackages = create_all_datapackages(fp_ecoinvent, project, iterations, seed) if correlations else None
+        fu, data_objs = get_consumption_lca_inputs(project, datapackages)
+
+        lca = get_lca_class(solver)(
+            demand=fu,
+            data_objs=data_objs,
+            use_arrays=True,
+            use_distributions=True,
+            seed_override=seed,
+            **(solver_options or dict()),
+        )
+        lca.lci()
+        lca.lcia()
+
+        resets = {name: get_static_resets(lca, masks) for name, masks in scenarios.items()}
+        mapped_matrices = [getattr(lca, f"{matrix_type}_mm") for matrix_type in all_inputs]
+
+        scores = {name: [] for name in scenarios}
+        for _ in range(iterations):
+            # Same samples as in each iteration of `compute_consumption_lcia`
+            advance_lca(lca, 1)
+            sampled_data = [mapped_matrix.matrix.data.copy() for mapped_matrix in mapped_matrices]
+            for name, reset in resets.items():
+                for matrix_type, (positions, static) in reset.items():
+                    data = getattr(lca, f"{matrix_type}_mm").matrix.data
+                    data[positions] = 0
+                    np.add.at(data, positions, static)
+                lca.lci_calculation()
+                lca.lcia_calculation()
+                scores[name].append(lca.score)
+                for mapped_matrix, data in zip(mapped_matrices, sampled_data):
+                    mapped_matrix.matrix.data[:] = data
+
+        for name, fp in fps.items():
+            write_pickle(scores[name], fp)
+
+    scores = {name: np.array(scores[name]) + get_lca_score_shift(project, masks) for name, masks in scenarios.items()}
+
+    return scores
@@ -0,0 +1,132 @@
+import numpy as np
+import bw2data as bd
+import stats_arrays as sa
+from pathlib import Path
+
+from .remove_lowly_influential import get_sensitivities
+from ..utils import read_pickle, write_pickle, get_lca, get_project_tag, get_adjoint, METHOD
+
+GSA_DIR = Path(__file__).parent.parent.parent.resolve() / "data" / "sensitivity-analysis"
+
+MATRIX_TYPES = ("technosphere", "biosphere", "characterization")
+
+
+def get_distribution_variances(distributions):
+    """Return variances of stats_arrays uncertainty distributions, which are zero for inputs without uncertainty."""
+    variances = np.zeros(len(distributions))
+    types = distributions["uncertainty_type"]
+    loc, scale = distributions["loc"], distributions["scale"]
+    a, b = distributions["minimum"], distributions["maximum"]
+
+    lognormal = types == sa.LognormalUncertainty.id
+    variances[lognormal] = ((np.exp(scale ** 2) - 1) * np.exp(2 * loc + scale ** 2))[lognormal]
+
+    normal = types == sa.NormalUncertainty.id
+    variances[normal] = scale[normal] ** 2
+
+    triangular = types == sa.TriangularUncertainty.id
+    variances[triangular] = ((a ** 2 + b ** 2 + loc ** 2 - a * b - a * loc - b * loc) / 18)[triangular]
+
+    uniform = types == sa.UniformUncertainty.id
+    variances[uniform] = ((b - a) ** 2 / 12)[uniform]
+
+    other = ~(lognormal | normal | triangular | uniform) & (types > sa.NoUncertainty.id)
+    if np.any(other):
+        print(f"Variances of {other.sum()} inputs with uncertainty types {set(types[other])} are not propagated")
+
+    return variances
+
+
+def get_ecoinvent_lcia_resources(project):
+    """Return indices, data, distributions and flip arrays of ecoinvent TECH, BIO and CF inputs, ordered as masks."""
+    bd.projects.set_current(project)
+    ei = bd.Database("ecoinvent 3.8 cutoff").datapackage()
+    tei = ei.filter_by_attribute('matrix', 'technosphere_matrix')
+    bei = ei.filter_by_attribute('matrix', 'biosphere_matrix')
+    cf = bd.Method(METHOD).datapackage()
+    cf_name = "IPCC_2013_climate_change_GWP_100a_uncertain_matrix_data"
+    resources = {
+        "technosphere": {
+            "indices": tei.get_resource('ecoinvent_3.8_cutoff_technosphere_matrix.indices')[0],
+            "data": tei.get_resource('ecoinvent_3.8_cutoff_technosphere_matrix.data')[0],
+            "distributions": tei.get_resource('ecoinvent_3.8_cutoff_technosphere_matrix.distributions')[0],
+            "flip": tei.get_resource('ecoinvent_3.8_cutoff_technosphere_matrix.flip')[0],
+        },
+        "biosphere": {
+            "indices": bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.indices')[0],
+            "data": bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.data')[0],
+            "distributions": bei.get_resource('ecoinvent_3.8_cutoff_biosphere_matrix.distributions')[0],
+        },
+        "characterization": {
+            "indices": cf.get_resource(f"{cf_name}.indices")[0],
+            "data": cf.get_resource(f"{cf_name}.data")[0],
+            "distributions": cf.get_resource(f"{cf_name}.distributions")[0],
+        },
+    }
+    return resources
+
+
+def get_first_order_variances(project):
+    """
+    Compute contributions of TECH, BIO and CF inputs to the variance of the LCIA score with first-order propagation.
+
+    The contribution of input x_k is (∂score/∂x_k)^2 Var(x_k), where derivatives are computed from one deterministic
+    LCA with `get_sensitivities`. Inputs are assumed to be independent. Contributions are returned in the same order
+    as the masks of inputs, and cached per `project` and LCIA method.
+    """
+
+    fp = GSA_DIR / f"variances.first_order.{get_project_tag(project)}.pickle"
+
+    if fp.exists():
+        variances = read_pickle(fp)
+    else:
+        lca = get_lca(project)
+        lca.lci()
+        lca.lcia()
+
+        adjoint = get_adjoint(lca)
+        resources = get_ecoinvent_lcia_resources(project)
+        variances = {}
+        for matrix_type in MATRIX_TYPES:
+            sensitivities = get_sensitivities(
+                lca, matrix_type, resources[matrix_type]["indices"], resources[matrix_type].get("flip"), adjoint
+            )
+            distributions = resources[matrix_type]["distributions"]
+            variances[matrix_type] = sensitivities ** 2 * get_distribution_variances(distributions)
+
+        write_pickle(variances, fp)
+
+    return variances
+
+
+def get_explained_variance(project, masks):
+    """
+    Estimate which fraction of the LCIA score variance is carried by inputs that vary in `masks`.
+
+    `masks` has TECH, BIO and CF masks of inputs that vary, e.g. from `get_lowinf_lsa_masks`, where None means that all
+    inputs vary. This is a quick check of a mask before validating it with Monte Carlo simulations.
+    """
+    variances = get_first_order_variances(project)
+    total = sum(contributions.sum() for contributions in variances.values())
+
+    explained = {}
+    for matrix_type in MATRIX_TYPES:
+        mask = masks.get(matrix_type)
+        contributions = variances[matrix_type]
+        explained[matrix_type] = contributions.sum() if mask is None else contributions[mask].sum()
+
+    fraction = sum(explained.values()) / total
+    dict_ = {
+        "total_variance": total,
+        "explained_variance": sum(explained.values()),
+        "explained_fraction": fraction,
+        "removed_fraction": 1 - fraction,
+    }
+    dict_.update({f"{matrix_type}_fraction": explained[matrix_type] / total for matrix_type in MATRIX_TYPES})
+
+    print(
+        f"Inputs in masks explain {100 * fraction:6.2f}% of the first-order variance of LCIA scores -- "
+        + ", ".join(f"{matrix_type} {100 * dict_[f'{matrix_type}_fraction']:6.2f}%" for matrix_type in MATRIX_TYPES)
+    )
+
+    return dict_
@@ -0,0 +1,129 @@
+import numpy as np
+import xgboost as xgb
+
+from .feature_store import FeatureStore, ROW_BLOCK_SIZE, MANIFEST_NAME
+
+EDGES_NAME = "edges.npy"
+
+# Number of quantile bins of each feature, codes of bins are stored as uint8
+MAX_BIN = 256
+# Number of MC iterations that are used to compute quantiles of features
+QUANTILE_SAMPLE_SIZE = 5_000
+# Number of features for which quantiles are computed at once
+QUANTILE_COLUMN_BLOCK_SIZE = 1_000
+
+
+def get_bin_edges(store, max_bin=MAX_BIN, sample_size=QUANTILE_SAMPLE_SIZE):
+    """
+    Compute upper edges of `max_bin` quantile bins of each feature in `store` from evenly spaced rows.
+
+    Returns array with shape ``(num_features, max_bin)``. Quantiles are computed for blocks of columns, so that the
+    sample is never loaded into memory as a whole.
+    """
+    step = max(store.num_iterations // sample_size, 1)
+    features = store.features[::step]
+    q = np.linspace(0, 1, max_bin + 1)[1:]
+    edges = np.zeros((store.num_features, max_bin))
+    for start in range(0, store.num_features, QUANTILE_COLUMN_BLOCK_SIZE):
+        end = min(start + QUANTILE_COLUMN_BLOCK_SIZE, store.num_features)
+        edges[start:end] = np.quantile(np.array(features[:, start:end]), q, axis=0).T
+    return edges
+
+
+def quantize(data, edges):
+    """Return uint8 codes of quantile bins of `data`, with one row per MC iteration and one column per feature."""
+    codes = np.empty(data.shape, dtype=np.uint8)
+    last = edges.shape[1] - 1
+    for j in range(data.shape[1]):
+        codes[:, j] = np.minimum(np.searchsorted(edges[j], data[:, j], side="left"), last)
+    return codes
+
+
+def dequantize(codes, edges):
+    """Replace codes of quantile bins with upper edges of the bins, as float32 for XGBoost."""
+    return edges[np.arange(edges.shape[0]), codes].astype(np.float32)
+
+
+def read_dequantized(qstore, start=0, stop=None, edges=None):
+    """
+    Read rows from `start` to `stop` of a quantized feature store as upper edges of their bins.
+
+    Models that are trained on quantized features only saw these values, so predictions and SHAP values of such models
+    must be computed on them, and not on the original features.
+    """
+    edges = np.load(qstore.directory / EDGES_NAME) if edges is None else edges
+    return dequantize(qstore.read(start, stop), edges)
+
+
+def get_quantized_store(store, directory, max_bin=MAX_BIN):
+    """
+    Return store of features from `store` quantized into `max_bin` quantile bins, see `FeatureStore`.
+
+    Codes of bins are written as uint8 next to the bin edges in `directory`, so that the quantized matrix takes 1 byte
+    per value, and is reused by all XGBoost models that are trained on the same features. Quantization is done block by
+    block of rows, and is resumed from the last block that was written to disk.
+    """
+    if max_bin > 256:
+        raise ValueError("Codes of bins are stored as uint8, `max_bin` must be at most 256")
+    if (directory / MANIFEST_NAME).exists():
+        qstore = FeatureStore(directory, store.num_iterations)
+        if qstore.complete:
+            return qstore
+        edges = np.load(directory / EDGES_NAME)
+    else:
+        edges = get_bin_edges(store, max_bin)
+        qstore = FeatureStore(directory, store.num_iterations, store.get_indices(), store.get_masks(), np.uint8)
+        np.save(directory / EDGES_NAME, edges)
+
+    for start in range(0, store.num_iterations, ROW_BLOCK_SIZE):
+        if qstore.has_batch(start):
+            continue
+        end = min(start + ROW_BLOCK_SIZE, store.num_iterations)
+        print(f"Quantizing features of rows {start}-{end}")
+        qstore.write_batch(start, quantize(store.read(start, end), edges).T)
+    return qstore
+
+
+class FeatureIterator(xgb.DataIter):
+    """
+    Feed rows from `start` to `stop` of a quantized feature store and labels `Y` to XGBoost in blocks of rows.
+
+    Used to build an external memory ``DMatrix`` whose pages are cached with `cache_prefix`, so that only one block of
+    rows is held in memory during training.
+    """
+    def __init__(self, qstore, Y, start, stop, cache_prefix, block_size=ROW_BLOCK_SIZE):
+        self.qstore = qstore
+        self.edges = np.load(qstore.directory / EDGES_NAME)
+        self.Y = Y
+        self.starts = list(range(start, stop, block_size))
+        self.stop = stop
+        self.block_size = block_size
+        self.current = 0
+        super().__init__(cache_prefix=str(cache_prefix))
+
+    def next(self, input_data):
+        if self.current == len(self.starts):
+            return 0
+        start = self.starts[self.current]
+        end = min(start + self.block_size, self.stop)
+        input_data(data=read_dequantized(self.qstore, start, end, self.edges), label=self.Y[start:end])
+        self.current += 1
+        return 1
+
+    def reset(self):
+        self.current = 0
+
+
+def get_external_dmatrix(qstore, Y, start, stop, cache_prefix):
+    """Return external memory ``DMatrix`` with rows from `start` to `stop` of the quantized feature store."""
+    cache_prefix.parent.mkdir(parents=True, exist_ok=True)
+    return xgb.DMatrix(FeatureIterator(qstore, Y, start, stop, cache_prefix))
+
+
+def predict_in_blocks(model, qstore, start, stop, block_size=ROW_BLOCK_SIZE):
+    """Predict scores of rows from `start` to `stop` of a quantized feature store, one block of rows at a time."""
+    edges = np.load(qstore.directory / EDGES_NAME)
+    return np.hstack([
+        model.predict(xgb.DMatrix(read_dequantized(qstore, block_start, min(block_start + block_size, stop), edges)))
+        for block_start in range(start, stop, block_size)
+    ])
@@ -0,0 +1,281 @@
+import inspect
+import numpy as np
+import bw2calc as bc
+from scipy.sparse.linalg import splu, spilu, bicgstab, gmres, LinearOperator
+
+from .utils import get_csr_positions
+
+try:
+    from pypardiso import PyPardisoSolver
+    PYPARDISO = True
+except ImportError:
+    PyPardisoSolver = None
+    PYPARDISO = False
+
+# Pardiso phases, see https://www.intel.com/content/www/us/en/docs/onemkl/developer-reference-c/pardiso.html
+PARDISO_ANALYSIS = 11
+PARDISO_FACTORIZATION_SOLVE = 23
+
+KRYLOV_METHODS = {
+    "bicgstab": bicgstab,
+    "gmres": gmres,
+}
+# Relative tolerance keyword was renamed from `tol` to `rtol` in scipy 1.12
+KRYLOV_TOLERANCE_KWARG = "rtol" if "rtol" in inspect.signature(bicgstab).parameters else "tol"
+
+
+def get_permuted_csc_order(matrix, permutation):
+    """
+    Return positions in `matrix.data` such that `matrix[:, permutation].tocsc().data == matrix.data[positions]`.
+
+    Works as long as the sparsity pattern of `matrix` does not change.
+    """
+    positions = matrix.copy()
+    # Shift by one to make sure that no explicit zeros are dropped
+    positions.data = np.arange(1, matrix.nnz + 1, dtype=np.float64)
+    positions = positions[:, permutation].tocsc()
+    return positions.data.astype(np.int64) - 1
+
+
+def solve_multiple_demands(technosphere_matrix, demand_matrix):
+    """Solve technosphere system for all columns of `demand_matrix` with one factorization."""
+    if PYPARDISO:
+        return PyPardisoSolver().solve(technosphere_matrix, demand_matrix)
+    return splu(technosphere_matrix.tocsc()).solve(demand_matrix)
+
+
+class RefactorizingLCA(bc.LCA):
+    """
+    LCA that reuses the fill-reducing ordering and symbolic factorization of the technosphere matrix.
+
+    In Monte Carlo simulations the sparsity pattern of the technosphere matrix stays the same, and only its values
+    change. The ordering and symbolic analysis are computed once, at the first solve, and all subsequent solves only
+    redo the numerical factorization.
+
+    With pypardiso, phase 11 (reordering and symbolic factorization) is called once, and phase 23 (numerical
+    factorization and solve) in each iteration. Without pypardiso, the column permutation found by SuperLU at the
+    first solve is applied to the technosphere matrix in all subsequent solves, and the factorization is done with
+    natural ordering.
+
+    """
+    def solve_linear_system(self):
+        if hasattr(self, "solver"):
+            # Technosphere was explicitly factorized with `decompose_technosphere`
+            return super().solve_linear_system()
+        if PYPARDISO:
+            return self.solve_pardiso()
+        else:
+            return self.solve_superlu()
+
+    def solve_pardiso(self):
+        if not hasattr(self, "pardiso_solver"):
+            self.pardiso_solver = PyPardisoSolver()
+            # Checks format and sorts indices in place, sparsity pattern stays the same between iterations
+            self.pardiso_solver._check_A(self.technosphere_matrix)
+            self.pardiso_solver.set_phase(PARDISO_ANALYSIS)
+            self.pardiso_solver._call_pardiso(self.technosphere_matrix, self.demand_array)
+        self.pardiso_solver.set_phase(PARDISO_FACTORIZATION_SOLVE)
+        return self.pardiso_solver._call_pardiso(self.technosphere_matrix, self.demand_array)
+
+    def solve_superlu(self):
+        if not hasattr(self, "column_permutation"):
+            lu = splu(self.technosphere_matrix.tocsc())
+            self.column_permutation = lu.perm_c
+            self.permuted_positions = get_permuted_csc_order(self.technosphere_matrix, self.column_permutation)
+            self.permuted_matrix = self.technosphere_matrix[:, self.column_permutation].tocsc()
+            return lu.solve(self.demand_array)
+        self.permuted_matrix.data = self.technosphere_matrix.data[self.permuted_positions]
+        lu = splu(self.permuted_matrix, permc_spec="NATURAL")
+        permuted_supply = lu.solve(self.demand_array)
+        supply = np.empty_like(permuted_supply)
+        supply[self.column_permutation] = permuted_supply
+        return supply
+
+
+class IterativeLCA(bc.LCA):
+    """
+    LCA that solves the technosphere system with a preconditioned Krylov method, warm-started from the previous supply.
+
+    The first solve is direct, and the incomplete LU of the first technosphere matrix is used as preconditioner in all
+    subsequent solves. Each solve starts from the supply array of the previous iteration, which is usually close to the
+    new solution. If the Krylov method does not converge within `maxiter` iterations to the relative tolerance `rtol`,
+    the system is solved directly, and the number of such fallbacks is stored in `num_fallbacks`.
+
+    """
+    def __init__(
+            self, *args, krylov_method="bicgstab", rtol=1e-8, maxiter=100, drop_tol=1e-4, fill_factor=10, **kwargs
+    ):
+        if krylov_method not in KRYLOV_METHODS:
+            raise ValueError(f"Unknown Krylov method {krylov_method}, possible options are {list(KRYLOV_METHODS)}")
+        super().__init__(*args, **kwargs)
+        self.krylov_method = krylov_method
+        self.rtol = rtol
+        self.maxiter = maxiter
+        self.drop_tol = drop_tol
+        self.fill_factor = fill_factor
+        self.num_fallbacks = 0
+
+    def solve_linear_system(self):
+        if hasattr(self, "solver"):
+            # Technosphere was explicitly factorized with `decompose_technosphere`
+            return super().solve_linear_system()
+        if not hasattr(self, "preconditioner"):
+            ilu = spilu(self.technosphere_matrix.tocsc(), drop_tol=self.drop_tol, fill_factor=self.fill_factor)
+            self.preconditioner = LinearOperator(self.technosphere_matrix.shape, ilu.solve)
+            self.previous_supply = super().solve_linear_system()
+            return self.previous_supply
+        solve = KRYLOV_METHODS[self.krylov_method]
+        supply, info = solve(
+            self.technosphere_matrix,
+            self.demand_array,
+            x0=self.previous_supply,
+            M=self.preconditioner,
+            maxiter=self.maxiter,
+            **{KRYLOV_TOLERANCE_KWARG: self.rtol},
+        )
+        if info != 0:
+            self.num_fallbacks += 1
+            supply = super().solve_linear_system()
+        self.previous_supply = supply
+        return supply
+
+
+def get_stochastic_mask(group):
+    """Return boolean mask of the elements of a resource `group` that can change between Monte Carlo iterations."""
+    size = len(group.row_masked)
+    if group.is_array():
+        return np.ones(size, dtype=bool)
+    if group.use_distributions and group.has_distributions:
+        # Uncertainty types 0 and 1 are undefined and no uncertainty
+        return group.apply_masks(group.data_original)["uncertainty_type"] > 1
+    return np.zeros(size, dtype=bool)
+
+
+def get_varying_positions(mapped_matrix):
+    """Return positions in `mapped_matrix.matrix.data` that can change between Monte Carlo iterations."""
+    matrix = mapped_matrix.matrix
+    varying = np.zeros(matrix.nnz, dtype=bool)
+    for group in mapped_matrix.groups:
+        if group.empty:
+            continue
+        positions = get_csr_positions(matrix, group.row_masked, group.col_masked)
+        if not group.package.metadata["sum_inter_duplicates"]:
+            # Values of this group overwrite values of all previous groups
+            varying[positions] = False
+        np.logical_or.at(varying, positions, get_stochastic_mask(group))
+    return np.where(varying)[0]
+
+
+class WoodburyLCA(bc.LCA):
+    """
+    LCA that factorizes the technosphere matrix once, and solves all subsequent iterations with a low-rank update.
+
+    Varying positions of the technosphere matrix are found from the resource groups of `technosphere_mm`: elements
+    with uncertainty distributions or data arrays that are not overwritten by static values of later groups. The first
+    technosphere matrix A0 is factorized, and the change ΔA = U Δ V^T in each subsequent iteration is restricted to
+    the rows U and columns V of varying positions. The solution is obtained with the Sherman-Morrison-Woodbury formula
+
+        x = x0 - A0^{-1} U (I + Δ M)^{-1} Δ V^T x0,  where  x0 = A0^{-1} b  and  M = V^T A0^{-1} U,
+
+    so that each iteration only needs a dense solve of the size of the rank, and triangular solves with the LU factors
+    of A0. `M` is computed once from min(rank of U, rank of V) solves.
+
+    If the rank exceeds `max_rank`, the low-rank update is disabled and each iteration is solved directly. Iterations
+    where the technosphere matrix changes outside of the varying positions, or where the small system is singular, are
+    also solved directly, and counted in `num_fallbacks`.
+
+    """
+    def __init__(self, *args, max_rank=2000, block_size=100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_rank = max_rank
+        self.block_size = block_size
+        self.num_fallbacks = 0
+
+    def solve_linear_system(self):
+        if hasattr(self, "solver"):
+            # Technosphere was explicitly factorized with `decompose_technosphere`
+            return super().solve_linear_system()
+        if not hasattr(self, "low_rank"):
+            return self.factorize_reference()
+        if not self.low_rank:
+            return super().solve_linear_system()
+        return self.solve_low_rank()
+
+    def factorize_reference(self):
+        """Factorize first technosphere matrix and precompute the matrix `M` of the Woodbury formula."""
+        matrix = self.technosphere_matrix
+        positions = get_varying_positions(self.technosphere_mm)
+        matrix_rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        self.unique_rows, self.row_inverse = np.unique(matrix_rows[positions], return_inverse=True)
+        self.unique_cols, self.col_inverse = np.unique(matrix.indices[positions], return_inverse=True)
+        rank = min(len(self.unique_rows), len(self.unique_cols))
+        self.low_rank = rank <= self.max_rank
+        if not self.low_rank:
+            print(f"Rank of technosphere updates {rank} is larger than {self.max_rank}, using direct solver")
+            return super().solve_linear_system()
+
+        self.varying_positions = positions
+        self.static_mask = np.ones(matrix.nnz, dtype=bool)
+        self.static_mask[positions] = False
+        self.reference_data = matrix.data.copy()
+        self.reference_lu = splu(matrix.tocsc())
+
+        n, num_rows, num_cols = matrix.shape[0], len(self.unique_rows), len(self.unique_cols)
+        self.woodbury_matrix = np.zeros((num_cols, num_rows))
+        if num_rows <= num_cols:
+            for start in range(0, num_rows, self.block_size):
+                rows = self.unique_rows[start:start + self.block_size]
+                rhs = np.zeros((n, len(rows)))
+                rhs[rows, np.arange(len(rows))] = 1
+                solution = self.reference_lu.solve(rhs)
+                self.woodbury_matrix[:, start:start + len(rows)] = solution[self.unique_cols, :]
+        else:
+            for start in range(0, num_cols, self.block_size):
+                cols = self.unique_cols[start:start + self.block_size]
+                rhs = np.zeros((n, len(cols)))
+                rhs[cols, np.arange(len(cols))] = 1
+                solution = self.reference_lu.solve(rhs, trans="T")
+                self.woodbury_matrix[start:start + len(cols), :] = solution[self.unique_rows, :].T
+
+        return self.reference_lu.solve(self.demand_array)
+
+    def solve_low_rank(self):
+        """Solve technosphere system with the Sherman-Morrison-Woodbury update of the reference factorization."""
+        delta = self.technosphere_matrix.data - self.reference_data
+        if np.any(delta[self.static_mask]):
+            self.num_fallbacks += 1
+            return super().solve_linear_system()
+
+        num_rows, num_cols = len(self.unique_rows), len(self.unique_cols)
+        delta_small = np.zeros((num_rows, num_cols))
+        np.add.at(delta_small, (self.row_inverse, self.col_inverse), delta[self.varying_positions])
+
+        x0 = self.reference_lu.solve(self.demand_array)
+        correction = np.zeros_like(x0)
+        try:
+            if num_rows <= num_cols:
+                lhs = np.eye(num_rows) + delta_small @ self.woodbury_matrix
+                correction[self.unique_rows] = np.linalg.solve(lhs, delta_small @ x0[self.unique_cols])
+            else:
+                lhs = np.eye(num_cols) + self.woodbury_matrix @ delta_small
+                correction[self.unique_rows] = delta_small @ np.linalg.solve(lhs, x0[self.unique_cols])
+        except np.linalg.LinAlgError:
+            self.num_fallbacks += 1
+            return super().solve_linear_system()
+        return x0 - self.reference_lu.solve(correction)
+
+
+LCA_SOLVERS = {
+    "direct": bc.LCA,
+    "refactorize": RefactorizingLCA,
+    "iterative": IterativeLCA,
+    "woodbury": WoodburyLCA,
+}
+
+
+def get_lca_class(solver="direct"):
+    """Return LCA class for the given `solver` name, see `LCA_SOLVERS` for possible options."""
+    try:
+        return LCA_SOLVERS[solver]
+    except KeyError:
+        raise ValueError(f"Unknown solver {solver}, possible options are {list(LCA_SOLVERS)}")
@@ -1,3 +1,6 @@
+import re
+import json
+import hashlib
 import numpy as np
 import bw2data as bd
 import bw2calc as bc
@@ -9,6 +12,9 @@ import pandas as pd
 import country_converter as coco
 import logging
 from pathlib import Path
+from scipy.sparse.linalg import spsolve
+
+from .instrumentation import phase
 
 COLOR_GRAY_HEX = "#b2bcc0"
 COLOR_DARKGRAY_HEX = "#485063"
@@ -28,6 +34,15 @@ LABELS_DICT = {
 
 DATA_DIR = Path(__file__).parent.parent.resolve() / "data"
 
+METHOD = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
+
+
+def get_project_tag(project, method=METHOD):
+    """Return tag of cached results with the `project` name, and a short hash of the LCIA `method`."""
+    project_tag = re.sub(r"[^A-Za-z0-9]+", "-", project).strip("-")
+    method_tag = hashlib.sha256(json.dumps(list(method)).encode()).hexdigest()[:8]
+    return f"{project_tag}.{method_tag}"
+
 
 def get_consumption_activity():
     co = bd.Database('swiss consumption 1.0')
@@ -36,18 +51,25 @@ def get_consumption_activity():
     return activity[0]
 
 
-def get_lca(project):
+def get_consumption_sectors(years="121314"):
+    """Return all sectors of the Swiss household consumption for the given `years`, sorted by name."""
+    co = bd.Database('swiss consumption 1.0')
+    sectors = sorted(
+        [act for act in co if "sector" in act['name'].lower() and years in act['name']], key=lambda act: act['name']
+    )
+    return sectors
+
+
+def get_lca(project, method=METHOD):
     bd.projects.set_current(project)
     act = get_consumption_activity()
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     lca = bc.LCA({act: 1}, method)
     return lca
 
 
-def get_fu_pkgs(project):
+def get_fu_pkgs(project, method=METHOD):
     bd.projects.set_current(project)
     act = get_consumption_activity()
-    method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
     fu_mapped, pkgs, _ = bd.prepare_lca_inputs(demand={act: 1}, method=method, remapping=False)
     return fu_mapped, pkgs
 
@@ -60,6 +82,18 @@ def compute_deterministic_score(project):
     return lca.score
 
 
+def get_adjoint(lca, lu=None):
+    """
+    Return solution λ of the adjoint system A^T λ = B^T c of a static `lca`, i.e. the LCIA score per unit of each
+    product, where c are diagonal elements of the characterization matrix. If `lu` is given, the factorized
+    technosphere matrix is reused.
+    """
+    characterized_biosphere = lca.biosphere_matrix.T @ lca.characterization_matrix.diagonal()
+    if lu is not None:
+        return lu.solve(characterized_biosphere, trans="T")
+    return spsolve(lca.technosphere_matrix.T.tocsc(), characterized_biosphere)
+
+
 def get_amounts_shift(lca, shift_median=True):
 
     dict_ = {}
@@ -236,17 +270,93 @@ def get_locations_ecoinvent():
 
 def write_pickle(data, filepath):
     """Write ``data`` to a file with .pickle extension"""
-    with open(filepath, "wb") as f:
+    with phase("pickling"), open(filepath, "wb") as f:
         pickle.dump(data, f)
 
 
 def read_pickle(filepath):
     """Read ``data`` from a file with .pickle extension"""
-    with open(filepath, "rb") as f:
+    with phase("pickling"), open(filepath, "rb") as f:
         data = pickle.load(f)
     return data
 
 
+def get_csr_positions(matrix, rows, cols):
+    """Return positions in ``matrix.data`` of the elements with given ``rows`` and ``cols`` of a sparse CSR matrix."""
+    matrix_rows = np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr))
+    keys = matrix_rows * matrix.shape[1] + matrix.indices
+    order = np.argsort(keys, kind="stable")
+    query = np.asarray(rows, dtype=np.int64) * matrix.shape[1] + np.asarray(cols, dtype=np.int64)
+    if len(query) == 0:
+        return np.array([], dtype=np.int64)
+    where = np.searchsorted(keys, query, sorter=order)
+    positions = order[np.minimum(where, len(keys) - 1)]
+    if np.any(keys[positions] != query):
+        raise ValueError("Some elements are not in the sparsity pattern of the matrix")
+    return positions
+
+
+def get_index_keys(*indices_arrays):
+    """
+    Return 64-bit keys of structured ``indices_arrays``, e.g. with ``bwp.INDICES_DTYPE`` or ``PARAMS_DTYPE``, that are
+    equal if and only if all fields of the indices are equal.
+
+    Integer fields of at most 32 bits are packed into keys directly, so that ``(row, col)`` pairs of
+    ``bwp.INDICES_DTYPE`` need no coding. Other fields, e.g. parameter names, are coded with integers shared by all
+    arrays.
+    """
+    arrays = [np.asarray(indices) for indices in indices_arrays]
+    keys = [np.zeros(len(indices), dtype=np.uint64) for indices in arrays]
+    num_bits = 0
+    for name in arrays[0].dtype.names:
+        fields = [indices[name] for indices in arrays]
+        dtype = fields[0].dtype
+        if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 4:
+            width = 8 * dtype.itemsize
+            mask = (1 << width) - 1
+            codes = [field.astype(np.int64) & mask for field in fields]
+        else:
+            _, inverse = np.unique(np.concatenate(fields), return_inverse=True)
+            width = max(int(inverse.max(initial=0)).bit_length(), 1)
+            codes = np.split(inverse.ravel(), np.cumsum([len(field) for field in fields])[:-1])
+        num_bits += width
+        if num_bits > 64:
+            raise ValueError(f"Fields of {arrays[0].dtype} do not fit into 64-bit keys")
+        keys = [(key << np.uint64(width)) | code.astype(np.uint64) for key, code in zip(keys, codes)]
+    return keys
+
+
+def join_indices(all_indices, use_indices):
+    """
+    Match structured ``use_indices`` with ``all_indices`` with sorted search in O((N+M) log N).
+
+    Returns:
+        * Mask of ``all_indices`` that is True for all indices that are in ``use_indices``
+        * Positions of ``use_indices`` in ``all_indices``, of the first match, or -1 for missing indices
+        * Missing ``use_indices``, that are not in ``all_indices``
+    """
+    all_indices = np.asarray(all_indices)
+    use_indices = np.array(use_indices, dtype=all_indices.dtype)
+    all_keys, use_keys = get_index_keys(all_indices, use_indices)
+    if len(all_keys) == 0:
+        return np.zeros(0, dtype=bool), np.full(len(use_keys), -1, dtype=np.int64), use_indices
+
+    order = np.argsort(all_keys, kind="stable")
+    where = np.minimum(np.searchsorted(all_keys, use_keys, sorter=order), len(all_keys) - 1)
+    found = all_keys[order[where]] == use_keys
+    positions = np.where(found, order[where], -1)
+    mask = np.isin(all_keys, use_keys)
+    return mask, positions, use_indices[~found]
+
+
+def get_index_positions(all_indices, use_indices):
+    """Return positions of ``use_indices`` in ``all_indices``, see ``join_indices``, and raise if some are missing."""
+    _, positions, missing = join_indices(all_indices, use_indices)
+    if len(missing):
+        raise ValueError(f"{len(missing)} indices are missing, e.g. {missing[0]}")
+    return positions
+
+
 def update_fig_axes(fig):
     fig.update_xaxes(
         showgrid=True,
@@ -3,7 +3,8 @@ import bw2calc as bc
 from pathlib import Path
 import sys
 
-from akula.utils import get_consumption_activity
+from akula.utils import get_consumption_activity, get_consumption_sectors
+from akula.monte_carlo import compute_multi_demand_lcia
 
 PROJECT = "GSA with correlations"
 PROJECT_EXIOBASE = "GSA with correlations, exiobase"
@@ -18,7 +19,6 @@ if __name__ == "__main__":
     bd.projects.set_current(project)
 
     method = ("IPCC 2013", "climate change", "GWP 100a", "uncertain")
-    co = bd.Database("swiss consumption 1.0")
 
     # LCIA for average consumption
     demand_act = get_consumption_activity()
@@ -27,13 +27,11 @@ if __name__ == "__main__":
     lca.lcia()
     print("{:8.3f}  {}".format(lca.score, demand_act['name']))
 
-    # LCIA for all Swiss consumption sectors
-    sectors = sorted([act for act in co if "sector" in act['name'].lower() and "121314" in act['name']])
-    for demand_act in sectors:
-        lca = bc.LCA({demand_act: 1}, method)
-        lca.lci()
-        lca.lcia()
-        print("{:8.3f}  {}".format(lca.score, demand_act['name']))
+    # LCIA for all Swiss consumption sectors, solved with one factorization of the technosphere matrix
+    sectors = get_consumption_sectors()
+    scores = compute_multi_demand_lcia(project, sectors)
+    for demand_act, score in zip(sectors, scores):
+        print("{:8.3f}  {}".format(score, demand_act['name']))
 
 # =============================================================================
 # LCIA results with ECOINVENT electricity data
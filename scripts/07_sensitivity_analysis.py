@@ -77,6 +77,7 @@ if __name__ == "__main__":
     # =========================================================================
     # 1. Remove NON-influential inputs
     # - Takes ~25 min for technosphere with cutoff=1e-7, max_calc=1e18
+    # - With screening_method="contributions" technosphere edges are screened in seconds for any cutoff
     # - Tweak CUTOFF and MAX_CALC to get the desired number of technosphere inputs based on validation results.
     # =========================================================================
     tmask_wo_noninf = get_tmask_wo_noninf(PROJECT, CUTOFF, MAX_CALC)
@@ -159,7 +160,8 @@ if __name__ == "__main__":
 
     # Validate results
     scores_wo_lowinf_xgb = run_mc_simulations_wo_lowinf_xgb(
-        PROJECT, FP_ECOINVENT, xgb_model_tag, ITERATIONS_VALIDATION, SEED, NUM_LOWINF_XGB, INCLUDE_CORR
+        PROJECT, FP_ECOINVENT, xgb_model_tag, ITERATIONS_VALIDATION, SEED, NUM_LOWINF_XGB, INCLUDE_CORR,
+        solver="woodbury",
     )
     figure = plot_lcia_scores_from_two_cases(scores_all, scores_wo_lowinf_xgb, exiobase_offset)
     figure.write_image(
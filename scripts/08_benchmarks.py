@@ -0,0 +1,13 @@
+from akula.benchmarks import run_mc_engine_benchmarks, run_sampling_module_benchmarks
+
+
+if __name__ == "__main__":
+    # =========================================================================
+    # 1. MC engine on synthetic projects, no ecoinvent license needed
+    # =========================================================================
+    report_mc_engine = run_mc_engine_benchmarks(sizes=(2_000, 5_000, 20_000), iterations=200, seed=42)
+
+    # =========================================================================
+    # 2. Datapackage generation of sampling modules on fixture data, runs offline
+    # =========================================================================
+    report_sampling_modules = run_sampling_module_benchmarks(num_samples=(100, 2_000, 20_000, 100_000), seed=42)
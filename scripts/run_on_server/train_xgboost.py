@@ -21,14 +21,9 @@ def read_pickle(filepath):
 
 
 def read_data(seed, test_size):
-    # Read X and Y data
+    # Read X and Y data, X is the memory-mapped file of `akula.sensitivity_analysis.get_feature_store`
     print("Reading data")
-    X1 = read_pickle("X_0_25.pickle")
-    X2 = read_pickle("X_25_50.pickle")
-    X3 = read_pickle("X_50_75.pickle")
-    # X4 = read_pickle("X_75_100.pickle")
-    X = np.vstack([X1, X2, X3])
-    del X1, X2, X3
+    X = np.load("features.222201.100000/features.npy", mmap_mode="r")[:75000]
     Y = read_pickle("scores.without_lowinf.25000.222201.100000.pickle")
     Y = np.array(Y)[:75000]
 